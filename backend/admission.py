@@ -0,0 +1,335 @@
+"""Admission control for the expensive routes.
+
+Every LLM- or sandbox-bound request is admitted before it does any work:
+
+* LLM calls spend a token from the caller's bucket and from one shared by
+  the whole worker, so one client looping on ``/ai`` can't use up the
+  upstream quota of a classroom
+* ``/run`` and ``/submit-solution`` need CPU-second credit; the CPU a run
+  actually used is charged afterwards, so one heavy program can overdraw
+  the balance but the next one waits until it refills
+* admitted requests then queue for one of ``ADMISSION_SLOTS`` work slots.
+  Interactive requests (``/ai``, ``/run``, agents) go before background ones
+  (``/generate-question``), and within a class callers with fewer requests
+  in flight go first.
+
+A request that can't be admitted fails fast with ``AdmissionRejected``,
+carrying the seconds after which a retry can succeed (the routes answer 429
+with ``Retry-After``). That includes waiting in the queue past its class's
+deadline or finding the queue full, which keeps tail latency bounded under
+overload. Callers are identified by their address, not by anything in the
+request body. Like the LLM gateway's limits, everything here is per worker.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+ADMISSION_USER_LLM_PER_MINUTE = float(os.getenv('ADMISSION_USER_LLM_PER_MINUTE', 30))
+ADMISSION_USER_LLM_BURST = float(os.getenv('ADMISSION_USER_LLM_BURST', 10))
+ADMISSION_LLM_PER_SECOND = float(os.getenv('ADMISSION_LLM_PER_SECOND', 20))
+ADMISSION_LLM_BURST = float(os.getenv('ADMISSION_LLM_BURST', 40))
+ADMISSION_USER_CPU_PER_MINUTE = float(os.getenv('ADMISSION_USER_CPU_PER_MINUTE', 10))
+ADMISSION_USER_CPU_BURST = float(os.getenv('ADMISSION_USER_CPU_BURST', 30))
+ADMISSION_SLOTS = int(os.getenv('ADMISSION_SLOTS', 12))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 32))
+ADMISSION_INTERACTIVE_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_INTERACTIVE_QUEUE_TIMEOUT', 2))
+ADMISSION_BACKGROUND_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_BACKGROUND_QUEUE_TIMEOUT', 0.5))
+ADMISSION_MAX_USERS = int(os.getenv('ADMISSION_MAX_USERS', 10000))
+ADMISSION_PROXY_HOPS = int(os.getenv('ADMISSION_PROXY_HOPS', 1))
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Request kind -> (priority, spends an LLM token, needs CPU credit)
+KINDS = {
+    'ai': (INTERACTIVE, True, False),
+    'agent': (INTERACTIVE, True, False),
+    'run': (INTERACTIVE, False, True),
+    'submit': (INTERACTIVE, False, True),
+    'generate_question': (BACKGROUND, True, False)
+}
+
+_QUEUE_TIMEOUTS = {
+    INTERACTIVE: ADMISSION_INTERACTIVE_QUEUE_TIMEOUT,
+    BACKGROUND: ADMISSION_BACKGROUND_QUEUE_TIMEOUT
+}
+
+# Smoothing of the slot hold time used to estimate Retry-After for queue shedding
+_HOLD_TIME_DECAY = 0.1
+
+# Queue entry states
+_WAITING, _GRANTED, _ABANDONED = range(3)
+
+
+def caller_identity(forwarded_for, address, proxy_hops=ADMISSION_PROXY_HOPS):
+    """Key a request is charged to: the client's address.
+
+    ``user_id`` comes from the request body and anyone can change it, so it
+    isn't used. Each of our ``proxy_hops`` proxies appends the address it
+    got the request from to ``X-Forwarded-For``; entries left of those were
+    sent by the client and can't be trusted either.
+    """
+    hops = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+    if proxy_hops > 0 and hops:
+        return f"addr:{hops[-min(proxy_hops, len(hops))]}"
+    return f"addr:{address}"
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed; ``retry_after`` is in whole seconds"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class TokenBuckets:
+    """Token buckets by key, with the least recently used keys evicted past ``max_keys``"""
+
+    def __init__(self, rate, burst, max_keys=ADMISSION_MAX_USERS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, updated]
+        self._buckets = OrderedDict()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def wait(self, key, amount, now):
+        """Seconds until ``key`` has ``amount`` tokens (0 if it has them now)"""
+        tokens = self._bucket(key, now)[0]
+        return 0.0 if tokens >= amount else (amount - tokens) / self.rate
+
+    def spend(self, key, amount, now):
+        # May go negative: a debt paid off before the next admission
+        self._bucket(key, now)[0] -= amount
+
+
+class Ticket:
+    """An admitted request; release it once the response is finished"""
+
+    def __init__(self, controller, kind, identity):
+        self._controller = controller
+        self.kind = kind
+        self.identity = identity
+        self.admitted = time.monotonic()
+        self._released = False
+
+    def charge_cpu(self, cpu_ms):
+        """Charge the CPU a sandbox run used to the caller's quota"""
+        if cpu_ms:
+            self._controller._charge_cpu(self.identity, cpu_ms / 1000)
+
+    def release(self):
+        """Free the work slot (idempotent)"""
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """Token buckets, CPU quotas and the priority queue in front of the work slots"""
+
+    def __init__(self, slots=ADMISSION_SLOTS, max_queue=ADMISSION_MAX_QUEUE):
+        self.slots = slots
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._user_llm = TokenBuckets(ADMISSION_USER_LLM_PER_MINUTE / 60, ADMISSION_USER_LLM_BURST)
+        self._global_llm = TokenBuckets(ADMISSION_LLM_PER_SECOND, ADMISSION_LLM_BURST, max_keys=1)
+        self._user_cpu = TokenBuckets(ADMISSION_USER_CPU_PER_MINUTE / 60, ADMISSION_USER_CPU_BURST)
+        self._free = slots
+        # Heap of [priority, caller's requests in flight, arrival, identity, grant, state]
+        self._queue = []
+        self._waiting = 0
+        self._arrivals = itertools.count()
+        self._active = {}
+        self._hold_time = 1.0
+        self._stats = {'admitted': 0, 'queued': 0, 'rejected': {}}
+
+    def _check(self, kind, identity):
+        """Spend the request's tokens, or raise ``AdmissionRejected``"""
+        _, llm, cpu = KINDS[kind]
+        now = time.monotonic()
+        with self._lock:
+            if llm:
+                wait = self._user_llm.wait(identity, 1, now)
+                if wait:
+                    self._reject(kind, 'user_rate')
+                    raise AdmissionRejected('Too many AI requests, please slow down', wait, 'user_rate')
+                wait = self._global_llm.wait(None, 1, now)
+                if wait:
+                    self._reject(kind, 'global_rate')
+                    raise AdmissionRejected('The AI service is busy, please try again shortly', wait, 'global_rate')
+                self._user_llm.spend(identity, 1, now)
+                self._global_llm.spend(None, 1, now)
+            if cpu:
+                # Admitted while the balance is positive; the run itself is charged afterwards
+                wait = self._user_cpu.wait(identity, 1e-3, now)
+                if wait:
+                    self._reject(kind, 'cpu_quota')
+                    raise AdmissionRejected('Code execution quota used up, please wait a moment', wait, 'cpu_quota')
+
+    def _refund(self, kind, identity):
+        # Tokens of a request the queue then shed
+        if KINDS[kind][1]:
+            now = time.monotonic()
+            with self._lock:
+                self._user_llm.spend(identity, -1, now)
+                self._global_llm.spend(None, -1, now)
+
+    def _charge_cpu(self, identity, seconds):
+        with self._lock:
+            self._user_cpu.spend(identity, seconds, time.monotonic())
+
+    def _reject(self, kind, reason):
+        # Called with the lock held
+        rejected = self._stats['rejected']
+        rejected[reason] = rejected.get(reason, 0) + 1
+        metrics.inc('admission_rejected_total', kind=kind, reason=reason)
+
+    def _enqueue(self, kind, identity, grant):
+        """Take a free slot (returns ``None``) or queue ``grant`` (returns the entry)"""
+        priority = KINDS[kind][0]
+        with self._lock:
+            if self._free > 0 and not self._waiting:
+                self._take(identity)
+                return None
+            if self._waiting >= self.max_queue:
+                self._reject(kind, 'queue_full')
+                raise AdmissionRejected('The server is busy, please try again shortly',
+                                        self._retry_after(), 'queue_full')
+            entry = [priority, self._active.get(identity, 0), next(self._arrivals), identity, grant, _WAITING]
+            heapq.heappush(self._queue, entry)
+            self._waiting += 1
+            self._stats['queued'] += 1
+            metrics.inc('admission_queue_depth')
+            return entry
+
+    def _take(self, identity):
+        # Called with the lock held
+        self._free -= 1
+        self._active[identity] = self._active.get(identity, 0) + 1
+        self._stats['admitted'] += 1
+
+    def _abandon(self, kind, entry, reason):
+        """Leave the queue after its deadline; returns whether the slot was granted meanwhile"""
+        with self._lock:
+            if entry[5] == _GRANTED:
+                return True
+            entry[5] = _ABANDONED
+            self._waiting -= 1
+            metrics.dec('admission_queue_depth')
+            if reason:
+                self._reject(kind, reason)
+            return False
+
+    def _retry_after(self):
+        # Called with the lock held: time for the queue ahead to drain
+        return self._hold_time * (self._waiting + 1) / max(1, self.slots)
+
+    def _release(self, ticket):
+        with self._lock:
+            held = time.monotonic() - ticket.admitted
+            self._hold_time += _HOLD_TIME_DECAY * (held - self._hold_time)
+            remaining = self._active.get(ticket.identity, 0) - 1
+            if remaining > 0:
+                self._active[ticket.identity] = remaining
+            else:
+                self._active.pop(ticket.identity, None)
+            self._free += 1
+            while self._queue:
+                entry = heapq.heappop(self._queue)
+                if entry[5] == _ABANDONED:
+                    continue
+                entry[5] = _GRANTED
+                self._waiting -= 1
+                metrics.dec('admission_queue_depth')
+                self._take(entry[3])
+                entry[4]()
+                break
+
+    def admit(self, kind, identity):
+        """Admit a request, waiting for a work slot; raises ``AdmissionRejected``"""
+        self._check(kind, identity)
+        ticket = Ticket(self, kind, identity)
+        granted = threading.Event()
+        started = time.monotonic()
+        try:
+            entry = self._enqueue(kind, identity, granted.set)
+        except AdmissionRejected:
+            self._refund(kind, identity)
+            raise
+        if entry is not None:
+            timeout = _QUEUE_TIMEOUTS[KINDS[kind][0]]
+            if not granted.wait(timeout) and not self._abandon(kind, entry, 'queue_timeout'):
+                self._refund(kind, identity)
+                raise AdmissionRejected('The server is busy, please try again shortly', timeout, 'queue_timeout')
+        metrics.observe('admission_queue_seconds', time.monotonic() - started, kind=kind)
+        ticket.admitted = time.monotonic()
+        return ticket
+
+    async def async_admit(self, kind, identity):
+        """``admit`` for the ASGI app: waits for the slot without holding a thread"""
+        self._check(kind, identity)
+        ticket = Ticket(self, kind, identity)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        started = time.monotonic()
+        try:
+            entry = self._enqueue(kind, identity, grant)
+        except AdmissionRejected:
+            self._refund(kind, identity)
+            raise
+        if entry is not None:
+            timeout = _QUEUE_TIMEOUTS[KINDS[kind][0]]
+            try:
+                await asyncio.wait_for(asyncio.shield(granted), timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(kind, entry, 'queue_timeout'):
+                    self._refund(kind, identity)
+                    raise AdmissionRejected('The server is busy, please try again shortly', timeout,
+                                            'queue_timeout') from None
+            except asyncio.CancelledError:
+                # The client went away while queued; hand the slot on if it was already granted
+                if self._abandon(kind, entry, None):
+                    ticket.release()
+                raise
+        metrics.observe('admission_queue_seconds', time.monotonic() - started, kind=kind)
+        ticket.admitted = time.monotonic()
+        return ticket
+
+    def stats(self):
+        with self._lock:
+            return {
+                'admitted': self._stats['admitted'],
+                'queued': self._stats['queued'],
+                'rejected': dict(self._stats['rejected']),
+                'waiting': self._waiting,
+                'slots': self.slots,
+                'free_slots': self._free,
+                'active_callers': len(self._active),
+                'hold_time_ms': round(self._hold_time * 1000, 2)
+            }
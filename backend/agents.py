@@ -0,0 +1,186 @@
+"""Portfolio agents behind ``/api/<agent>``.
+
+Every agent is an entry in ``AGENTS``: a persona prompt plus its own token
+cap, deadline and sampling temperature. All agents share one request path
+through the LLM gateway, so each call has bounded cost (input is clipped,
+output is capped) and bounded latency (the deadline covers queueing,
+retries and streaming; a request deadline that is sooner wins). Short
+FAQ-style questions are answered from a per-agent cache.
+
+Agents can be added or tuned without code changes by pointing
+``AGENTS_CONFIG`` at a JSON file of entries shaped like ``AGENTS``.
+"""
+import json
+import os
+import time
+
+from llm import chat_completion, async_chat_completion
+from response_cache import ResponseCache
+
+AGENT_MODEL = os.getenv('AGENT_MODEL', 'llama-3.3-70b-versatile')
+AGENTS_CONFIG = os.getenv('AGENTS_CONFIG')
+AGENT_MAX_MESSAGE_CHARS = int(os.getenv('AGENT_MAX_MESSAGE_CHARS', 2000))
+AGENT_FAQ_MAX_WORDS = int(os.getenv('AGENT_FAQ_MAX_WORDS', 20))
+AGENT_CACHE_SIZE = int(os.getenv('AGENT_CACHE_SIZE', 2000))
+AGENT_CACHE_TTL = float(os.getenv('AGENT_CACHE_TTL', 24 * 3600))
+
+AGENTS = {
+    'welcome': {
+        'system_prompt': "You are a helpful welcome agent for a portfolio website.",
+        'max_tokens': 300,
+        'deadline_seconds': 15,
+        'temperature': 0.5
+    },
+    'project': {
+        'system_prompt': "You are a helpful project agent for a portfolio website.",
+        'max_tokens': 600,
+        'deadline_seconds': 25,
+        'temperature': 0.5
+    },
+    'career': {
+        'system_prompt': "You are a helpful career agent for a portfolio website.",
+        'max_tokens': 600,
+        'deadline_seconds': 25,
+        'temperature': 0.5
+    },
+    'client': {
+        'system_prompt': "You are a helpful business advisor agent for a portfolio website.",
+        'max_tokens': 600,
+        'deadline_seconds': 25,
+        'temperature': 0.5
+    },
+    'research': {
+        'system_prompt': "You are a helpful research agent for a portfolio website.",
+        'max_tokens': 800,
+        'deadline_seconds': 30,
+        'temperature': 0.5
+    }
+}
+
+if AGENTS_CONFIG:
+    with open(AGENTS_CONFIG) as f:
+        for name, overrides in json.load(f).items():
+            AGENTS[name] = dict(AGENTS.get(name, {}), **overrides)
+
+# FAQ answers, scoped per agent through the cache's question type
+faq_cache = ResponseCache(max_entries=AGENT_CACHE_SIZE, ttl=AGENT_CACHE_TTL, near_duplicates=False)
+
+
+class UnknownAgent(Exception):
+    """Raised for an agent name that is not in the registry"""
+
+
+def get_agent(name):
+    agent = AGENTS.get(name)
+    if agent is None:
+        raise UnknownAgent(f"Unknown agent: {name}")
+    return agent
+
+
+def is_faq(message):
+    """Short questions are the ones worth caching and sharing between visitors"""
+    return 0 < len(message.split()) <= AGENT_FAQ_MAX_WORDS
+
+
+def _request(name, message, deadline=None):
+    """Messages and gateway parameters for one agent call; ``deadline`` is the request's, if any"""
+    agent = get_agent(name)
+    messages = [
+        {"role": "system", "content": agent['system_prompt']},
+        {"role": "user", "content": message[:AGENT_MAX_MESSAGE_CHARS]}
+    ]
+    params = {
+        'model': agent.get('model', AGENT_MODEL),
+        'max_tokens': agent['max_tokens'],
+        'temperature': agent.get('temperature', 0.5),
+        'deadline': time.monotonic() + agent['deadline_seconds']
+    }
+    if deadline is not None:
+        params['deadline'] = min(params['deadline'], deadline)
+    return messages, params
+
+
+def cached_answer(name, message):
+    """FAQ answer of agent ``name`` for ``message``, or ``None``"""
+    return faq_cache.get(f"agent:{name}", '', '', message) if is_faq(message) else None
+
+
+def remember_answer(name, message, response):
+    if is_faq(message) and response:
+        faq_cache.set(f"agent:{name}", '', '', message, response)
+
+
+def ask_agent(name, message, deadline=None):
+    """Answer ``message`` as agent ``name``"""
+    messages, params = _request(name, message, deadline)
+    cached = cached_answer(name, message)
+    if cached is not None:
+        return cached
+    completion = chat_completion(messages=messages, **params)
+    response = completion.choices[0].message.content
+    remember_answer(name, message, response)
+    return response
+
+
+async def async_ask_agent(name, message, deadline=None):
+    """``ask_agent`` for the ASGI app"""
+    messages, params = _request(name, message, deadline)
+    cached = cached_answer(name, message)
+    if cached is not None:
+        return cached
+    completion = await async_chat_completion(messages=messages, **params)
+    response = completion.choices[0].message.content
+    remember_answer(name, message, response)
+    return response
+
+
+def stream_agent(name, message, deadline=None):
+    """Yield the answer of agent ``name`` token by token"""
+    messages, params = _request(name, message, deadline)
+    cached = cached_answer(name, message)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    stream = chat_completion(messages=messages, stream=True, **params)
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                yield token
+    finally:
+        # Release the upstream slot if the client went away mid-stream
+        stream.close()
+    remember_answer(name, message, ''.join(parts))
+
+
+async def async_stream_agent(name, message, deadline=None):
+    """``stream_agent`` for the ASGI app"""
+    messages, params = _request(name, message, deadline)
+    cached = cached_answer(name, message)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    stream = await async_chat_completion(messages=messages, stream=True, **params)
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                parts.append(token)
+                yield token
+    finally:
+        await stream.aclose()
+    remember_answer(name, message, ''.join(parts))
+
+
+def stats():
+    return {
+        'agents': sorted(AGENTS),
+        'faq_cache': faq_cache.stats()
+    }
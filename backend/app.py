@@ -1,46 +1,70 @@
-from groq import Groq
 import os
+import functools
+import logging
+import math
+import random
+import time
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import io
-import sys
-import traceback
-from tutor import get_tutor_response
-from collections import defaultdict
-import random
+from tutor import get_tutor_response, stream_tutor_response, response_cache, prompt_stats, get_intent_classifier
+import json
+from sandbox import get_sandbox_pool, SandboxBusy, SANDBOX_CASE_SECONDS
+from code_analysis import analyze, first_error, error_result, STATIC_ANALYSIS
+import code_analysis
+from run_cache import RunCache, RUN_CACHE
+from problem_bank import ProblemBank
+from problem_parser import ProblemIndex
+from problem_verifier import ProblemVerifier, PROBLEM_VERIFY, PROBLEM_VERIFY_ATTEMPTS, REJECTED
+from llm import LLMDeadlineExceeded, LLMOverloaded
+from router import router, STANDARD
+import llm
+from agents import ask_agent, stream_agent, get_agent, UnknownAgent
+import agents
+from session_store import create_session_store
+from recommender import Recommender
+from admission import AdmissionController, AdmissionRejected, caller_identity, ADMISSION_CONTROL
+from deadlines import Deadline, RequestCancelled, client_timeout, socket_closed, DEADLINE, DEADLINE_HEADER
+import deadlines
+import metrics
 
 # Load environment variables
 load_dotenv()
 
+logging.basicConfig(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+# Every upstream call would otherwise log a line
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
 app = Flask(__name__)
-# Configure CORS for production
+# Configure CORS for production (the ASGI app applies the same policy)
+CORS_ORIGINS = [
+    "http://localhost:3000",
+    "https://*.netlify.app",  # Allow all Netlify deployments
+    "https://codeedgeai.netlify.app"  # Your main Netlify domain
+]
+CORS_METHODS = ["GET", "POST", "OPTIONS"]
+CORS_HEADERS = ["Content-Type", "Authorization", DEADLINE_HEADER]
 CORS(app, resources={
     r"/*": {
-        "origins": [
-            "http://localhost:3000",
-            "https://*.netlify.app",  # Allow all Netlify deployments
-            "https://codeedgeai.netlify.app"  # Your main Netlify domain
-        ],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "origins": CORS_ORIGINS,
+        "methods": CORS_METHODS,
+        "allow_headers": CORS_HEADERS
     }
 })
 
-# Initialize Groq client
-client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# Open the upstream connection, start the sandboxes and train the intent
+# classifier when a worker boots instead of on its first requests
+WARMUP = os.getenv('WARMUP', 'true').lower() == 'true'
 
-# Store conversation history for each user
-conversation_history = defaultdict(list)
+# Store conversation history and progress for each user
+session_store = create_session_store()
 
-# Store user progress
-user_progress = defaultdict(lambda: {
-    'easy_solved': 0,
-    'medium_solved': 0,
-    'hard_solved': 0,
-    'current_difficulty': 'easy',
-    'concepts_mastered': set()
-})
+# Results of deterministic /run submissions, per worker
+run_cache = RunCache()
 
 # Define system prompts for different categories and concepts
 system_prompts = {
@@ -172,6 +196,9 @@ problem_categories = {
     'bit_manipulation': 'Problems involving bitwise operations and binary manipulation'
 }
 
+# Bank key category for problems generated from problem_categories
+ADVANCED_CATEGORY = 'advanced'
+
 def get_problem_prompt(category, difficulty):
     return f"""Generate an original coding problem focusing on {category}.
 Category Description: {problem_categories[category]}
@@ -187,18 +214,10 @@ The problem should:
 7. Have a clear, unambiguous solution approach
 8. Be educational and help users learn the concept
 9. Be completely original and not copied from any existing platforms
-10. ALWAYS verify that the expected outputs are correct and consistent with the problem description
-11. Test all examples before including them in the problem statement
-12. Ensure the examples follow the exact same rules as described in the problem
-13. For each example:
-    - First write the solution
-    - Then run the solution with the example input
-    - Verify the output matches the expected output
-    - Only include the example if the output is correct
-14. If any example's output doesn't match, either:
-    - Fix the example to match the actual output
-    - Or fix the solution to match the expected output
-15. Make sure all examples are consistent with each other
+10. Ensure the examples follow the exact same rules as described in the problem
+11. Make sure all examples are consistent with each other
+12. Write every example input as named Python literals (for example: nums = [1, 2, 3], k = 2) and every output as a Python literal
+13. Include a correct reference solution; the examples are checked by running it
 
 Format the response as:
 Title: [Problem Title]
@@ -212,167 +231,491 @@ Output: [example output]
 Explanation: [detailed explanation of how the output was calculated]
 
 Constraints:
-[Problem constraints]"""
-
-def get_next_question(user_id, category=None):
-    if category:
-        # Generate a new question for this category
-        prompt = get_problem_prompt(category, 'medium')  # Default to medium difficulty
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "Generate a new problem. Make sure to test all examples and verify the outputs are correct. For each example, first write and test the solution, then include the example only if the output matches."}
-            ],
-            model="llama3-70b-8192",
-            temperature=0.8,
-            max_tokens=500
-        )
-        return {
-            'title': completion.choices[0].message.content.split('\n')[0].replace('Title: ', ''),
-            'content': completion.choices[0].message.content,
-            'category': category,
-            'difficulty': 'medium'
-        }
-    
-    # If no category specified, randomly select one
-    category = random.choice(list(problem_categories.keys()))
-    prompt = get_problem_prompt(category, 'medium')
-    completion = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": "Generate a new problem."}
-        ],
-        model="llama3-70b-8192",
-        temperature=0.8,
-        max_tokens=500
+[Problem constraints]
+
+Reference Solution:
+```python
+def solve(...):
+    ...
+```"""
+
+# Appended to every problem request; the examples are verified by running the solution
+REFERENCE_SOLUTION_INSTRUCTION = (
+    "Write example inputs as named Python literals (for example: nums = [1, 2, 3], k = 2) and outputs as Python literals. "
+    "After the constraints, add a 'Reference Solution:' section with a correct Python function named solve in a "
+    "```python code block. Its parameters must be named like the example inputs and it must return the expected output."
+)
+
+# Model settings shared by the sync and async problem generators; problems
+# need the reasoning of a large model, so they are routed in its tier
+PROBLEM_TIER = STANDARD
+PROBLEM_PARAMS = {
+    'temperature': 0.8,
+    'max_tokens': 900
+}
+# Rejected problems are regenerated, up to this many model calls per problem
+PROBLEM_GENERATE_ATTEMPTS = max(1, PROBLEM_VERIFY_ATTEMPTS) if PROBLEM_VERIFY else 1
+
+def problem_messages(category, concept, difficulty):
+    """Messages asking the model for a problem text with its reference solution"""
+    if category == ADVANCED_CATEGORY:
+        prompt = get_problem_prompt(concept, difficulty)
+        user_message = "Generate a new problem."
+    else:
+        prompt = system_prompts.get(category, {}).get(concept, {}).get(difficulty, system_prompts['data_structures']['arrays']['medium'])
+        user_message = f"Generate a problem in the {category} category, specifically about {concept}, with {difficulty} difficulty. Include a clear problem title."
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": f"{user_message} {REFERENCE_SOLUTION_INSTRUCTION}"}
+    ]
+
+def request_problem(category, concept, difficulty, deadline=None):
+    """Ask the model for a problem text with its reference solution"""
+    params = deadline.llm_params() if deadline is not None else {}
+    completion = router.complete(problem_messages(category, concept, difficulty), PROBLEM_TIER, 'problem',
+                                 **PROBLEM_PARAMS, **params)
+    return completion.choices[0].message.content
+
+def share_problem(record, status):
+    """Let submissions reaching other workers grade on the checked test cases"""
+    session_store.save_problem(record['hash'], {
+        'key': record['key'],
+        'test_cases': record['test_cases'],
+        'verification': status
+    })
+
+def check_problem(content, key, deadline=None):
+    """Parse and verify one generated problem; returns ``(status, record)``.
+
+    ``deadline`` is the ``Deadline`` of the request waiting for it, which
+    bounds the reference solution's run.
+    """
+    # Parse once; graders look the test cases up by problem_id afterwards
+    record = problem_index.add(content, key)
+    if not PROBLEM_VERIFY:
+        share_problem(record, None)
+        return None, record
+    category, concept, _ = key
+    status, record, _ = problem_verifier.verify(
+        record,
+        concept if category == ADVANCED_CATEGORY else category,
+        deadline=deadline.at if deadline is not None else None,
+        cancelled=deadline.cancelled if deadline is not None else None
     )
+    share_problem(record, status)
+    return status, record
+
+def problem_payload(record, key, status):
+    category, concept, difficulty = key
     return {
-        'title': completion.choices[0].message.content.split('\n')[0].replace('Title: ', ''),
-        'content': completion.choices[0].message.content,
+        'problem_id': record['hash'],
+        'title': record['title'],
+        # The reference solution is never sent to students
+        'content': record['statement'],
         'category': category,
-        'difficulty': 'medium'
+        'concept': concept,
+        'difficulty': difficulty,
+        'verification': status
     }
 
-@app.route('/api/welcome', methods=['POST'])
-def welcome():
-    data = request.json
-    message = data.get('message', '')
-    
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful welcome agent for a portfolio website."},
-                {"role": "user", "content": message}
-            ],
-            model="llama-3.3-70b-versatile",
-        )
-        return jsonify({"response": chat_completion.choices[0].message.content})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+def generate_problem(category, concept, difficulty, deadline=None):
+    """Generate a problem for one problem bank bucket, verified against its reference solution.
 
-@app.route('/api/project', methods=['POST'])
-def project():
-    data = request.json
-    message = data.get('message', '')
-    
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful project agent for a portfolio website."},
-                {"role": "user", "content": message}
-            ],
-            model="llama-3.3-70b-versatile",
-        )
-        return jsonify({"response": chat_completion.choices[0].message.content})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    ``deadline`` is the ``Deadline`` of the request waiting for it; the
+    background refill has none.
+    """
+    key = (category, concept, difficulty)
+    for _ in range(PROBLEM_GENERATE_ATTEMPTS):
+        if deadline is not None:
+            deadline.check()
+        status, record = check_problem(request_problem(*key, deadline), key, deadline)
+        if status != REJECTED:
+            break
+    return problem_payload(record, key, status)
 
-@app.route('/api/career', methods=['POST'])
-def career():
-    data = request.json
-    message = data.get('message', '')
-    
-    try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful career agent for a portfolio website."},
-                {"role": "user", "content": message}
-            ],
-            model="llama-3.3-70b-versatile",
-        )
-        return jsonify({"response": chat_completion.choices[0].message.content})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+# Parsed problems and their test cases, by content hash and bucket
+problem_index = ProblemIndex()
+problem_verifier = ProblemVerifier(problem_index)
 
-@app.route('/api/client', methods=['POST'])
-def client_route():
-    data = request.json
+# Bank of pre-generated problems, refilled in the background; problems that
+# failed verification are only ever served when generated on demand
+problem_bank = ProblemBank(generate_problem, accept=lambda problem: problem['verification'] != REJECTED)
+
+# Optionally warm every advanced bucket at startup instead of on first use
+if os.getenv('PROBLEM_BANK_PREFILL', 'false').lower() == 'true':
+    problem_bank.prefill((ADVANCED_CATEGORY, category, 'medium') for category in problem_categories)
+
+def is_bank_key(category, concept, difficulty):
+    """Only buckets from the prompt tables are banked, never arbitrary input"""
+    if category == ADVANCED_CATEGORY:
+        return concept in problem_categories and difficulty in ('easy', 'medium', 'hard')
+    return difficulty in system_prompts.get(category, {}).get(concept, {})
+
+# One track per main-page category plus the advanced concepts
+recommender = Recommender(dict(
+    {category: list(concepts) for category, concepts in system_prompts.items()},
+    **{ADVANCED_CATEGORY: list(problem_categories)}
+))
+
+def recommended_key(user_id, track, concept=None):
+    """Bucket to serve ``user_id`` next in ``track``, by skill; ``concept`` pins the concept"""
+    if not recommender.has_track(track):
+        raise ValueError(f"Unknown category: {track}")
+    progress = session_store.get_progress(user_id)
+    if concept is not None and recommender.knows(track, concept):
+        return track, concept, recommender.difficulty(progress, track, concept)
+    return (track,) + recommender.next(progress, track)
+
+# Rate limits, CPU quotas and the priority queue in front of the LLM and sandbox routes
+admission = AdmissionController()
+
+def request_identity():
+    """Who the current request is charged to"""
+    return caller_identity(request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def admitted(kind):
+    """Admit the request before the view runs; streamed responses hold their slot until closed"""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not ADMISSION_CONTROL:
+                return view(*args, **kwargs)
+            ticket = g.admission = admission.admit(kind, request_identity())
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except BaseException:
+                ticket.release()
+                raise
+            if response.is_streamed:
+                response.call_on_close(ticket.release)
+            else:
+                ticket.release()
+            return response
+        return wrapper
+    return decorate
+
+def with_deadline(kind):
+    """Give the request its ``Deadline`` in ``g.deadline``: the route default or the client's ``X-Request-Timeout``"""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # The dev server and gunicorn both expose the client socket
+            sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+            g.deadline = Deadline(kind, client_timeout(request.headers.get(DEADLINE_HEADER)), socket_closed(sock))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def cancelled_response(error):
+    """504 once the deadline passed; 499 (nginx's "client closed request") when nobody is listening"""
+    reason = getattr(error, 'reason', DEADLINE)
+    deadlines.record(g.deadline.kind, reason)
+    return jsonify({
+        'success': False,
+        'error': str(error)
+    }), 504 if reason == DEADLINE else 499
+
+def charge_run(result):
+    """Charge the CPU a sandbox run used to the caller's quota"""
+    ticket = g.get('admission')
+    if ticket is not None:
+        ticket.charge_cpu(result.get('cpu_ms'))
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    response = jsonify({
+        'success': False,
+        'error': str(e)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats())
+
+@app.route('/deadlines/stats', methods=['GET'])
+def deadline_stats():
+    return jsonify(deadlines.stats())
+
+@app.route('/api/<agent>', methods=['POST'])
+@with_deadline('agent')
+@admitted('agent')
+def agent_route(agent):
+    """Portfolio agents (welcome, project, career, client, research, ...)"""
+    data = request.json or {}
     message = data.get('message', '')
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful business advisor agent for a portfolio website."},
-                {"role": "user", "content": message}
-            ],
-            model="llama-3.3-70b-versatile",
+        get_agent(agent)
+    except UnknownAgent as e:
+        return jsonify({"error": str(e)}), 404
+    
+    if data.get('stream'):
+        def generate():
+            tokens = []
+            try:
+                for token in stream_agent(agent, message, g.deadline.at):
+                    tokens.append(token)
+                    yield sse_event({'token': token})
+            except Exception as e:
+                yield sse_event({'success': False, 'error': str(e)}, event='error')
+                return
+            yield sse_event({'success': True, 'response': ''.join(tokens)}, event='done')
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
         )
-        return jsonify({"response": chat_completion.choices[0].message.content})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/api/research', methods=['POST'])
-def research():
-    data = request.json
-    message = data.get('message', '')
     
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a helpful research agent for a portfolio website."},
-                {"role": "user", "content": message}
-            ],
-            model="llama-3.3-70b-versatile",
-        )
-        return jsonify({"response": chat_completion.choices[0].message.content})
+        return jsonify({"response": ask_agent(agent, message, g.deadline.at)})
+    except LLMDeadlineExceeded as e:
+        deadlines.record('agent', DEADLINE)
+        return jsonify({"error": str(e)}), 504
+    except LLMOverloaded as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/stats', methods=['GET'])
+def agent_stats():
+    return jsonify(agents.stats())
+
 @app.route('/run', methods=['POST'])
+@with_deadline('run')
+@admitted('run')
 def run_code():
     try:
         data = request.json
         code = data.get('code', '')
+        stdin = data.get('stdin', '')
+        
+        # Unchanged deterministic code gets the last run's result without a sandbox
+        result, token = run_cache.get(code, stdin) if RUN_CACHE else (None, None)
+        if result is not None:
+            result['cached'] = True
+            return jsonify(result)
         
-        # Create a string buffer to capture output
-        output_buffer = io.StringIO()
-        sys.stdout = output_buffer
+        # Code that can't run (syntax errors, unbound names, endless loops) never reaches a sandbox
+        findings = analyze(code) if STATIC_ANALYSIS else []
+        error = first_error(findings)
+        if error is not None:
+            return jsonify(error_result(error, findings))
         
-        # Execute the code with access to built-ins
+        # Execute the code in an isolated sandbox process
+        result = get_sandbox_pool().run(code, stdin=stdin, deadline=g.deadline.at, cancelled=g.deadline.cancelled)
+        charge_run(result)
+        if result.get('cancelled'):
+            return cancelled_response(RequestCancelled(result['cancelled']))
+        if findings:
+            result['analysis'] = findings
+        run_cache.set(token, result)
+        return jsonify(result)
+    except SandboxBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/run/stream', methods=['POST'])
+@with_deadline('run')
+@admitted('run')
+def run_code_stream():
+    """``/run`` as Server-Sent Events: output chunks while the program runs, then the result"""
+    data = request.json or {}
+    code = data.get('code', '')
+    stdin = data.get('stdin', '')
+    
+    findings = analyze(code) if STATIC_ANALYSIS else []
+    error = first_error(findings)
+    if error is not None:
+        return Response(sse_event(error_result(error, findings), event='done'), mimetype='text/event-stream')
+    
+    try:
+        events = get_sandbox_pool().stream(code, stdin=stdin, deadline=g.deadline.at, cancelled=g.deadline.cancelled)
+    except SandboxBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    
+    def generate():
         try:
-            exec(code, {'__builtins__': __builtins__})
-            output = output_buffer.getvalue()
-            return jsonify({
-                'success': True,
-                'output': output
-            })
+            for event in events:
+                if 'result' in event:
+                    result = event['result']
+                    charge_run(result)
+                    if findings:
+                        result['analysis'] = findings
+                    yield sse_event(result, event='done')
+                else:
+                    yield sse_event(event)
         except Exception as e:
-            error_traceback = traceback.format_exc()
-            return jsonify({
-                'success': False,
-                'error': str(e),
-                'traceback': error_traceback
-            })
+            yield sse_event({'success': False, 'error': str(e)}, event='error')
         finally:
-            sys.stdout = sys.__stdout__
-            
+            # Stops the program if the client disconnected
+            events.close()
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Frees the slot even if the body is never iterated
+    response.call_on_close(events.close)
+    return response
+
+UNGRADED_MESSAGE = "Your code ran without errors, but this problem has no test cases to check it against."
+
+def describe_verdicts(result):
+    """Short message for the frontend summarizing a batch run"""
+    if not result['success']:
+        return f"Error: {result.get('error', 'Failed to run code')}"
+    if result['all_passed']:
+        return f"All {result['total']} test cases passed!"
+    failed = next(case for case in result['cases'] if case['verdict'] != 'passed')
+    reason = failed['verdict'].replace('_', ' ')
+    return f"Test case {failed['index'] + 1} failed ({reason}). Passed {result['passed']} of {result['total']}."
+
+def problem_record(problem_id):
+    """Record of a generated problem: from this worker's index, else as shared by the worker that made it"""
+    if not problem_id:
+        return None
+    return problem_index.get(problem_id) or session_store.get_problem(problem_id)
+
+def problem_test_cases(problem_id):
+    """Verified test cases of a generated problem.
+
+    ``None`` when no worker has a record of it, ``[]`` when the record has
+    no usable cases (none parsed, or the verifier rejected them). The
+    problem text a client sends is never parsed for cases: it may be one
+    the verifier rejected.
+    """
+    record = problem_record(problem_id)
+    return record['test_cases'] if record else None
+
+def normalize_case(case):
+    if not isinstance(case, dict):
+        raise ValueError("Each test case must be an object with 'input' or 'args'")
+    if 'args' in case:
+        return {'args': case['args'], 'expected': case.get('expected')}
+    return {'input': case.get('input', ''), 'expected_output': case.get('expected_output')}
+
+def case_timeout(value):
+    """Per-case time limit a submission asked for, capped at ``SANDBOX_CASE_SECONDS``"""
+    if value is None:
+        return SANDBOX_CASE_SECONDS
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('timeout must be a number of seconds') from None
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError('timeout must be a positive number of seconds')
+    return min(seconds, SANDBOX_CASE_SECONDS)
+
+def attempt_key(problem_id, data, difficulty):
+    """(category, concept, difficulty) of the problem being attempted"""
+    record = problem_record(problem_id)
+    if record is not None and record['key'] is not None:
+        return tuple(record['key'])
+    return data.get('category'), data.get('concept'), difficulty
+
+@app.route('/submit-solution', methods=['POST'])
+@with_deadline('submit')
+@admitted('submit')
+def submit_solution():
+    try:
+        data = request.json
+        code = data.get('code', '')
+        user_id = data.get('user_id', 'default')
+        difficulty = data.get('difficulty', 'easy')
+        stop_on_failure = data.get('stop_on_failure', True)
+        case_seconds = case_timeout(data.get('timeout'))
+        
+        # A stored problem is graded on its own cases only, whatever the client sent
+        cases = problem_test_cases(data.get('problem_id'))
+        if cases is None:
+            cases = data.get('cases') or []
+        graded = bool(cases)
+        # Without test cases just check that the code runs cleanly; that says nothing about correctness
+        cases = [normalize_case(case) for case in cases or [{'input': '', 'expected_output': None}]]
+        
+        result = get_sandbox_pool().run_batch(
+            code,
+            cases,
+            case_seconds=case_seconds,
+            stop_on_failure=stop_on_failure,
+            deadline=g.deadline.at,
+            cancelled=g.deadline.cancelled
+        )
+        charge_run(result)
+        if result.get('cancelled'):
+            # A run cut short says nothing about the solution, so progress is left alone
+            return cancelled_response(RequestCancelled(result['cancelled']))
+        correct = graded and result['success'] and result['all_passed']
+        response = {
+            'success': result['success'],
+            'correct': correct,
+            'graded': graded,
+            'message': describe_verdicts(result) if graded or not result['success'] else UNGRADED_MESSAGE,
+            'cases': result.get('cases', []),
+            'passed': result.get('passed', 0),
+            'total': len(cases),
+            'duration_ms': result['duration_ms']
+        }
+        if not result['success']:
+            response['error'] = result.get('error', '')
+            response['traceback'] = result.get('traceback', '')
+        
+        if not graded:
+            return jsonify(response)
+        # Every graded attempt rates the concept; only one where every case passed counts as solved
+        category, concept, difficulty = attempt_key(data.get('problem_id'), data, difficulty)
+        progress = update_user_progress(user_id, difficulty, category, concept, solved=correct)
+        if correct:
+            response['current_difficulty'] = progress['current_difficulty']
+            response['progress'] = progress_payload(progress)
+        return jsonify(response)
+    except SandboxBusy as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/run/stats', methods=['GET'])
+def run_stats():
+    stats = get_sandbox_pool().stats()
+    stats['analysis'] = code_analysis.stats()
+    stats['cache'] = run_cache.stats()
+    return jsonify(stats)
+
 @app.route('/ai', methods=['POST'])
+@with_deadline('ai')
+@admitted('ai')
 def ai():
     try:
         data = request.json
@@ -383,7 +726,7 @@ def ai():
         user_id = data.get('user_id', 'default')  # Add user_id to track conversations
         
         # Get previous conversation history
-        history = conversation_history[user_id]
+        history = session_store.get_history(user_id)
         
         # Get response from tutor with history
         response = get_tutor_response(
@@ -391,115 +734,165 @@ def ai():
             problem=problem,
             code=code,
             question=question,
-            history=history
+            history=history,
+            deadline=g.deadline
         )
         
-        # Store the current interaction in history
-        conversation_history[user_id].append({
-            'question': question,
-            'response': response
-        })
-        
-        # Limit history to last 10 interactions
-        if len(conversation_history[user_id]) > 10:
-            conversation_history[user_id] = conversation_history[user_id][-10:]
+        # Store the current interaction in history (the store keeps the last 10)
+        session_store.append_history(user_id, question, response)
         
         return jsonify({
             'success': True,
             'response': response
         })
+    except (RequestCancelled, LLMDeadlineExceeded) as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/generate-question', methods=['GET'])
-def generate_question():
-    try:
-        user_id = request.args.get('user_id', 'default')
-        category = request.args.get('category', 'data_structures')
-        concept = request.args.get('concept', None)
-        difficulty = request.args.get('difficulty', None)
-        use_advanced = request.args.get('use_advanced', 'false').lower() == 'true'
-        
-        # For Code with AI page, use advanced problem generation
-        if use_advanced:
-            # Get the next question based on user's progress
-            question = get_next_question(user_id, concept)
-            if question:
-                return jsonify({
-                    'success': True,
-                    'question': question['content'],
-                    'difficulty': question['difficulty'],
-                    'concept': question['category'],
-                    'is_advanced': True
-                })
-            else:
-                # If no more questions available, generate a new one
-                category = random.choice(list(problem_categories.keys()))
-                prompt = get_problem_prompt(category, 'medium')
-                completion = client.chat.completions.create(
-                    messages=[
-                        {"role": "system", "content": prompt},
-                        {"role": "user", "content": "Generate a new problem."}
-                    ],
-                    model="llama3-70b-8192",
-                    temperature=0.8,
-                    max_tokens=500
-                )
-                return jsonify({
-                    'success': True,
-                    'question': completion.choices[0].message.content,
-                    'difficulty': 'medium',
-                    'concept': category,
-                    'is_advanced': True
-                })
+def sse_event(data, event=None):
+    """Format a Server-Sent Events message"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@app.route('/ai/stream', methods=['POST'])
+@with_deadline('ai')
+@admitted('ai')
+def ai_stream():
+    data = request.json
+    problem = data.get('problem', '')
+    code = data.get('code', '')
+    question = data.get('question', '')
+    question_type = data.get('type', 'general')
+    user_id = data.get('user_id', 'default')
+    
+    history = session_store.get_history(user_id)
+    deadline = g.deadline
+    
+    def generate():
+        tokens = []
+        try:
+            for token in stream_tutor_response(
+                question_type=question_type,
+                problem=problem,
+                code=code,
+                question=question,
+                history=history,
+                deadline=deadline
+            ):
+                tokens.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            yield sse_event({'success': False, 'error': str(e)}, event='error')
+            return
         
-        # For main page, use the original system
-        if concept is None:
-            difficulty = user_progress[user_id]['current_difficulty']
-            concepts = list(system_prompts[category].keys())
-            concept = random.choice(concepts)
+        response = ''.join(tokens).strip()
         
-        print(f"Generating question for user {user_id} with category: {category}, concept: {concept}, difficulty: {difficulty}")
+        # Store the completed interaction in history
+        session_store.append_history(user_id, question, response)
         
-        prompt = system_prompts.get(category, {}).get(concept, {}).get(difficulty, system_prompts['data_structures']['arrays']['medium'])
+        yield sse_event({'success': True, 'response': response}, event='done')
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/ai/stats', methods=['GET'])
+def ai_stats():
+    return jsonify({
+        'llm': llm.stats(),
+        'cache': response_cache.stats(),
+        'prompts': prompt_stats(),
+        'intents': get_intent_classifier().stats(),
+        'router': router.stats()
+    })
+
+def question_request(args):
+    """``(user_id, bucket, is_advanced)`` of a /generate-question query"""
+    user_id = args.get('user_id', 'default')
+    category = args.get('category', 'data_structures')
+    concept = args.get('concept', None)
+    difficulty = args.get('difficulty', None)
+    
+    # For Code with AI page, use advanced problem generation
+    if args.get('use_advanced', 'false').lower() == 'true':
+        return user_id, recommended_key(user_id, ADVANCED_CATEGORY, concept), True
+    
+    # For main page, the student picks the concept or the recommender does
+    if concept is None:
+        return user_id, recommended_key(user_id, category), False
+    return user_id, (category, concept, difficulty), False
+
+def question_payload(question, key, is_advanced):
+    _, concept, difficulty = key
+    return {
+        'success': True,
+        'problem_id': question['problem_id'],
+        'question': question['content'],
+        'difficulty': difficulty,
+        'concept': concept,
+        'is_advanced': is_advanced
+    }
+
+@app.route('/generate-question', methods=['GET'])
+@with_deadline('generate_question')
+@admitted('generate_question')
+def generate_question():
+    try:
+        user_id, key, is_advanced = question_request(request.args)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    try:
+        logger.debug("Generating question for user %s with category: %s, concept: %s, difficulty: %s",
+                     user_id, *key)
         
-        completion = client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"Generate a problem in the {category} category, specifically about {concept}, with {difficulty} difficulty. Include a clear problem title."}
-            ],
-            model="llama3-70b-8192",
-            temperature=0.8,
-            max_tokens=500
-        )
+        # Serve from the problem bank when the bucket is a known one
+        if not is_bank_key(*key):
+            question = generate_problem(*key, deadline=g.deadline)
+        else:
+            question = problem_bank.take_ready(user_id, key)
+            if question is None:
+                question = problem_bank.served(user_id, key, generate_problem(*key, deadline=g.deadline))
         
-        return jsonify({
-            'success': True,
-            'question': completion.choices[0].message.content,
-            'difficulty': difficulty,
-            'concept': concept,
-            'is_advanced': False
-        })
+        return jsonify(question_payload(question, key, is_advanced))
         
+    except (RequestCancelled, LLMDeadlineExceeded) as e:
+        return cancelled_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-def get_next_difficulty(user_id):
-    progress = user_progress[user_id]
+@app.route('/generate-question/stats', methods=['GET'])
+def generate_question_stats():
+    stats = problem_bank.stats()
+    stats['index'] = problem_index.stats()
+    stats['verification'] = problem_verifier.stats()
+    stats['recommender'] = recommender.stats()
+    return jsonify(stats)
+
+def get_next_difficulty(progress):
+    """Difficulty step for attempts that don't name a concept the recommender rates"""
     # Start with easy if no problems solved
     if progress['easy_solved'] == 0:
         return 'easy'
     # Move to medium after solving some easy problems
-    elif progress['easy_solved'] > 0 and progress['medium_solved'] == 0:
+    elif progress['medium_solved'] == 0:
         return 'medium'
     # Move to hard after solving some medium problems
-    elif progress['medium_solved'] > 0 and progress['hard_solved'] == 0:
+    elif progress['hard_solved'] == 0:
         return 'hard'
     # Once all difficulties are unlocked, randomly select difficulty
     else:
@@ -507,15 +900,39 @@ def get_next_difficulty(user_id):
         weights = [0.4, 0.4, 0.2]  # 40% easy, 40% medium, 20% hard
         return random.choices(difficulties, weights=weights)[0]
 
-def update_user_progress(user_id, difficulty):
-    progress = user_progress[user_id]
-    if difficulty == 'easy':
-        progress['easy_solved'] += 1
-    elif difficulty == 'medium':
-        progress['medium_solved'] += 1
-    elif difficulty == 'hard':
-        progress['hard_solved'] += 1
-    progress['current_difficulty'] = get_next_difficulty(user_id)
+def update_user_progress(user_id, difficulty, category=None, concept=None, solved=True):
+    """Record an attempt: solved counts, the concept's rating and the next recommended problem"""
+    upcoming = None
+
+    def record(progress):
+        nonlocal upcoming
+        if solved and difficulty == 'easy':
+            progress['easy_solved'] += 1
+        elif solved and difficulty == 'medium':
+            progress['medium_solved'] += 1
+        elif solved and difficulty == 'hard':
+            progress['hard_solved'] += 1
+        if recommender.knows(category, concept):
+            recommender.record(progress, category, concept, difficulty, solved)
+            upcoming = (category,) + recommender.next(progress, category)
+            progress['current_difficulty'] = upcoming[2]
+        else:
+            progress['current_difficulty'] = get_next_difficulty(progress)
+
+    # Read, update and write in one step, so concurrent attempts aren't lost
+    progress = session_store.update_progress(user_id, record)
+    # Have the bank ready the recommended problem before it is asked for
+    if upcoming is not None and is_bank_key(*upcoming):
+        problem_bank.request_refill(upcoming)
+    return progress
+
+def progress_payload(progress):
+    return {
+        'easy_solved': progress['easy_solved'],
+        'medium_solved': progress['medium_solved'],
+        'hard_solved': progress['hard_solved'],
+        'concepts_mastered': sorted(progress['concepts_mastered'])
+    }
 
 @app.route('/update-progress', methods=['POST'])
 def update_progress():
@@ -523,26 +940,95 @@ def update_progress():
         data = request.json
         user_id = data.get('user_id', 'default')
         difficulty = data.get('difficulty', 'easy')
+        category, concept, difficulty = attempt_key(data.get('problem_id'), data, difficulty)
         
         # Update progress
-        update_user_progress(user_id, difficulty)
+        progress = update_user_progress(user_id, difficulty, category, concept, solved=data.get('solved', True))
         
         return jsonify({
             'success': True,
-            'current_difficulty': user_progress[user_id]['current_difficulty'],
-            'progress': {
-                'easy_solved': user_progress[user_id]['easy_solved'],
-                'medium_solved': user_progress[user_id]['medium_solved'],
-                'hard_solved': user_progress[user_id]['hard_solved']
-            }
+            'current_difficulty': progress['current_difficulty'],
+            'progress': progress_payload(progress)
         })
     except Exception as e:
-        print(f"Error updating progress: {str(e)}")  # Add logging
+        logger.exception("Error updating progress")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.before_request
+def start_timer():
+    g.request_started = time.monotonic()
+    metrics.inc('http_requests_in_flight')
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    # Streaming responses are timed to their first byte here; the stream itself is in the LLM metrics
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('http_request_duration_seconds', time.monotonic() - started, route=route)
+    metrics.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request(error=None):
+    if 'request_started' in g:
+        metrics.dec('http_requests_in_flight')
+
+def collect_cache_metrics():
+    """Hit/miss counters the caches already keep, exported at snapshot time"""
+    help_text = 'Cache lookups by cache and result'
+    cache = response_cache.stats()
+    bank = problem_bank.stats()
+    intents = get_intent_classifier().stats()
+    runs = run_cache.stats()
+    return [
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'tutor_response', 'result': 'exact_hit'}, cache['exact_hits']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'tutor_response', 'result': 'near_hit'}, cache['near_hits']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'tutor_response', 'result': 'miss'}, cache['misses']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'problem_bank', 'result': 'hit'}, bank['hits']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'problem_bank', 'result': 'miss'}, bank['misses']),
+        ('cache_entries', metrics.GAUGE, 'Entries held by each cache', {'cache': 'tutor_response'}, cache['entries']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'run_result', 'result': 'hit'}, runs['hits']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'run_result', 'result': 'miss'}, runs['misses']),
+        ('cache_requests_total', metrics.COUNTER, help_text, {'cache': 'run_result', 'result': 'uncacheable'}, runs['uncacheable']),
+        ('cache_entries', metrics.GAUGE, 'Entries held by each cache', {'cache': 'problem_bank'}, bank['ready']),
+        ('cache_entries', metrics.GAUGE, 'Entries held by each cache', {'cache': 'run_result'}, runs['entries']),
+        ('intent_llm_calls_avoided_total', metrics.COUNTER, 'Tutor messages answered without the model', {}, intents['llm_calls_avoided']),
+        ('llm_retries_total', metrics.COUNTER, 'Upstream calls retried after rate limits or server errors', {}, llm.stats()['retries'])
+    ]
+
+metrics.add_collector(collect_cache_metrics)
+metrics.start()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def warmup():
+    """Pay the one-off startup costs before the first request does.
+
+    Builds the LLM client and opens its first upstream connection, spawns the
+    sandbox workers and trains the intent classifier. Called by the gunicorn
+    worker hook once the app is loaded; safe to call more than once.
+    """
+    if not WARMUP:
+        return None
+    started = time.monotonic()
+    timings = {}
+    for name, step in (('llm', llm.warmup), ('sandbox', get_sandbox_pool().start), ('intents', get_intent_classifier)):
+        step_started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warmup step %s failed: %s", name, e)
+        timings[name] = round((time.monotonic() - step_started) * 1000, 1)
+    logger.info("Worker warmed up in %.0f ms %s", (time.monotonic() - started) * 1000, timings)
+    return timings
+
 if __name__ == '__main__':
+    warmup()
     port = int(os.environ.get('PORT', 5001))
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
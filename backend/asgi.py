@@ -0,0 +1,365 @@
+"""ASGI serving mode.
+
+The routes that spend their time waiting on the LLM (``/ai``, ``/ai/stream``,
+``/generate-question`` and ``/api/<agent>``) are served by async handlers on
+the async LLM gateway, so one worker holds hundreds of open model calls and
+streams without a thread each. ``/run``, ``/run/stream`` and
+``/submit-solution`` block on a sandbox process and run the Flask views on a
+dedicated thread pool of ``ASGI_RUN_THREADS``. Every other route falls
+through to the Flask app on a pool of ``ASGI_WSGI_THREADS``, so paths,
+payloads and status codes are the same in both modes.
+
+The async routes go through the same admission controller as the Flask
+routes; while queued for a work slot they hold no thread. They get the same
+deadlines too, and their handler task is cancelled when the client
+disconnects, which aborts the upstream call.
+
+Run with ``gunicorn -c gunicorn_asgi_config.py asgi:app`` or, for a single
+process, ``uvicorn asgi:app --port 5001``.
+"""
+import asyncio
+import functools
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+import metrics
+from admission import AdmissionRejected, caller_identity, ADMISSION_CONTROL
+from agents import async_ask_agent, async_stream_agent, get_agent, UnknownAgent
+from deadlines import (Deadline, RequestCancelled, client_timeout, CANCEL_ON_DISCONNECT, DEADLINE, DISCONNECT,
+                       DEADLINE_HEADER)
+import deadlines
+from llm import LLMDeadlineExceeded, LLMOverloaded
+from router import router
+from problem_verifier import REJECTED
+from tutor import async_get_tutor_response, async_stream_tutor_response
+
+ASGI_RUN_THREADS = int(os.getenv('ASGI_RUN_THREADS', 16))
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 16))
+
+session_store = flask_app.session_store
+admission = flask_app.admission
+problem_bank = flask_app.problem_bank
+sse_event = flask_app.sse_event
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+# How long a handler may run past its deadline before it is cancelled, so
+# the gateway's own deadline error gets to answer first
+_DEADLINE_GRACE_SECONDS = 1
+
+
+def instrumented(route):
+    """Record the route metrics the Flask hooks record for WSGI routes"""
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            started = time.monotonic()
+            status = 500
+            metrics.inc('http_requests_in_flight')
+            try:
+                response = await endpoint(request)
+                status = response.status_code
+                return response
+            finally:
+                metrics.dec('http_requests_in_flight')
+                metrics.observe('http_request_duration_seconds', time.monotonic() - started, route=route)
+                metrics.inc('http_requests_total', route=route, method=request.method, status=status)
+        return wrapper
+    return decorate
+
+
+async def json_body(request):
+    try:
+        return await request.json() or {}
+    except ValueError:
+        return {}
+
+
+class ReleasingResponse:
+    """Sends ``response``, then frees its admission slot, also when the client went away"""
+
+    def __init__(self, response, ticket):
+        self.response = response
+        self.ticket = ticket
+        self.status_code = response.status_code
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.response(scope, receive, send)
+        finally:
+            self.ticket.release()
+
+
+def cancelled_response(kind, reason):
+    deadlines.record(kind, reason)
+    return JSONResponse({
+        'success': False,
+        'error': str(RequestCancelled(reason))
+    }, status_code=504 if reason == DEADLINE else 499)
+
+
+async def disconnected(request):
+    """Return once the client has gone away; the body must have been read already"""
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+
+
+def with_deadline(kind):
+    """``app.with_deadline`` for async endpoints, in ``request.state.deadline``.
+
+    The handler runs as a task that is cancelled, along with its upstream
+    calls, when the client disconnects or the deadline has passed.
+    """
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            deadline = request.state.deadline = Deadline(kind, client_timeout(request.headers.get(DEADLINE_HEADER)))
+            # Read up front so the disconnect watcher is the only reader left
+            await request.body()
+            handler = asyncio.ensure_future(endpoint(request))
+            tasks = {handler}
+            if CANCEL_ON_DISCONNECT:
+                watcher = asyncio.ensure_future(disconnected(request))
+                tasks.add(watcher)
+            try:
+                done, _ = await asyncio.wait(tasks, timeout=deadline.remaining() + _DEADLINE_GRACE_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                deadline.abandon(DISCONNECT)
+                handler.cancel()
+                raise
+            finally:
+                for task in tasks - {handler}:
+                    task.cancel()
+            if handler in done:
+                return handler.result()
+            # Work the handler left running in a thread sees this through deadline.cancelled()
+            reason = deadline.abandon(DISCONNECT if done else DEADLINE)
+            handler.cancel()
+            return cancelled_response(kind, reason)
+        return wrapper
+    return decorate
+
+
+def admitted(kind):
+    """``app.admitted`` for async endpoints"""
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            if not ADMISSION_CONTROL:
+                return await endpoint(request)
+            identity = caller_identity(request.headers.get('x-forwarded-for'),
+                                       request.client.host if request.client else None)
+            try:
+                ticket = await admission.async_admit(kind, identity)
+            except AdmissionRejected as e:
+                return JSONResponse({
+                    'success': False,
+                    'error': str(e)
+                }, status_code=429, headers={'Retry-After': str(e.retry_after)})
+            try:
+                response = await endpoint(request)
+            except BaseException:
+                ticket.release()
+                raise
+            return ReleasingResponse(response, ticket)
+        return wrapper
+    return decorate
+
+
+@instrumented('/ai')
+@with_deadline('ai')
+@admitted('ai')
+async def ai(request):
+    try:
+        data = await json_body(request)
+        question = data.get('question', '')
+        user_id = data.get('user_id', 'default')
+
+        # The session store may be SQLite, which blocks
+        history = await run_in_threadpool(session_store.get_history, user_id)
+        response = await async_get_tutor_response(
+            question_type=data.get('type', 'general'),
+            problem=data.get('problem', ''),
+            code=data.get('code', ''),
+            question=question,
+            history=history,
+            deadline=request.state.deadline
+        )
+        await run_in_threadpool(session_store.append_history, user_id, question, response)
+
+        return JSONResponse({
+            'success': True,
+            'response': response
+        })
+    except LLMDeadlineExceeded:
+        return cancelled_response('ai', DEADLINE)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'error': str(e)
+        }, status_code=500)
+
+
+@instrumented('/ai/stream')
+@with_deadline('ai')
+@admitted('ai')
+async def ai_stream(request):
+    data = await json_body(request)
+    question = data.get('question', '')
+    user_id = data.get('user_id', 'default')
+    history = await run_in_threadpool(session_store.get_history, user_id)
+
+    async def generate():
+        tokens = []
+        try:
+            async for token in async_stream_tutor_response(
+                question_type=data.get('type', 'general'),
+                problem=data.get('problem', ''),
+                code=data.get('code', ''),
+                question=question,
+                history=history,
+                deadline=request.state.deadline
+            ):
+                tokens.append(token)
+                yield sse_event({'token': token})
+        except Exception as e:
+            yield sse_event({'success': False, 'error': str(e)}, event='error')
+            return
+
+        response = ''.join(tokens).strip()
+        await run_in_threadpool(session_store.append_history, user_id, question, response)
+        yield sse_event({'success': True, 'response': response}, event='done')
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def async_generate_problem(category, concept, difficulty, deadline=None):
+    """``generate_problem`` on the async gateway; parsing and verification run in a thread"""
+    key = (category, concept, difficulty)
+    params = deadline.llm_params(watch=False) if deadline is not None else {}
+    for _ in range(flask_app.PROBLEM_GENERATE_ATTEMPTS):
+        completion = await router.async_complete(
+            flask_app.problem_messages(*key),
+            flask_app.PROBLEM_TIER,
+            'problem',
+            **flask_app.PROBLEM_PARAMS,
+            **params
+        )
+        status, record = await run_in_threadpool(flask_app.check_problem, completion.choices[0].message.content, key,
+                                                 deadline)
+        if status != REJECTED:
+            break
+    return flask_app.problem_payload(record, key, status)
+
+
+@instrumented('/generate-question')
+@with_deadline('generate_question')
+@admitted('generate_question')
+async def generate_question(request):
+    deadline = request.state.deadline
+    try:
+        user_id, key, is_advanced = await run_in_threadpool(flask_app.question_request, request.query_params)
+    except ValueError as e:
+        return JSONResponse({
+            'success': False,
+            'error': str(e)
+        }, status_code=400)
+    try:
+        if not flask_app.is_bank_key(*key):
+            question = await async_generate_problem(*key, deadline=deadline)
+        else:
+            question = problem_bank.take_ready(user_id, key)
+            if question is None:
+                question = problem_bank.served(user_id, key, await async_generate_problem(*key, deadline=deadline))
+
+        return JSONResponse(flask_app.question_payload(question, key, is_advanced))
+    except RequestCancelled as e:
+        return cancelled_response('generate_question', e.reason)
+    except LLMDeadlineExceeded:
+        return cancelled_response('generate_question', DEADLINE)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'error': str(e)
+        }, status_code=500)
+
+
+@instrumented('/api/<agent>')
+@with_deadline('agent')
+@admitted('agent')
+async def agent_route(request):
+    """Portfolio agents (welcome, project, career, client, research, ...)"""
+    agent = request.path_params['agent']
+    data = await json_body(request)
+    message = data.get('message', '')
+
+    try:
+        get_agent(agent)
+    except UnknownAgent as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+    if data.get('stream'):
+        async def generate():
+            tokens = []
+            try:
+                async for token in async_stream_agent(agent, message, request.state.deadline.at):
+                    tokens.append(token)
+                    yield sse_event({'token': token})
+            except Exception as e:
+                yield sse_event({'success': False, 'error': str(e)}, event='error')
+                return
+            yield sse_event({'success': True, 'response': ''.join(tokens)}, event='done')
+
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    try:
+        return JSONResponse({"response": await async_ask_agent(agent, message, request.state.deadline.at)})
+    except LLMDeadlineExceeded as e:
+        deadlines.record('agent', DEADLINE)
+        return JSONResponse({"error": str(e)}, status_code=504)
+    except LLMOverloaded as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+# Sandbox routes block for the whole run, so they get their own threads and
+# can't starve the cheap Flask routes
+sandbox_routes = WSGIMiddleware(flask_app.app, workers=ASGI_RUN_THREADS)
+flask_routes = WSGIMiddleware(flask_app.app, workers=ASGI_WSGI_THREADS)
+
+app = Starlette(
+    routes=[
+        Route('/ai', ai, methods=['POST']),
+        Route('/ai/stream', ai_stream, methods=['POST']),
+        Route('/generate-question', generate_question, methods=['GET']),
+        # /api/stats is a Flask route
+        Route('/api/{agent:str}', agent_route, methods=['POST']),
+        Route('/run', sandbox_routes, methods=['POST']),
+        Route('/run/stream', sandbox_routes, methods=['POST']),
+        Route('/submit-solution', sandbox_routes, methods=['POST']),
+        Mount('', app=flask_routes)
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=[origin for origin in flask_app.CORS_ORIGINS if '*' not in origin],
+            allow_origin_regex=r"https://.*\.netlify\.app",
+            allow_methods=flask_app.CORS_METHODS,
+            allow_headers=flask_app.CORS_HEADERS
+        )
+    ]
+)
@@ -0,0 +1,202 @@
+"""Measure worker cold start: import time and first-request latency.
+
+Every sample is a fresh Python process doing what a gunicorn worker does
+after fork: import ``app``, run ``app.warmup()`` (``warm`` mode only), then
+serve its first ``/ai``, ``/run`` and ``/generate-question`` requests
+through the Flask test client against the mock Groq API. Comparing the
+``cold`` and ``warm`` modes shows what the warmup moves out of the first
+requests.
+
+Results are written as JSON; ``--baseline`` compares against an earlier
+run, and ``--max-import-ms`` / ``--max-first-request-ms`` make the run fail
+when a cold start got slower than the budget.
+
+Run from ``backend/``::
+
+    python bench/cold_start.py --samples 5
+    python bench/cold_start.py --baseline bench/results/<earlier>.json --max-import-ms 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from mock_groq import add_arguments, config_from_args, start_mock_server
+from run_bench import BACKEND_DIR, RESULTS_DIR, _delta, _git_commit
+
+# The first request of each kind, in the order a worker is likely to see them
+FIRST_REQUESTS = {
+    'ai': ('POST', '/ai', {
+        'problem': "Two Sum: return indices of the two numbers that add up to target.",
+        'code': "def two_sum(nums, target):\n    return []\n",
+        'question': "Why does this always return an empty list?",
+        'type': 'debug',
+        'user_id': 'cold-start'
+    }),
+    'run': ('POST', '/run', {'code': "print(sum(range(1000)))"}),
+    'generate_question': ('GET', '/generate-question?user_id=cold-start&category=data_structures', None)
+}
+
+MODES = ('cold', 'warm')
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def measure(warm):
+    """One sample, run inside the child process"""
+    started = time.perf_counter()
+    import app
+    sample = {'import_ms': _ms(started)}
+    if warm:
+        step_started = time.perf_counter()
+        app.warmup()
+        sample['warmup_ms'] = _ms(step_started)
+
+    client = app.app.test_client()
+    sample['first_request_ms'] = {}
+    sample['errors'] = []
+    for name, (method, path, body) in FIRST_REQUESTS.items():
+        request_started = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        sample['first_request_ms'][name] = _ms(request_started)
+        if response.status_code >= 400:
+            sample['errors'].append(f"{name}: HTTP {response.status_code}")
+    sample['total_ms'] = _ms(started)
+    app.get_sandbox_pool().close()
+    return sample
+
+
+def run_sample(warm, mock_url, extra_env):
+    env = dict(os.environ, GROQ_API_KEY='bench', GROQ_BASE_URL=mock_url, PYTHONPATH=BACKEND_DIR,
+               LOG_LEVEL='WARNING', **extra_env)
+    command = [sys.executable, os.path.abspath(__file__), '--child'] + (['--child-warm'] if warm else [])
+    output = subprocess.check_output(command, cwd=BACKEND_DIR, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    """Median of every measurement across samples"""
+    summary = {'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2)}
+    if 'warmup_ms' in samples[0]:
+        summary['warmup_ms'] = round(statistics.median(s['warmup_ms'] for s in samples), 2)
+    summary['first_request_ms'] = {
+        name: round(statistics.median(s['first_request_ms'][name] for s in samples), 2)
+        for name in FIRST_REQUESTS
+    }
+    summary['total_ms'] = round(statistics.median(s['total_ms'] for s in samples), 2)
+    summary['errors'] = sorted({error for s in samples for error in s['errors']})
+    return summary
+
+
+def compare(result, baseline):
+    """Print cold-start changes against an earlier result"""
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    for mode in MODES:
+        current, previous = result[mode], baseline.get(mode)
+        if not previous:
+            continue
+        parts = [f"{mode:5}", _delta('import', current['import_ms'], previous['import_ms'])]
+        for name in FIRST_REQUESTS:
+            parts.append(_delta(name, current['first_request_ms'][name], previous['first_request_ms'].get(name)))
+        print('  '.join(parts))
+
+
+def _print_table(result):
+    names = list(FIRST_REQUESTS)
+    print(f"{'mode':6} {'import ms':>10} {'warmup ms':>10} " + ' '.join(f"{name + ' ms':>22}" for name in names))
+    for mode in MODES:
+        summary = result[mode]
+        print(f"{mode:6} {summary['import_ms']:>10} {summary.get('warmup_ms', '-'):>10} "
+              + ' '.join(f"{summary['first_request_ms'][name]:>22}" for name in names))
+        for error in summary['errors']:
+            print(f"       error: {error}")
+
+
+def check_budgets(result, max_import_ms, max_first_request_ms):
+    """Budget violations; the first-request budget applies to warmed-up workers"""
+    failures = []
+    for mode in MODES:
+        if max_import_ms is not None and result[mode]['import_ms'] > max_import_ms:
+            failures.append(f"{mode} import took {result[mode]['import_ms']} ms (budget {max_import_ms} ms)")
+    if max_first_request_ms is not None:
+        for name, latency in result['warm']['first_request_ms'].items():
+            if latency > max_first_request_ms:
+                failures.append(f"first {name} request took {latency} ms (budget {max_first_request_ms} ms)")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=5, help='Fresh processes per mode')
+    parser.add_argument('--output', help='Result file (default: bench/results/cold-start-<timestamp>-<commit>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare against')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if importing app takes longer')
+    parser.add_argument('--max-first-request-ms', type=float,
+                        help='Fail if a first request after warmup takes longer')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the backend, e.g. --env SANDBOX_WORKERS=2')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--child-warm', action='store_true', help=argparse.SUPPRESS)
+    add_arguments(parser)
+    # Upstream latency would only add noise to the cold-start numbers
+    parser.set_defaults(latency_ms=0, jitter_ms=0, tokens_per_second=100000)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child_warm)))
+        return
+
+    config = config_from_args(args)
+    mock = start_mock_server(config)
+    mock_url = f"http://127.0.0.1:{mock.server_address[1]}"
+    extra_env = dict(item.split('=', 1) for item in args.env)
+
+    try:
+        # Interleave the modes so drift on the host affects both alike
+        samples = {mode: [] for mode in MODES}
+        for _ in range(args.samples):
+            for mode in MODES:
+                samples[mode].append(run_sample(mode == 'warm', mock_url, extra_env))
+    finally:
+        mock.shutdown()
+
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    commit = _git_commit()
+    result = {
+        'timestamp': timestamp,
+        'commit': commit,
+        'config': {
+            'samples': args.samples,
+            'env': extra_env,
+            'mock': vars(config)
+        }
+    }
+    for mode in MODES:
+        result[mode] = summarize(samples[mode])
+
+    output = args.output or os.path.join(RESULTS_DIR, f"cold-start-{timestamp}-{commit or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    _print_table(result)
+    print(f"\nSaved results to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+    failures = check_budgets(result, args.max_import_ms, args.max_first_request_ms)
+    for failure in failures:
+        print(f"Budget exceeded: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
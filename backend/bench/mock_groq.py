@@ -0,0 +1,265 @@
+"""Local stand-in for the Groq chat-completions API.
+
+Answers ``POST /openai/v1/chat/completions`` (streaming and non-streaming)
+with a configurable time to first token, token rate and error injection, so
+the backend can be load-tested without spending Groq quota. ``GET
+/openai/v1/models`` answers the worker warmup request. Point the backend at
+it with ``GROQ_BASE_URL=http://127.0.0.1:<port>``.
+
+Run standalone::
+
+    python bench/mock_groq.py --port 8900 --latency-ms 300 --tokens-per-second 250 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Returned for problem-generation prompts so parsing and verification do real work
+PROBLEM_TEXT = """Title: Pair Sum Count {n}
+
+Description:
+Given an array of integers nums and an integer k, return how many pairs (i, j) with i < j satisfy nums[i] + nums[j] == k.
+
+Examples:
+Input: nums = [1, 2, 3, 4], k = 5
+Output: 2
+Explanation: (1, 4) and (2, 3) add up to 5.
+
+Input: nums = [1, 1, 1], k = 2
+Output: 3
+Explanation: Every pair adds up to 2.
+
+Constraints:
+- 0 <= len(nums) <= 10^4
+- -10^9 <= nums[i], k <= 10^9
+
+Reference Solution:
+```python
+def solve(nums, k):
+    seen = {{}}
+    count = 0
+    for x in nums:
+        count += seen.get(k - x, 0)
+        seen[x] = seen.get(x, 0) + 1
+    return count
+```"""
+
+_WORDS = ('the', 'loop', 'index', 'value', 'list', 'returns', 'check', 'when', 'your', 'code', 'case', 'edge',
+          'empty', 'input', 'because', 'each', 'element', 'step', 'first', 'then')
+
+
+class MockConfig:
+    def __init__(self, latency_ms=300, jitter_ms=50, tokens_per_second=250, completion_tokens=150,
+                 error_rate=0.0, error_status=429):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'streams': self.streams,
+                'errors': self.errors,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens
+            }
+
+
+def _reply_text(messages, tokens):
+    system = next((m['content'] for m in messages if m.get('role') == 'system'), '')
+    last = messages[-1]['content'] if messages else ''
+    if 'Reference Solution' in system or 'Reference Solution' in last:
+        return PROBLEM_TEXT.format(n=random.randint(1, 10 ** 6))
+    return ' '.join(random.choice(_WORDS) for _ in range(tokens)).capitalize() + '.'
+
+
+def _chunks(text, count):
+    words = text.split(' ')
+    size = max(1, len(words) // max(1, count))
+    return [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = MockConfig()
+    stats = MockStats()
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # Clients drop idle keep-alive connections when they exit
+            pass
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.stats.to_dict())
+        elif self.path.endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+
+        config = self.config
+        self.stats.add(requests=1)
+        delay = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+        time.sleep(delay)
+        if random.random() < config.error_rate:
+            self.stats.add(errors=1)
+            self._send_json(config.error_status, {'error': {'message': 'Injected error', 'type': 'mock_error'}},
+                            headers={'retry-after': '0'} if config.error_status == 429 else None)
+            return
+
+        messages = body.get('messages', [])
+        tokens = min(config.completion_tokens, body.get('max_tokens') or config.completion_tokens)
+        text = _reply_text(messages, tokens)
+        usage = {
+            'prompt_tokens': sum(len(m.get('content', '')) for m in messages) // 4,
+            'completion_tokens': len(text) // 4,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        self.stats.add(prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get('model', 'mock')
+
+        if body.get('stream'):
+            self.stats.add(streams=1)
+            self._stream(completion_id, model, text, usage)
+            return
+
+        # Non-streaming replies still take as long as generating every token
+        time.sleep(usage['completion_tokens'] / config.tokens_per_second)
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': usage
+        })
+
+    def _stream(self, completion_id, model, text, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = _chunks(text, usage['completion_tokens'])
+        interval = usage['completion_tokens'] / self.config.tokens_per_second / max(1, len(pieces))
+        try:
+            for index, piece in enumerate(pieces):
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+                }
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                if index < len(pieces) - 1:
+                    time.sleep(interval)
+            final = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                'x_groq': {'id': completion_id, 'usage': usage}
+            }
+            self._write_chunk(f"data: {json.dumps(final)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start_mock_server(config, host='127.0.0.1', port=0):
+    """Serve the mock API from a background thread; returns the server"""
+    handler = type('ConfiguredMockGroqHandler', (MockGroqHandler,), {'config': config, 'stats': MockStats()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-groq', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=300, help='Time to first token')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='Uniform jitter on the latency')
+    parser.add_argument('--tokens-per-second', type=float, default=250, help='Generation speed after the first token')
+    parser.add_argument('--completion-tokens', type=int, default=150, help='Tokens per reply (capped by max_tokens)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=429, help='HTTP status of injected failures')
+
+
+def config_from_args(args):
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = start_mock_server(config_from_args(args), args.host, args.port)
+    print(f"Mock Groq API listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,323 @@
+"""Load-test the backend offline against the mock Groq API.
+
+Boots ``app:app`` under gunicorn with the real ``gunicorn_config.py``,
+points it at a local mock chat-completions server, replays a weighted mix of
+``/ai``, ``/run``, ``/generate-question`` and ``/update-progress`` traffic
+and reports throughput, p50/p95/p99 latency and error rates per endpoint.
+Results are written as JSON; ``--baseline`` compares against an earlier run.
+
+Run from ``backend/``::
+
+    python bench/run_bench.py --duration 60 --concurrency 32
+    python bench/run_bench.py --baseline bench/results/<earlier>.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from mock_groq import add_arguments, config_from_args, start_mock_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'bench', 'results')
+
+# Endpoint -> share of the traffic mix
+DEFAULT_MIX = {'ai': 50, 'run': 25, 'generate_question': 15, 'update_progress': 10}
+
+PROBLEMS = [
+    "Two Sum: return indices of the two numbers that add up to target.",
+    "Valid Parentheses: decide whether the brackets in s are balanced.",
+    "Merge Intervals: merge all overlapping intervals.",
+    "Climbing Stairs: count the distinct ways to climb n stairs taking 1 or 2 steps."
+]
+CODES = [
+    "def two_sum(nums, target):\n    for i in range(len(nums)):\n        for j in range(len(nums)):\n            if nums[i] + nums[j] == target:\n                return [i, j]\n",
+    "def is_valid(s):\n    stack = []\n    for c in s:\n        stack.append(c)\n    return not stack\n",
+    "def climb(n):\n    return climb(n - 1) + climb(n - 2)\n"
+]
+QUESTIONS = [
+    ("debug", "Why does this return the same index twice?"),
+    ("debug", "My function never returns, what is wrong?"),
+    ("explain", "Can you explain the approach?"),
+    ("concept", "What is a hash map and when should I use one?"),
+    ("general", "How can I make this faster?"),
+    ("general", "thanks"),
+    ("general", "hi")
+]
+RUN_PROGRAMS = [
+    "print(sum(range(1000)))",
+    "import math\nprint(math.factorial(50))",
+    "nums = [5, 3, 8, 1]\nnums.sort()\nprint(nums)",
+    "total = 0\nfor i in range(200000):\n    total += i * i\nprint(total)",
+    "print(1 / 0)"
+]
+
+
+def _ai_request(rng, user_id):
+    question_type, question = rng.choice(QUESTIONS)
+    # A third of the questions are unique so the response cache doesn't serve everything
+    if rng.random() < 0.33:
+        question = f"{question} (attempt {rng.randint(1, 10 ** 9)})"
+    return 'POST', '/ai', {
+        'problem': rng.choice(PROBLEMS),
+        'code': rng.choice(CODES),
+        'question': question,
+        'type': question_type,
+        'user_id': user_id
+    }
+
+
+def _run_request(rng, user_id):
+    return 'POST', '/run', {'code': rng.choice(RUN_PROGRAMS)}
+
+
+def _generate_question_request(rng, user_id):
+    if rng.random() < 0.5:
+        return 'GET', f"/generate-question?user_id={user_id}&use_advanced=true", None
+    return 'GET', f"/generate-question?user_id={user_id}&category=data_structures", None
+
+
+def _update_progress_request(rng, user_id):
+    return 'POST', '/update-progress', {'user_id': user_id, 'difficulty': rng.choice(('easy', 'medium', 'hard'))}
+
+
+REQUEST_BUILDERS = {
+    'ai': _ai_request,
+    'run': _run_request,
+    'generate_question': _generate_question_request,
+    'update_progress': _update_progress_request
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles (ms) and error rate of ``(latency, ok)`` samples"""
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': _round(percentile(latencies, 0.50)),
+            'p95': _round(percentile(latencies, 0.95)),
+            'p99': _round(percentile(latencies, 0.99)),
+            'max': _round(latencies[-1] if latencies else None),
+            'mean': _round(sum(latencies) / len(latencies) if latencies else None)
+        }
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def _request(connection, method, path, body):
+    """Send one request; only HTTP errors count as failures (a program raising in /run is a normal reply)"""
+    payload = json.dumps(body) if body is not None else None
+    headers = {'Content-Type': 'application/json'} if payload is not None else {}
+    connection.request(method, path, body=payload, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response.status < 400
+
+
+def run_load(port, mix, concurrency, duration, users, seed):
+    """Closed-loop load: ``concurrency`` clients send requests back to back"""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            method, path, body = REQUEST_BUILDERS[name](rng, f"bench-user-{rng.randrange(users)}")
+            started = time.monotonic()
+            try:
+                ok = _request(connection, method, path, body)
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            with lock:
+                samples[name].append((time.monotonic() - started, ok))
+        connection.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    everything = [sample for endpoint_samples in samples.values() for sample in endpoint_samples]
+    return {
+        'elapsed_seconds': round(elapsed, 2),
+        'overall': summarize(everything, elapsed),
+        'endpoints': {name: summarize(samples[name], elapsed) for name in names}
+    }
+
+
+def boot_backend(port, mock_url, extra_env):
+    """Start gunicorn with the real config and wait until it answers"""
+    env = dict(os.environ, GROQ_API_KEY='bench', GROQ_BASE_URL=mock_url, **extra_env)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f"127.0.0.1:{port}",
+         '--access-logfile', '/dev/null', 'app:app'],
+        cwd=BACKEND_DIR,
+        env=env,
+        start_new_session=True
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/run/stats')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_backend(process)
+    raise RuntimeError('gunicorn did not become ready within 60 seconds')
+
+
+def stop_backend(process):
+    if process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    """Print throughput and latency changes against an earlier result"""
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'} ({baseline.get('timestamp')}):")
+    for name, current in [('overall', result['overall'])] + sorted(result['endpoints'].items()):
+        previous = baseline['overall'] if name == 'overall' else baseline['endpoints'].get(name)
+        if not previous:
+            continue
+        parts = [f"{name:18}", _delta('rps', current['throughput_rps'], previous['throughput_rps'])]
+        for key in ('p50', 'p95', 'p99'):
+            parts.append(_delta(key, current['latency_ms'][key], previous['latency_ms'][key]))
+        parts.append(f"errors {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+        print('  '.join(parts))
+
+
+def _delta(label, current, previous):
+    if not current or not previous:
+        return f"{label} n/a"
+    return f"{label} {current} ({(current - previous) / previous:+.1%})"
+
+
+def _print_table(result):
+    print(f"{'endpoint':18} {'requests':>8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, summary in [('overall', result['overall'])] + sorted(result['endpoints'].items()):
+        latency = summary['latency_ms']
+        print(f"{name:18} {summary['requests']:>8} {summary['throughput_rps']:>8} "
+              f"{latency['p50'] or '-':>9} {latency['p95'] or '-':>9} {latency['p99'] or '-':>9} "
+              f"{summary['error_rate']:>7.2%}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in REQUEST_BUILDERS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load after warm-up')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds of load that are not measured')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent closed-loop clients')
+    parser.add_argument('--users', type=int, default=200, help='Distinct user ids in the traffic')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='Traffic weights, e.g. ai=50,run=25,generate_question=15,update_progress=10')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=10500, help='Port for the backend under test')
+    parser.add_argument('--output', help='Result file (default: bench/results/<timestamp>-<commit>.json)')
+    parser.add_argument('--baseline', help='Earlier result file to compare against')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the backend, e.g. --env GUNICORN_THREADS=32')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    config = config_from_args(args)
+    mock = start_mock_server(config)
+    mock_url = f"http://127.0.0.1:{mock.server_address[1]}"
+    extra_env = dict(item.split('=', 1) for item in args.env)
+
+    backend = boot_backend(args.port, mock_url, extra_env)
+    try:
+        if args.warmup > 0:
+            run_load(args.port, args.mix, args.concurrency, args.warmup, args.users, args.seed + 10 ** 6)
+        result = run_load(args.port, args.mix, args.concurrency, args.duration, args.users, args.seed)
+    finally:
+        stop_backend(backend)
+        mock.shutdown()
+
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    commit = _git_commit()
+    result = dict({
+        'timestamp': timestamp,
+        'commit': commit,
+        'config': {
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'concurrency': args.concurrency,
+            'users': args.users,
+            'mix': args.mix,
+            'seed': args.seed,
+            'env': extra_env,
+            'mock': vars(config)
+        },
+        'upstream': mock.RequestHandlerClass.stats.to_dict()
+    }, **result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}-{commit or 'nocommit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    _print_table(result)
+    print(f"\nSaved results to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Static checks on student code that need neither the sandbox nor the model.
+
+``analyze`` compiles the code and walks its syntax tree once, looking for
+syntax errors, names that are never bound, unreachable statements and
+``while True`` loops with no way out. Each finding is a small dict
+(``kind``, ``severity``, ``line``, ``column``, ``message``).
+
+Errors are findings that are certain to fail when the code runs as a
+script (a syntax error, an unbound name in a top-level statement, an
+endless top-level loop), so ``/run`` answers them without starting a
+sandbox. Everything else is a warning; both are passed to the debug tutor
+as hints.
+"""
+import ast
+import builtins
+import os
+import threading
+
+STATIC_ANALYSIS = os.getenv('STATIC_ANALYSIS', 'true').lower() == 'true'
+STATIC_ANALYSIS_MAX_FINDINGS = int(os.getenv('STATIC_ANALYSIS_MAX_FINDINGS', 10))
+
+ERROR = 'error'
+WARNING = 'warning'
+
+SYNTAX_ERROR = 'syntax_error'
+UNDEFINED_NAME = 'undefined_name'
+UNREACHABLE_CODE = 'unreachable_code'
+INFINITE_LOOP = 'infinite_loop'
+
+_BUILTIN_NAMES = frozenset(dir(builtins)) | {'__file__', '__builtins__', '__annotations__'}
+_COMPOUND = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor, ast.While,
+             ast.Try, ast.With, ast.AsyncWith, ast.Match)
+_SCOPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)
+_LOOPS = (ast.For, ast.AsyncFor, ast.While)
+_TERMINATORS = (ast.Return, ast.Raise, ast.Break, ast.Continue)
+# Builtins that can't end a loop; any other call may raise or exit
+_SAFE_FUNCTIONS = {'print', 'len', 'str', 'repr', 'bool', 'type', 'isinstance', 'id', 'abs'}
+# Code that can bind names the analysis can't see
+_DYNAMIC_NAMES = {'globals', 'locals', 'vars', 'exec', 'eval', 'setattr', '__import__', '__builtins__', 'builtins'}
+# Expressions whose body doesn't run where it is written
+_DEFERRED = (ast.Lambda, ast.GeneratorExp)
+
+_stats_lock = threading.Lock()
+_stats = {
+    'analyzed': 0,
+    'blocked': 0,
+    SYNTAX_ERROR: 0,
+    UNDEFINED_NAME: 0,
+    UNREACHABLE_CODE: 0,
+    INFINITE_LOOP: 0
+}
+
+
+def _finding(kind, severity, node, message):
+    return {
+        'kind': kind,
+        'severity': severity,
+        'line': getattr(node, 'lineno', None),
+        'column': getattr(node, 'col_offset', None),
+        'message': message
+    }
+
+
+def _bound_names(tree):
+    """Every name the code binds anywhere, or ``None`` after a star import"""
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            bound.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == '*':
+                    return None
+                bound.add(alias.asname or alias.name.split('.')[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound.update(node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            bound.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            bound.add(node.rest)
+    return bound
+
+
+def _walk_eager(node):
+    """``ast.walk`` without the bodies of lambdas and generator expressions"""
+    yield node
+    for child in ast.iter_child_nodes(node):
+        if not isinstance(child, _DEFERRED):
+            yield from _walk_eager(child)
+
+
+def _undefined_names(tree):
+    # Scope- and flow-insensitive: only names bound nowhere are reported
+    bound = _bound_names(tree)
+    if bound is None:
+        return []
+    # Names in top-level simple statements run unconditionally, unless the
+    # code binds names dynamically
+    dynamic = any(isinstance(node, ast.Name) and node.id in _DYNAMIC_NAMES
+                  or isinstance(node, ast.alias) and node.name == 'builtins'
+                  for node in ast.walk(tree))
+    certain = set() if dynamic else {
+        id(node) for statement in tree.body if not isinstance(statement, _COMPOUND)
+        for node in _walk_eager(statement)
+    }
+    findings = []
+    reported = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+                and node.id not in bound and node.id not in _BUILTIN_NAMES and node.id not in reported):
+            reported.add(node.id)
+            severity = ERROR if id(node) in certain else WARNING
+            findings.append(_finding(UNDEFINED_NAME, severity, node, f"name '{node.id}' is not defined"))
+    return findings
+
+
+def _statement_lists(tree):
+    for node in ast.walk(tree):
+        for field in ('body', 'orelse', 'finalbody'):
+            statements = getattr(node, field, None)
+            if isinstance(statements, list) and statements and isinstance(statements[0], ast.stmt):
+                yield statements
+        if isinstance(node, ast.Match):
+            for case in node.cases:
+                yield case.body
+
+
+def _unreachable_code(tree):
+    findings = []
+    for statements in _statement_lists(tree):
+        for previous, statement in zip(statements, statements[1:]):
+            if isinstance(previous, _TERMINATORS):
+                keyword = type(previous).__name__.lower()
+                findings.append(_finding(UNREACHABLE_CODE, WARNING, statement,
+                                         f"unreachable code after '{keyword}' on line {previous.lineno}"))
+                break
+    return findings
+
+
+def _exits(node, defined, nested_loop=False):
+    """Whether ``node`` can leave the loop it is in"""
+    # Failed asserts, out-of-range subscripts and calls end the loop by raising
+    if isinstance(node, (ast.Return, ast.Raise, ast.Yield, ast.YieldFrom, ast.Await, ast.Assert, ast.Subscript)):
+        return True
+    if isinstance(node, ast.Break):
+        # A break in a nested loop only ends that loop
+        return not nested_loop
+    if isinstance(node, ast.Call):
+        function = node.func
+        if not isinstance(function, ast.Name) or function.id not in _SAFE_FUNCTIONS or function.id in defined:
+            return True
+    return any(
+        _exits(child, defined, nested_loop or isinstance(child, _LOOPS))
+        for child in ast.iter_child_nodes(node)
+        # Nested functions and classes don't run as part of the loop body
+        if not isinstance(child, _SCOPES)
+    )
+
+
+def _infinite_loops(tree):
+    # A user-defined function may shadow a safe builtin
+    defined = {node.name for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    top_level = {id(statement) for statement in tree.body}
+    findings = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.While) and isinstance(node.test, ast.Constant) and node.test.value
+                and not any(_exits(statement, defined) for statement in node.body)):
+            severity = ERROR if id(node) in top_level else WARNING
+            findings.append(_finding(INFINITE_LOOP, severity, node,
+                                     "'while True' loop never breaks, returns or raises"))
+    return findings
+
+
+def analyze(code):
+    """Findings for ``code``, errors first, in source order"""
+    try:
+        tree = ast.parse(code, '<string>')
+        # The compiler catches a few errors the parser doesn't ('return' outside function, ...)
+        compile(tree, '<string>', 'exec')
+    except SyntaxError as e:
+        findings = [{
+            'kind': SYNTAX_ERROR,
+            'severity': ERROR,
+            'line': e.lineno,
+            'column': e.offset,
+            'message': e.msg
+        }]
+    except ValueError as e:
+        findings = [{'kind': SYNTAX_ERROR, 'severity': ERROR, 'line': None, 'column': None, 'message': str(e)}]
+    else:
+        findings = _undefined_names(tree) + _unreachable_code(tree) + _infinite_loops(tree)
+        findings.sort(key=lambda f: (f['severity'] != ERROR, f['line'] or 0, f['column'] or 0))
+        findings = findings[:STATIC_ANALYSIS_MAX_FINDINGS]
+
+    with _stats_lock:
+        _stats['analyzed'] += 1
+        for finding in findings:
+            _stats[finding['kind']] += 1
+    return findings
+
+
+def first_error(findings):
+    """The finding that makes running the code pointless, or ``None``"""
+    return next((finding for finding in findings if finding['severity'] == ERROR), None)
+
+
+def error_result(finding, findings):
+    """A ``/run`` result for code that fails static analysis"""
+    with _stats_lock:
+        _stats['blocked'] += 1
+    location = f" (line {finding['line']})" if finding['line'] else ''
+    name = ''.join(word.capitalize() for word in finding['kind'].split('_'))
+    return {
+        'success': False,
+        'error': f"{name}: {finding['message']}{location}",
+        'traceback': '',
+        'output': '',
+        'analysis': findings
+    }
+
+
+def format_hints(findings):
+    """One compact line per finding for the tutor prompt"""
+    return '\n'.join(
+        f"- line {finding['line']}: {finding['message']}" if finding['line'] else f"- {finding['message']}"
+        for finding in findings
+    )
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
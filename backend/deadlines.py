@@ -0,0 +1,151 @@
+"""Per-request deadlines and cancellation of abandoned work.
+
+Every LLM- and sandbox-bound request gets a deadline: its route's default
+(``DEADLINE_<KIND>_SECONDS``), or what the client asks for in the
+``X-Request-Timeout`` header, up to ``DEADLINE_MAX_SECONDS``. The deadline
+is passed down as an absolute ``time.monotonic()`` value, the form the LLM
+gateway and the sandbox pool take, so it bounds queueing, upstream calls
+and the wall clock of sandboxed code alike.
+
+A request is also cancelled when its client goes away. The Flask routes
+notice by peeking at the client socket while they wait on the model or a
+sandbox; the ASGI routes watch for ``http.disconnect`` and cancel the
+handler task, which aborts the upstream call. Upstream tokens and sandbox
+CPU spent on replies nobody received are counted as waste by the gateway
+and the pool.
+"""
+import math
+import os
+import socket
+import threading
+import time
+
+import metrics
+
+DEADLINE_AI_SECONDS = float(os.getenv('DEADLINE_AI_SECONDS', 30))
+DEADLINE_AGENT_SECONDS = float(os.getenv('DEADLINE_AGENT_SECONDS', 30))
+DEADLINE_RUN_SECONDS = float(os.getenv('DEADLINE_RUN_SECONDS', 15))
+DEADLINE_SUBMIT_SECONDS = float(os.getenv('DEADLINE_SUBMIT_SECONDS', 60))
+DEADLINE_GENERATE_QUESTION_SECONDS = float(os.getenv('DEADLINE_GENERATE_QUESTION_SECONDS', 45))
+# Longer would only be cut off by the gunicorn worker timeout
+DEADLINE_MAX_SECONDS = float(os.getenv('DEADLINE_MAX_SECONDS', 110))
+CANCEL_ON_DISCONNECT = os.getenv('CANCEL_ON_DISCONNECT', 'true').lower() == 'true'
+# How often blocked requests check whether their client is still there
+DEADLINE_POLL_SECONDS = float(os.getenv('DEADLINE_POLL_SECONDS', 0.25))
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+# Request kind (as in admission.KINDS) -> default deadline in seconds
+DEFAULT_DEADLINES = {
+    'ai': DEADLINE_AI_SECONDS,
+    'agent': DEADLINE_AGENT_SECONDS,
+    'run': DEADLINE_RUN_SECONDS,
+    'submit': DEADLINE_SUBMIT_SECONDS,
+    'generate_question': DEADLINE_GENERATE_QUESTION_SECONDS
+}
+
+# Why a request stopped early
+DEADLINE = 'deadline'
+DISCONNECT = 'disconnect'
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'client_timeouts': 0, 'cancelled': {}}
+
+
+class RequestCancelled(Exception):
+    """Raised when a request is abandoned: its deadline passed or its client disconnected"""
+
+    def __init__(self, reason):
+        super().__init__('The request took too long and was cancelled' if reason == DEADLINE
+                         else 'The client disconnected')
+        self.reason = reason
+
+
+def client_timeout(value):
+    """Seconds from an ``X-Request-Timeout`` header, or ``None`` when missing or invalid"""
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 and math.isfinite(seconds) else None
+
+
+def socket_closed(sock):
+    """A check for whether the client closed ``sock``, or ``None`` if it can't be watched"""
+    if not CANCEL_ON_DISCONNECT or not isinstance(sock, socket.socket):
+        return None
+
+    def closed():
+        try:
+            # A closed connection reads as EOF; a pipelined request as data
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except (BlockingIOError, InterruptedError):
+            return False
+        except ValueError:
+            # TLS sockets don't allow peeking
+            return False
+        except OSError:
+            return True
+    return closed
+
+
+class Deadline:
+    """When a request must be answered by, and whether it has been abandoned"""
+
+    def __init__(self, kind, timeout=None, closed=None):
+        self.kind = kind
+        self.seconds = min(timeout, DEADLINE_MAX_SECONDS) if timeout is not None else DEFAULT_DEADLINES[kind]
+        self.at = time.monotonic() + self.seconds
+        self._closed = closed
+        self.reason = None
+        with _stats_lock:
+            _stats['requests'] += 1
+            _stats['client_timeouts'] += int(timeout is not None)
+
+    def remaining(self):
+        return max(0.0, self.at - time.monotonic())
+
+    def cancelled(self):
+        """``DEADLINE`` or ``DISCONNECT`` once the request should stop, else ``None``"""
+        if self.reason is None:
+            if time.monotonic() >= self.at:
+                self.reason = DEADLINE
+            elif self._closed is not None and self._closed():
+                self.reason = DISCONNECT
+        return self.reason
+
+    def abandon(self, reason):
+        """Mark the request as stopped for ``reason`` unless it already is; returns the reason"""
+        if self.reason is None:
+            self.reason = reason
+        return self.reason
+
+    def check(self):
+        """Raise ``RequestCancelled`` if the request should stop"""
+        reason = self.cancelled()
+        if reason is not None:
+            raise RequestCancelled(reason)
+
+    def llm_params(self, watch=True):
+        """Router keyword arguments: the gateway deadline and, for blocking calls, the cancel check"""
+        params = {'deadline': self.at}
+        if watch and self._closed is not None:
+            params['cancelled'] = self.cancelled
+        return params
+
+
+def record(kind, reason):
+    """Count a request that was cancelled before it could be answered"""
+    with _stats_lock:
+        cancelled = _stats['cancelled'].setdefault(kind, {})
+        cancelled[reason] = cancelled.get(reason, 0) + 1
+    metrics.inc('requests_cancelled_total', kind=kind, reason=reason)
+
+
+def stats():
+    with _stats_lock:
+        stats = dict(_stats, cancelled={kind: dict(counts) for kind, counts in _stats['cancelled'].items()})
+    stats['defaults'] = DEFAULT_DEADLINES
+    stats['max_seconds'] = DEADLINE_MAX_SECONDS
+    stats['cancel_on_disconnect'] = CANCEL_ON_DISCONNECT
+    return stats
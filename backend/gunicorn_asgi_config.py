@@ -0,0 +1,9 @@
+# Gunicorn settings for the ASGI app: gunicorn -c gunicorn_asgi_config.py asgi:app
+#
+# Uvicorn workers run one event loop each, so LLM-bound requests no longer
+# need a thread apiece; the sandbox and remaining Flask routes use the thread
+# pools configured in asgi.py (ASGI_RUN_THREADS, ASGI_WSGI_THREADS).
+# Without gunicorn a single process can be started with: uvicorn asgi:app --port 5001
+from gunicorn_config import bind, workers, timeout, keepalive, errorlog, accesslog, loglevel, on_starting, post_fork, post_worker_init
+
+worker_class = "uvicorn_worker.UvicornWorker"
@@ -1,8 +1,29 @@
+import os
+
 bind = "0.0.0.0:10000"
 workers = 2
-threads = 4
+# Requests mostly wait on the LLM gateway or a sandbox process, so threads are cheap
+threads = int(os.getenv('GUNICORN_THREADS', 16))
 timeout = 120
 keepalive = 5
 errorlog = "-"
 accesslog = "-"
-loglevel = "info" 
\ No newline at end of file
+loglevel = "info"
+
+
+def on_starting(server):
+    # Metrics snapshots from a previous run would otherwise be merged into /metrics
+    import metrics
+    metrics.clear_snapshots()
+
+
+def post_fork(server, worker):
+    # Each worker publishes its own metrics snapshot for /metrics to aggregate
+    import metrics
+    metrics.start()
+
+
+def post_worker_init(worker):
+    # post_fork runs before the worker loads the app; this runs after, before it accepts
+    import app
+    app.warmup()
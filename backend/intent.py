@@ -0,0 +1,234 @@
+"""Local intent classifier for trivial tutor messages.
+
+Greetings, thanks and generic "I want to learn" messages get a fixed reply
+from the tutor prompts anyway, so they are answered here without calling
+the model. Classification runs in microseconds:
+
+1. the normalized message is matched against a trie of known phrases
+2. short messages the trie doesn't cover go to a small hashed-feature
+   linear model (an averaged perceptron trained at import time), which may
+   only recognize greetings and thanks
+
+Messages with question words never reach the linear model, so anything that
+looks like a real question goes to the LLM. "I want to learn" replies only
+fit the exact phrases in the trie; "teach me linked lists" is a request.
+"""
+import re
+import threading
+import zlib
+from array import array
+
+GREETING = 'greeting'
+THANKS = 'thanks'
+LEARN = 'learn'
+OTHER = 'other'
+
+CANNED_RESPONSES = {
+    GREETING: "Hi!",
+    THANKS: "You're welcome!",
+    LEARN: "I'd be happy to help you prepare! What specific topic or problem would you like to work on?"
+}
+
+# Words that can pad a trivial message without changing its intent
+FILLER_WORDS = {'ok', 'okay', 'oh', 'so', 'well', 'cool', 'great', 'nice', 'awesome', 'again', 'a', 'lot', 'very',
+                'much', 'man', 'buddy', 'friend', 'bot', 'tutor', 'there', 'all', 'guys', 'sir', 'yes', 'yeah', 'alright'}
+
+# Words that mean the student actually wants help with something
+VETO_WORDS = {'but', 'why', 'how', 'what', 'when', 'where', 'which', 'not', 'error', 'wrong', 'still', 'fix',
+              'bug', 'code', 'output', 'function', 'loop', 'explain', 'does', 'doesn', 'isn', 'can', 'could',
+              'should', 'is', 'are', 'exception', 'traceback', 'fails', 'failing', 'works', 'work', 'help',
+              'about', 'stuck', 'next', 'question', 'problem', 'hint', 'confused', 'understand', 'lost'}
+
+PHRASES = {
+    GREETING: [
+        'hi', 'hello', 'hey', 'hiya', 'howdy', 'yo', 'sup', 'greetings', 'hello there', 'hi there', 'hey there',
+        'good morning', 'good afternoon', 'good evening', 'whats up'
+    ],
+    THANKS: [
+        'thanks', 'thank you', 'thank u', 'thx', 'thnx', 'ty', 'tysm', 'tyvm', 'cheers', 'much appreciated',
+        'appreciate it', 'thanks a lot', 'got it thanks', 'that helped', 'that helps', 'perfect', 'got it'
+    ],
+    LEARN: [
+        'i want to learn coding', 'i want to learn programming', 'i want to learn python', 'i want to learn to code',
+        'i want to learn', 'i wanna learn coding', 'i want to practice', 'i want to practice coding', 'i have an interview',
+        'i have an interview tomorrow', 'i have an interview today', 'i have an interview next week',
+        'i have a coding interview', 'i have a coding interview tomorrow', 'help me prepare for interviews',
+        'help me prepare for my interview', 'i want to prepare for interviews', 'teach me coding',
+        'teach me programming', 'i am new to coding', 'im new to coding', 'i am a beginner'
+    ]
+}
+
+# Labelled examples for the linear model; the phrases above are added too
+TRAINING_EXAMPLES = [
+    (GREETING, 'hello hello'), (GREETING, 'hey hey'), (GREETING, 'hi hi there'), (GREETING, 'helloo tutor'),
+    (GREETING, 'hey whats up'), (GREETING, 'hi good morning'), (GREETING, 'good day'), (GREETING, 'hello friend'),
+    (THANKS, 'thank you so much'), (THANKS, 'thanks so much'), (THANKS, 'thanks for the help'),
+    (THANKS, 'thank you for your help'), (THANKS, 'thanks man'), (THANKS, 'ok ty'), (THANKS, 'ty!!'),
+    (THANKS, 'many thanks'), (THANKS, 'thanks a ton'), (THANKS, 'great thanks'), (THANKS, 'awesome thank you'),
+    (THANKS, 'that was helpful thanks'), (THANKS, 'thank you very much'), (THANKS, 'ok got it thanks'),
+    (LEARN, 'i would like to learn coding'), (LEARN, 'i want to get better at coding'),
+    (LEARN, 'my interview is tomorrow'), (LEARN, 'i have a technical interview soon'),
+    (LEARN, 'i need to prepare for a coding interview'), (LEARN, 'i want to start learning programming'),
+    (LEARN, 'i am preparing for interviews'),
+    (OTHER, 'why is my output wrong'), (OTHER, 'how do i fix this error'), (OTHER, 'what does this loop do'),
+    (OTHER, 'explain recursion'), (OTHER, 'my hello world program does not print'),
+    (OTHER, 'thanks but it still fails'), (OTHER, 'hi my code gives an index error'),
+    (OTHER, 'hello why does this return none'), (OTHER, 'what is a hash table'),
+    (OTHER, 'can you give me a hint'), (OTHER, 'is my solution optimal'), (OTHER, 'time complexity'),
+    (OTHER, 'the second test case fails'), (OTHER, 'i get a key error on line 3'),
+    (OTHER, 'should i use a stack here'), (OTHER, 'walk me through the example'),
+    (OTHER, 'i want to learn about binary search trees'), (OTHER, 'teach me dynamic programming for this problem'),
+    (OTHER, 'give me a hint for the first step'), (OTHER, 'what is wrong with my recursion'),
+    (OTHER, 'how do i reverse a linked list'), (OTHER, 'optimize this'), (OTHER, 'debug this please'),
+    (OTHER, 'it prints the wrong answer'), (OTHER, 'is there a faster way'), (OTHER, 'what should i return'),
+    (OTHER, 'hey i am stuck'), (OTHER, 'i am stuck'), (OTHER, 'teach me linked lists'),
+    (OTHER, 'i want to learn recursion'), (OTHER, 'ty next question'), (OTHER, 'next question please'),
+    (OTHER, 'teach me graphs'), (OTHER, 'i want to learn sorting')
+]
+
+# Intents the linear model may assign; a generic reply to a specific request is worse than a model call
+_MODEL_LABELS = (GREETING, THANKS)
+
+_NUM_FEATURES = 1 << 12
+_LABELS = (GREETING, THANKS, LEARN, OTHER)
+# Longest message (in words) the linear model is trusted with
+_MAX_MODEL_TOKENS = 8
+# Minimum score margin over the runner-up before a model prediction is used
+_MIN_MARGIN = 1.0
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_REPEAT_RE = re.compile(r"(.)\1{2,}")
+
+
+def normalize(message):
+    """Lowercase, drop punctuation and squeeze stretched letters ("heyyy")"""
+    message = message.lower().replace("'", '')
+    return _WORD_RE.findall(_REPEAT_RE.sub(r"\1", message))
+
+
+class PhraseTrie:
+    """Word-level trie of known phrases, each tagged with an intent"""
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, phrase, label):
+        node = self._root
+        for word in normalize(phrase):
+            node = node.setdefault(word, {})
+        node[None] = label
+
+    def match(self, tokens):
+        """Intent if ``tokens`` is entirely known phrases of one intent plus fillers"""
+        labels = set()
+        position = 0
+        while position < len(tokens):
+            # Longest phrase starting here
+            node, end, label = self._root, None, None
+            for index in range(position, len(tokens)):
+                node = node.get(tokens[index])
+                if node is None:
+                    break
+                if None in node:
+                    end, label = index + 1, node[None]
+            if end is not None:
+                labels.add(label)
+                position = end
+            elif tokens[position] in FILLER_WORDS:
+                position += 1
+            else:
+                return None
+        return labels.pop() if len(labels) == 1 else None
+
+
+def _features(tokens):
+    features = ['bias', f"len:{min(len(tokens), 6)}"]
+    features.extend(f"w:{token}" for token in tokens)
+    features.extend(f"b:{left} {right}" for left, right in zip(tokens, tokens[1:]))
+    return [zlib.crc32(feature.encode('utf-8')) % _NUM_FEATURES for feature in features]
+
+
+class LinearIntentModel:
+    """Multiclass linear model over hashed unigram/bigram features"""
+
+    def __init__(self):
+        self._weights = {label: array('d', bytes(8 * _NUM_FEATURES)) for label in _LABELS}
+
+    def scores(self, tokens):
+        features = _features(tokens)
+        return {label: sum(weights[f] for f in features) for label, weights in self._weights.items()}
+
+    def predict(self, tokens):
+        """Best label and its margin over the runner-up"""
+        ranked = sorted(self.scores(tokens).items(), key=lambda item: item[1], reverse=True)
+        return ranked[0][0], ranked[0][1] - ranked[1][1]
+
+    def train(self, examples, epochs=10):
+        """Averaged perceptron over (label, text) pairs"""
+        totals = {label: array('d', bytes(8 * _NUM_FEATURES)) for label in _LABELS}
+        step = 0
+        samples = [(label, _features(normalize(text))) for label, text in examples]
+        for epoch in range(epochs):
+            # Deterministic shuffle so every worker trains the same model
+            ordered = samples[epoch % len(samples):] + samples[:epoch % len(samples)]
+            for label, features in ordered:
+                step += 1
+                scores = {name: sum(weights[f] for f in features) for name, weights in self._weights.items()}
+                predicted = max(scores, key=scores.get)
+                if predicted != label:
+                    for f in features:
+                        self._weights[label][f] += 1
+                        self._weights[predicted][f] -= 1
+                        totals[label][f] += step
+                        totals[predicted][f] -= step
+        # Averaging: w_avg = w - totals / steps
+        for label in _LABELS:
+            weights, total = self._weights[label], totals[label]
+            for f in range(_NUM_FEATURES):
+                if total[f]:
+                    weights[f] -= total[f] / (step + 1)
+
+
+class IntentClassifier:
+    """Trie first, then the linear model for short greetings and thanks without veto words"""
+
+    def __init__(self):
+        self.trie = PhraseTrie()
+        examples = list(TRAINING_EXAMPLES)
+        for label, phrases in PHRASES.items():
+            for phrase in phrases:
+                self.trie.add(phrase, label)
+                examples.append((label, phrase))
+        self.model = LinearIntentModel()
+        self.model.train(examples)
+        self._lock = threading.Lock()
+        self._counts = {label: 0 for label in _LABELS}
+
+    def classify(self, message):
+        tokens = normalize(message)
+        label = self.trie.match(tokens) if tokens else OTHER
+        if label is None:
+            label = OTHER
+            # Only short messages with real content and no question words go to the model
+            if (len(tokens) <= _MAX_MODEL_TOKENS
+                    and not all(token in FILLER_WORDS for token in tokens)
+                    and not any(token in VETO_WORDS for token in tokens)):
+                predicted, margin = self.model.predict(tokens)
+                if margin >= _MIN_MARGIN and predicted in _MODEL_LABELS:
+                    label = predicted
+        with self._lock:
+            self._counts[label] += 1
+        return label
+
+    def canned_response(self, message):
+        """Fixed reply for a trivial message, or ``None`` if it needs the model"""
+        return CANNED_RESPONSES.get(self.classify(message))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'classified': sum(counts.values()),
+            'llm_calls_avoided': counts[GREETING] + counts[THANKS] + counts[LEARN],
+            'by_intent': counts
+        }
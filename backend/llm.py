@@ -0,0 +1,592 @@
+"""Shared gateway for every call to the Groq chat-completions API.
+
+All routes go through ``chat_completion`` so that they share one pooled,
+keep-alive HTTP client, one concurrency limit and one retry policy. Callers
+that can't get an upstream slot before their queue deadline get
+``LLMOverloaded`` instead of piling up behind a slow upstream.
+
+Identical non-streaming calls in flight at the same time are coalesced
+(single-flight): followers wait for the leader's upstream call and share its
+completion. Deterministic calls (temperature 0) always share; sampled calls
+share only when they start within ``LLM_COALESCE_WINDOW`` seconds of the
+leader, which is off by default since they would otherwise get the same
+"random" reply.
+
+``async_chat_completion`` is the same gateway for the ASGI app: an
+``AsyncGroq`` client, an asyncio slot limit and the same retry policy,
+statistics and metrics.
+
+The Groq SDK (and httpx under it) is the most expensive import of the
+backend, so it is only imported when the first client is built. ``warmup``
+does that, and opens the first pooled connection, before a worker takes
+traffic.
+
+Calls cut off by their deadline, and streams or async calls dropped because
+the client went away, still cost upstream tokens. Those are counted as
+``wasted_tokens``: the reported usage when there is one, else an estimate
+from the prompt and the chunks already streamed.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import metrics
+from deadlines import DEADLINE, DISCONNECT
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 64))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 10))
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 60))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_POOL_CONNECTIONS = int(os.getenv('LLM_POOL_CONNECTIONS', 100))
+LLM_COALESCE = os.getenv('LLM_COALESCE', 'true').lower() == 'true'
+LLM_COALESCE_WINDOW = float(os.getenv('LLM_COALESCE_WINDOW', 0))
+LLM_WARMUP_TIMEOUT = float(os.getenv('LLM_WARMUP_TIMEOUT', 5))
+
+# Backoff between retries: full jitter on an exponential schedule
+_BACKOFF_BASE_SECONDS = 0.5
+_BACKOFF_MAX_SECONDS = 8
+
+
+class LLMError(Exception):
+    """Base class for gateway errors"""
+
+
+class LLMOverloaded(LLMError):
+    """Raised when no upstream slot frees up before the queue deadline"""
+
+
+class LLMDeadlineExceeded(LLMError):
+    """Raised when a call can't complete before the caller's deadline"""
+
+
+_client = None
+_client_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'retries': 0,
+    'errors': 0,
+    'rejected': 0,
+    'in_flight': 0,
+    'coalesced': 0,
+    'wasted_tokens': 0
+}
+# Single-flight key -> _Flight of the leader's call
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared Groq client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import groq
+                import httpx
+                http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=LLM_POOL_CONNECTIONS,
+                        max_keepalive_connections=LLM_POOL_CONNECTIONS
+                    ),
+                    timeout=LLM_REQUEST_TIMEOUT
+                )
+                # Retries are handled here so they respect our slots and backoff
+                _client = groq.Groq(
+                    api_key=os.getenv('GROQ_API_KEY'),
+                    http_client=http_client,
+                    max_retries=0
+                )
+    return _client
+
+
+def _retryable_errors():
+    """Rate limits, 5xx and connection errors (the SDK is imported by then)"""
+    import groq
+    return (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+
+def warmup():
+    """Build the client and open a pooled upstream connection; returns whether it connected"""
+    started = time.monotonic()
+    try:
+        get_client().models.list(timeout=LLM_WARMUP_TIMEOUT)
+        connected = True
+    except Exception as e:
+        # An error response still leaves the connection open; only log it
+        logger.warning("LLM warmup request failed: %s", e)
+        connected = False
+    logger.info("LLM client warmed up in %.0f ms", (time.monotonic() - started) * 1000)
+    return connected
+
+
+def _bump(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def _backoff(attempt, error):
+    """Seconds to wait before retry ``attempt``, honouring Retry-After"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), _BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def _acquire(queue_timeout):
+    if not _slots.acquire(timeout=queue_timeout):
+        _bump('rejected')
+        raise LLMOverloaded('The AI service is busy, please try again shortly')
+    _bump('in_flight')
+    metrics.inc('llm_requests_in_flight')
+
+
+def _release():
+    _bump('in_flight', -1)
+    metrics.dec('llm_requests_in_flight')
+    _slots.release()
+
+
+def _field(obj, name):
+    # Streamed extras such as x_groq can arrive as plain dicts
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def _record(model, outcome, started, first_token=None, usage=None):
+    """Upstream latency and token metrics for one completion"""
+    finished = time.monotonic()
+    metrics.inc('llm_requests_total', model=model, outcome=outcome)
+    if outcome != 'ok':
+        return
+    metrics.observe('llm_time_to_first_token_seconds', (first_token or finished) - started, model=model)
+    metrics.observe('llm_request_duration_seconds', finished - started, model=model)
+    if usage is not None:
+        metrics.inc('llm_tokens_total', _field(usage, 'prompt_tokens') or 0, model=model, kind='prompt')
+        metrics.inc('llm_tokens_total', _field(usage, 'completion_tokens') or 0, model=model, kind='completion')
+
+
+def _estimate_tokens(messages):
+    # About four characters per token; only used when the API reported no usage
+    return sum(len(m.get('content') or '') for m in messages) // 4
+
+
+def record_waste(model, reason, tokens):
+    """Count upstream tokens spent on a reply nobody received"""
+    if tokens:
+        _bump('wasted_tokens', tokens)
+        metrics.inc('llm_wasted_tokens_total', tokens, model=model, reason=reason)
+
+
+def _usage_tokens(usage):
+    return (_field(usage, 'prompt_tokens') or 0) + (_field(usage, 'completion_tokens') or 0)
+
+
+def _sent(error):
+    """Whether ``error`` cut off a request upstream had already started on"""
+    import groq
+    return isinstance(error, LLMDeadlineExceeded) and isinstance(error.__cause__, groq.APITimeoutError)
+
+
+def _remaining(deadline):
+    """Seconds left before ``deadline``; raises once it has passed"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise LLMDeadlineExceeded('The AI service did not answer in time')
+    return remaining
+
+
+def _create(params, deadline=None):
+    """Call the API, retrying rate limits, 5xx and connection errors"""
+    attempt = 0
+    while True:
+        try:
+            if deadline is not None:
+                # Each attempt may only use what is left of the deadline
+                params['timeout'] = _remaining(deadline)
+            return get_client().chat.completions.create(**params)
+        except LLMDeadlineExceeded:
+            _bump('errors')
+            raise
+        except _retryable_errors() as e:
+            delay = _backoff(attempt, e)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                _bump('errors')
+                raise LLMDeadlineExceeded('The AI service did not answer in time') from e
+            if attempt >= LLM_MAX_RETRIES:
+                _bump('errors')
+                raise
+            attempt += 1
+            _bump('retries')
+            time.sleep(delay)
+        except Exception:
+            _bump('errors')
+            raise
+
+
+# Per-call settings that don't change the completion
+_CALL_ONLY_PARAMS = ('timeout', 'stream')
+
+
+def _normalize(content):
+    return ' '.join(content.split()) if isinstance(content, str) else content
+
+
+def _flight_key(messages, model, params):
+    """Identity of a call for coalescing: model, parameters and normalized prompt"""
+    payload = {
+        'model': model,
+        'messages': [dict(m, content=_normalize(m.get('content'))) for m in messages],
+        'params': {k: v for k, v in params.items() if k not in _CALL_ONLY_PARAMS}
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _can_join(flight, params, window):
+    """Deterministic calls always share; sampled ones only within ``window`` of the leader"""
+    if params.get('temperature') == 0:
+        return True
+    return window > 0 and time.monotonic() - flight.started <= window
+
+
+def _coalesced(model):
+    _bump('coalesced')
+    metrics.inc('llm_coalesced_total', model=model)
+
+
+def _outlived(error, deadline):
+    """Whether a follower still has time after the leader missed its deadline"""
+    return isinstance(error, LLMDeadlineExceeded) and (deadline is None or time.monotonic() < deadline)
+
+
+class _Flight:
+    """One upstream call that concurrent identical callers wait on"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        # Set instead of done/response/error by the async gateway
+        self.future = None
+
+
+def chat_completion(messages, model, queue_timeout=LLM_QUEUE_TIMEOUT, deadline=None,
+                    coalesce_window=LLM_COALESCE_WINDOW, **params):
+    """Create a chat completion through the shared client.
+
+    Accepts the same keyword arguments as ``client.chat.completions.create``.
+    With ``stream=True`` the upstream slot is held until the returned
+    iterator is exhausted or closed. ``deadline`` is an absolute
+    ``time.monotonic()`` value that bounds queueing, every attempt and the
+    whole stream; missing it raises ``LLMDeadlineExceeded``.
+    ``coalesce_window`` overrides ``LLM_COALESCE_WINDOW`` for this call.
+    """
+    if not LLM_COALESCE or params.get('stream'):
+        return _complete(messages, model, queue_timeout, deadline, params)
+
+    key = _flight_key(messages, model, params)
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None or not _can_join(flight, params, coalesce_window)
+            if leader:
+                flight = _flights[key] = _Flight()
+        if leader:
+            break
+
+        _coalesced(model)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not flight.done.wait(timeout):
+            raise LLMDeadlineExceeded('The AI service did not answer in time')
+        if flight.error is None:
+            return flight.response
+        if not _outlived(flight.error, deadline):
+            raise flight.error
+        # The leader ran out of its own, earlier deadline: join the next flight or lead one
+
+    try:
+        flight.response = _complete(messages, model, queue_timeout, deadline, params)
+        return flight.response
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+        flight.done.set()
+
+
+def _complete(messages, model, queue_timeout, deadline, params):
+    """One upstream call: take a slot, create the completion, record metrics"""
+    if deadline is not None:
+        queue_timeout = min(queue_timeout, max(0.0, deadline - time.monotonic()))
+    try:
+        _acquire(queue_timeout)
+    except LLMOverloaded:
+        if deadline is not None and time.monotonic() >= deadline:
+            metrics.inc('llm_requests_total', model=model, outcome='deadline')
+            raise LLMDeadlineExceeded('The AI service did not answer in time') from None
+        metrics.inc('llm_requests_total', model=model, outcome='rejected')
+        raise
+    _bump('requests')
+    params = dict(params, messages=messages, model=model)
+    started = time.monotonic()
+    try:
+        response = _create(params, deadline)
+    except Exception as e:
+        _release()
+        _record(model, 'deadline' if isinstance(e, LLMDeadlineExceeded) else 'error', started)
+        if _sent(e):
+            record_waste(model, DEADLINE, _estimate_tokens(messages))
+        raise
+    if not params.get('stream'):
+        _release()
+        _record(model, 'ok', started, usage=getattr(response, 'usage', None))
+        return response
+    chunks = _stream(response, model, started, deadline, messages)
+    next(chunks)
+    return chunks
+
+
+def _stream(stream, model, started, deadline=None, messages=()):
+    first_token = None
+    usage = None
+    chunks = 0
+    outcome = 'error'
+    try:
+        # ``_complete`` runs the generator up to here, so closing it (or
+        # dropping it) before the first chunk still frees the slot
+        yield
+        for chunk in stream:
+            if deadline is not None and time.monotonic() >= deadline:
+                outcome = 'deadline'
+                raise LLMDeadlineExceeded('The AI service did not finish in time')
+            if first_token is None:
+                first_token = time.monotonic()
+            # Groq reports usage on the final chunk
+            usage = _field(_field(chunk, 'x_groq'), 'usage') or usage
+            chunks += 1
+            yield chunk
+        outcome = 'ok'
+    except GeneratorExit:
+        outcome = 'cancelled'
+        raise
+    finally:
+        stream.close()
+        _release()
+        _record(model, outcome, started, first_token, usage)
+        _stream_waste(model, outcome, usage, messages, chunks)
+
+
+def _stream_waste(model, outcome, usage, messages, chunks):
+    # A streamed chunk carries about one token
+    if outcome in ('deadline', 'cancelled'):
+        tokens = _usage_tokens(usage) if usage is not None else _estimate_tokens(messages) + chunks
+        record_waste(model, DEADLINE if outcome == 'deadline' else DISCONNECT, tokens)
+
+
+# ---------------------------------------------------------------------------
+# Async gateway (ASGI mode)
+# ---------------------------------------------------------------------------
+_async_client = None
+_async_slots = None
+_async_flights = {}
+
+
+def get_async_client():
+    """Return the shared AsyncGroq client of this process's event loop"""
+    global _async_client
+    if _async_client is None:
+        import groq
+        import httpx
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_POOL_CONNECTIONS,
+                max_keepalive_connections=LLM_POOL_CONNECTIONS
+            ),
+            timeout=LLM_REQUEST_TIMEOUT
+        )
+        _async_client = groq.AsyncGroq(
+            api_key=os.getenv('GROQ_API_KEY'),
+            http_client=http_client,
+            max_retries=0
+        )
+    return _async_client
+
+
+async def _async_acquire(queue_timeout):
+    global _async_slots
+    if _async_slots is None:
+        _async_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    try:
+        await asyncio.wait_for(_async_slots.acquire(), timeout=queue_timeout)
+    except asyncio.TimeoutError:
+        _bump('rejected')
+        raise LLMOverloaded('The AI service is busy, please try again shortly') from None
+    _bump('in_flight')
+    metrics.inc('llm_requests_in_flight')
+
+
+def _async_release():
+    _bump('in_flight', -1)
+    metrics.dec('llm_requests_in_flight')
+    _async_slots.release()
+
+
+async def _async_create(params, deadline=None):
+    """``_create`` for the async client"""
+    attempt = 0
+    while True:
+        try:
+            if deadline is not None:
+                params['timeout'] = _remaining(deadline)
+            return await get_async_client().chat.completions.create(**params)
+        except LLMDeadlineExceeded:
+            _bump('errors')
+            raise
+        except _retryable_errors() as e:
+            delay = _backoff(attempt, e)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                _bump('errors')
+                raise LLMDeadlineExceeded('The AI service did not answer in time') from e
+            if attempt >= LLM_MAX_RETRIES:
+                _bump('errors')
+                raise
+            attempt += 1
+            _bump('retries')
+            await asyncio.sleep(delay)
+        except Exception:
+            _bump('errors')
+            raise
+
+
+async def async_chat_completion(messages, model, queue_timeout=LLM_QUEUE_TIMEOUT, deadline=None,
+                                coalesce_window=LLM_COALESCE_WINDOW, **params):
+    """``chat_completion`` for async callers; streams are async iterators"""
+    if not LLM_COALESCE or params.get('stream'):
+        return await _async_complete(messages, model, queue_timeout, deadline, params)
+
+    # The event loop is single-threaded, so the flight table needs no lock
+    key = _flight_key(messages, model, params)
+    flight = _async_flights.get(key)
+    while flight is not None and _can_join(flight, params, coalesce_window):
+        _coalesced(model)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            # Shielded so a follower giving up doesn't cancel the leader's call
+            return await asyncio.wait_for(asyncio.shield(flight.future), timeout)
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceeded('The AI service did not answer in time') from None
+        except LLMDeadlineExceeded as e:
+            if not _outlived(e, deadline):
+                raise
+            flight = _async_flights.get(key)
+        except asyncio.CancelledError:
+            # Only the leader's client went away: join the next flight or lead one
+            if not flight.future.cancelled() or asyncio.current_task().cancelling():
+                raise
+            flight = _async_flights.get(key)
+
+    flight = _async_flights[key] = _Flight()
+    flight.future = asyncio.get_running_loop().create_future()
+    try:
+        response = await _async_complete(messages, model, queue_timeout, deadline, params)
+        flight.future.set_result(response)
+        return response
+    except BaseException as e:
+        if isinstance(e, asyncio.CancelledError):
+            flight.future.cancel()
+        else:
+            flight.future.set_exception(e)
+            # Retrieved here so an unawaited future doesn't log "exception never retrieved"
+            flight.future.exception()
+        raise
+    finally:
+        if _async_flights.get(key) is flight:
+            del _async_flights[key]
+
+
+async def _async_complete(messages, model, queue_timeout, deadline, params):
+    """``_complete`` on the async client"""
+    if deadline is not None:
+        queue_timeout = min(queue_timeout, max(0.0, deadline - time.monotonic()))
+    try:
+        await _async_acquire(queue_timeout)
+    except LLMOverloaded:
+        if deadline is not None and time.monotonic() >= deadline:
+            metrics.inc('llm_requests_total', model=model, outcome='deadline')
+            raise LLMDeadlineExceeded('The AI service did not answer in time') from None
+        metrics.inc('llm_requests_total', model=model, outcome='rejected')
+        raise
+    _bump('requests')
+    params = dict(params, messages=messages, model=model)
+    started = time.monotonic()
+    try:
+        response = await _async_create(params, deadline)
+    except BaseException as e:
+        _async_release()
+        if isinstance(e, asyncio.CancelledError):
+            # The client went away: the request was sent, the reply is dropped
+            _record(model, 'cancelled', started)
+            record_waste(model, DISCONNECT, _estimate_tokens(messages))
+        else:
+            _record(model, 'deadline' if isinstance(e, LLMDeadlineExceeded) else 'error', started)
+            if _sent(e):
+                record_waste(model, DEADLINE, _estimate_tokens(messages))
+        raise
+    if not params.get('stream'):
+        _async_release()
+        _record(model, 'ok', started, usage=getattr(response, 'usage', None))
+        return response
+    chunks = _async_stream(response, model, started, deadline, messages)
+    await chunks.__anext__()
+    return chunks
+
+
+async def _async_stream(stream, model, started, deadline=None, messages=()):
+    first_token = None
+    usage = None
+    chunks = 0
+    outcome = 'error'
+    try:
+        # Primed by ``_async_complete`` like ``_stream``
+        yield
+        async for chunk in stream:
+            if deadline is not None and time.monotonic() >= deadline:
+                outcome = 'deadline'
+                raise LLMDeadlineExceeded('The AI service did not finish in time')
+            if first_token is None:
+                first_token = time.monotonic()
+            usage = _field(_field(chunk, 'x_groq'), 'usage') or usage
+            chunks += 1
+            yield chunk
+        outcome = 'ok'
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = 'cancelled'
+        raise
+    finally:
+        await stream.close()
+        _async_release()
+        _record(model, outcome, started, first_token, usage)
+        _stream_waste(model, outcome, usage, messages, chunks)
+
+
+def stats():
+    """Counters for upstream traffic through the gateway"""
+    with _stats_lock:
+        return dict(_stats, max_concurrency=LLM_MAX_CONCURRENCY)
@@ -0,0 +1,298 @@
+"""In-process metrics with a Prometheus text endpoint.
+
+Counters, gauges and histograms live in plain dicts guarded by one lock, so
+recording a sample on the hot path is a dict update and a bisect. Each
+gunicorn worker writes a JSON snapshot of its metrics to ``METRICS_DIR``
+every ``METRICS_FLUSH_INTERVAL`` seconds; ``/metrics`` merges the snapshots
+of all live workers with a fresh one of its own, so scrapes see the whole
+server whichever worker answers.
+
+Subsystems that already keep their own counters (caches, the problem bank)
+are exported through collectors that read their ``stats()`` at snapshot
+time instead of being instrumented call by call.
+"""
+import bisect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'codeedge-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MEMORY_KB_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288)
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+
+class Registry:
+    """Metric families of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> {'type', 'help', 'buckets', 'values': {labels: value}}
+        self._families = {}
+        self._collectors = []
+
+    def define(self, name, kind, help_text, buckets=None):
+        with self._lock:
+            self._families.setdefault(name, {
+                'type': kind,
+                'help': help_text,
+                'buckets': tuple(buckets) if buckets else None,
+                'values': {}
+            })
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter or gauge"""
+        key = _label_key(labels)
+        with self._lock:
+            values = self._families[name]['values']
+            values[key] = values.get(key, 0) + amount
+
+    def dec(self, name, amount=1, **labels):
+        self.inc(name, -amount, **labels)
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._families[name]['values'][_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Record a histogram sample"""
+        key = _label_key(labels)
+        with self._lock:
+            family = self._families[name]
+            series = family['values'].get(key)
+            if series is None:
+                # [count per bucket..., +Inf count, sum]
+                series = family['values'][key] = [0] * (len(family['buckets']) + 2)
+            series[bisect.bisect_left(family['buckets'], value)] += 1
+            series[-1] += value
+
+    def add_collector(self, collect):
+        """``collect()`` returns ``[(name, kind, help, labels, value)]`` at snapshot time"""
+        self._collectors.append(collect)
+
+    def snapshot(self):
+        """JSON-friendly copy of every family, collectors included"""
+        with self._lock:
+            families = {
+                name: {
+                    'type': family['type'],
+                    'help': family['help'],
+                    'buckets': family['buckets'],
+                    'values': [[list(key), value if not isinstance(value, list) else list(value)]
+                               for key, value in family['values'].items()]
+                }
+                for name, family in self._families.items()
+            }
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, kind, help_text, labels, value in samples:
+                family = families.setdefault(name, {'type': kind, 'help': help_text, 'buckets': None, 'values': []})
+                family['values'].append([list(_label_key(labels)), value])
+        return families
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+registry = Registry()
+
+# Route metrics
+registry.define('http_requests_total', COUNTER, 'HTTP requests by route, method and status')
+registry.define('http_request_duration_seconds', HISTOGRAM, 'Time to produce the response, by route', LATENCY_BUCKETS)
+registry.define('http_requests_in_flight', GAUGE, 'Requests currently being handled')
+# Upstream LLM metrics
+registry.define('llm_requests_total', COUNTER, 'Chat completions by model and outcome')
+registry.define('llm_time_to_first_token_seconds', HISTOGRAM, 'Time until the first token (or the whole reply when not streaming)', LATENCY_BUCKETS)
+registry.define('llm_request_duration_seconds', HISTOGRAM, 'Total time of a chat completion', LATENCY_BUCKETS)
+registry.define('llm_tokens_total', COUNTER, 'Tokens by model and kind (prompt, completion)')
+registry.define('llm_coalesced_total', COUNTER, 'Chat completions answered by sharing an identical in-flight call')
+registry.define('llm_requests_in_flight', GAUGE, 'Chat completions holding an upstream slot')
+registry.define('router_decisions_total', COUNTER, 'Requests routed, by route, serving tier and first model')
+registry.define('router_fallbacks_total', COUNTER, 'Calls retried on the next model, by failed model and error')
+registry.define('router_hedges_total', COUNTER, 'Second requests sent after the first passed its p95 latency')
+registry.define('router_latency_saved_seconds', HISTOGRAM, 'Time a winning hedge saved over the first request', LATENCY_BUCKETS)
+# Sandbox metrics
+registry.define('sandbox_runs_total', COUNTER, 'Sandbox runs by kind (run, batch) and outcome')
+registry.define('sandbox_run_duration_seconds', HISTOGRAM, 'Sandbox execution time, by kind', LATENCY_BUCKETS)
+registry.define('sandbox_queue_seconds', HISTOGRAM, 'Time waiting for a sandbox slot', LATENCY_BUCKETS)
+registry.define('sandbox_memory_kb', HISTOGRAM, 'Peak memory of sandboxed code', MEMORY_KB_BUCKETS)
+registry.define('sandbox_runs_in_flight', GAUGE, 'Sandbox runs holding a slot')
+# Admission control metrics
+registry.define('admission_rejected_total', COUNTER, 'Requests shed by admission control, by kind and reason')
+registry.define('admission_queue_seconds', HISTOGRAM, 'Time admitted requests waited for a work slot, by kind', LATENCY_BUCKETS)
+registry.define('admission_queue_depth', GAUGE, 'Requests waiting for a work slot')
+# Deadline and cancellation metrics
+registry.define('requests_cancelled_total', COUNTER, 'Requests stopped by their deadline or a client disconnect, by kind and reason')
+registry.define('llm_wasted_tokens_total', COUNTER, 'Upstream tokens spent on replies nobody received, by model and reason')
+registry.define('sandbox_wasted_cpu_seconds_total', COUNTER, 'Sandbox CPU spent on runs nobody received, by kind and reason')
+
+inc = registry.inc
+dec = registry.dec
+observe = registry.observe
+add_collector = registry.add_collector
+
+
+# ---------------------------------------------------------------------------
+# Cross-worker aggregation
+# ---------------------------------------------------------------------------
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot():
+    """Publish this worker's metrics for the other workers' ``/metrics``"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temporary, path)
+
+
+def _writer_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.warning("Metrics snapshot failed: %s", e)
+
+
+def start():
+    """Start publishing snapshots from this process (idempotent, fork-safe)"""
+    global _writer
+    if not METRICS_ENABLED:
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_writer_loop, name='metrics-writer', daemon=True)
+            _writer.start()
+
+
+def clear_snapshots():
+    """Forget snapshots of previous runs; call once before workers start"""
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except OSError:
+                pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read_snapshots():
+    """This process's live snapshot plus those of every other live worker"""
+    snapshots = [registry.snapshot()]
+    if not os.path.isdir(METRICS_DIR):
+        return snapshots
+    own = os.getpid()
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            pid = int(name[:-5])
+        except ValueError:
+            continue
+        if pid == own:
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        if not _alive(pid):
+            # A restarted worker starts from zero; Prometheus handles the counter reset
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(name, {
+                'type': family['type'], 'help': family['help'], 'buckets': family['buckets'], 'values': {}
+            })
+            for labels, value in family['values']:
+                key = tuple(tuple(pair) for pair in labels)
+                current = target['values'].get(key)
+                if current is None:
+                    target['values'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['values'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['values'][key] = current + value
+    return merged
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    rendered = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + rendered + '}'
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render():
+    """Prometheus text exposition of the metrics of every worker"""
+    lines = []
+    for name, family in sorted(_merge(_read_snapshots()).items()):
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family['values'].items()):
+            if family['type'] != HISTOGRAM:
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(family['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_number(float(bound))
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,176 @@
+"""Pre-generated problem bank for /generate-question.
+
+Problems are kept in buckets keyed by ``(category, concept, difficulty)``.
+Requests pop a ready problem in O(1) while a background thread tops each
+bucket back up to its watermark. If a bucket is empty the problem is
+generated synchronously, so callers always get an answer.
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+PROBLEM_BANK_WATERMARK = int(os.getenv('PROBLEM_BANK_WATERMARK', 3))
+PROBLEM_BANK_SEEN_PER_USER = int(os.getenv('PROBLEM_BANK_SEEN_PER_USER', 200))
+PROBLEM_BANK_MAX_USERS = int(os.getenv('PROBLEM_BANK_MAX_USERS', 10000))
+
+# Pause after a failed background generation so we don't hammer a rate limit
+_REFILL_BACKOFF_SECONDS = 5
+
+
+def problem_fingerprint(problem):
+    """Identify a problem by its normalized title (or content if untitled)"""
+    text = problem.get('title') or problem.get('content', '')
+    normalized = ' '.join(text.lower().split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+class ProblemBank:
+    """Buckets of ready-to-serve problems with background refill"""
+
+    def __init__(self, generate, watermark=PROBLEM_BANK_WATERMARK,
+                 seen_per_user=PROBLEM_BANK_SEEN_PER_USER, max_users=PROBLEM_BANK_MAX_USERS, accept=None):
+        # generate(category, concept, difficulty) -> problem dict
+        self._generate = generate
+        # accept(problem) -> bool; rejected problems are never banked
+        self._accept = accept
+        self.watermark = watermark
+        self.seen_per_user = seen_per_user
+        self.max_users = max_users
+        self._buckets = defaultdict(deque)
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._refill_queue = queue.Queue()
+        self._pending = set()
+        self._worker = None
+        self._hits = 0
+        self._misses = 0
+        self._generated = 0
+        self._refill_errors = 0
+        self._rejected = 0
+
+    def take_ready(self, user_id, key):
+        """Pop a banked problem ``user_id`` has not seen, or ``None`` on a miss.
+
+        On a miss the caller generates the problem itself, with its own
+        deadline, and passes it to ``served``.
+        """
+        problem = None
+        with self._lock:
+            bucket = self._buckets[key]
+            # Skip (and keep for other users) anything this user has already seen
+            for _ in range(len(bucket)):
+                candidate = bucket.popleft()
+                if not self._has_seen(user_id, candidate):
+                    problem = candidate
+                    break
+                bucket.append(candidate)
+            if problem is not None:
+                self._hits += 1
+            else:
+                self._misses += 1
+        if problem is not None:
+            with self._lock:
+                self._mark_seen(user_id, problem)
+            self.request_refill(key)
+        return problem
+
+    def served(self, user_id, key, problem):
+        """Record a problem generated on a bank miss as served to ``user_id``"""
+        if 'fingerprint' in problem:
+            return problem
+        problem['fingerprint'] = problem_fingerprint(problem)
+        with self._lock:
+            self._generated += 1
+            self._mark_seen(user_id, problem)
+        self.request_refill(key)
+        return problem
+
+    def request_refill(self, key):
+        """Ask the background worker to top ``key`` up to the watermark"""
+        if self.watermark <= 0:
+            return
+        with self._lock:
+            if key in self._pending or len(self._buckets[key]) >= self.watermark:
+                return
+            self._pending.add(key)
+            self._ensure_worker()
+        self._refill_queue.put(key)
+
+    def prefill(self, keys):
+        """Queue background refills for a set of buckets"""
+        for key in keys:
+            self.request_refill(key)
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'buckets': len(self._buckets),
+                'ready': sum(len(bucket) for bucket in self._buckets.values()),
+                'pending_refills': len(self._pending),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+                'generated': self._generated,
+                'refill_errors': self._refill_errors,
+                'rejected': self._rejected,
+                'users_tracked': len(self._seen)
+            }
+
+    def _has_seen(self, user_id, problem):
+        seen = self._seen.get(user_id)
+        return seen is not None and problem['fingerprint'] in seen[0]
+
+    def _mark_seen(self, user_id, problem):
+        seen = self._seen.get(user_id)
+        if seen is None:
+            seen = self._seen[user_id] = (set(), deque())
+            if len(self._seen) > self.max_users:
+                self._seen.popitem(last=False)
+        else:
+            self._seen.move_to_end(user_id)
+        fingerprints, order = seen
+        if problem['fingerprint'] in fingerprints:
+            return
+        fingerprints.add(problem['fingerprint'])
+        order.append(problem['fingerprint'])
+        if len(order) > self.seen_per_user:
+            fingerprints.discard(order.popleft())
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._refill_loop, name='problem-bank-refill', daemon=True)
+            self._worker.start()
+
+    def _refill_loop(self):
+        while True:
+            key = self._refill_queue.get()
+            try:
+                # Bounded so a model that keeps repeating itself can't spin forever
+                for _ in range(self.watermark * 2):
+                    with self._lock:
+                        if len(self._buckets[key]) >= self.watermark:
+                            break
+                    problem = self._generate(*key)
+                    problem['fingerprint'] = problem_fingerprint(problem)
+                    with self._lock:
+                        self._generated += 1
+                        if self._accept is not None and not self._accept(problem):
+                            self._rejected += 1
+                            continue
+                        if all(p['fingerprint'] != problem['fingerprint'] for p in self._buckets[key]):
+                            self._buckets[key].append(problem)
+            except Exception as e:
+                logger.warning("Problem bank refill failed for %s: %s", key, e)
+                with self._lock:
+                    self._refill_errors += 1
+                time.sleep(_REFILL_BACKOFF_SECONDS)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
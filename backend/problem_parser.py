@@ -0,0 +1,332 @@
+"""Structured parsing of generated problems and an index of their test cases.
+
+The model returns problems as loosely formatted text (``Title:``,
+``Description:``, ``Examples:`` with ``Input:``/``Output:`` pairs and
+``Constraints:``). ``parse_problem`` turns that text into a record with
+typed example inputs and outputs, and ``ProblemIndex`` keeps the records by
+content hash and by (category, concept, difficulty) so grading can fetch
+executable test cases without re-parsing or asking the model again.
+
+A ``Reference Solution:`` section, if the model included one, is split off
+the statement so it is never shown to students but can be used to verify
+the examples.
+"""
+import ast
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+PROBLEM_INDEX_SIZE = int(os.getenv('PROBLEM_INDEX_SIZE', 5000))
+
+_SECTION_RE = re.compile(
+    r"^[\s#*>_-]*(title|problem title|description|problem description|problem statement|"
+    r"examples?(?:\s*\d+)?|sample(?:\s+test)?(?:\s+cases?)?(?:\s*\d+)?|constraints)\b\s*\d*[\s*_]*:?[\s*_]*(.*)$",
+    re.IGNORECASE
+)
+_SOLUTION_RE = re.compile(r"^[\s#*>_-]*(?:reference\s+)?solution\b[^\n]*$", re.IGNORECASE | re.MULTILINE)
+_CODE_BLOCK_RE = re.compile(r"```[a-zA-Z0-9]*\n(.*?)```", re.DOTALL)
+_EXAMPLE_FIELD_RE = re.compile(r"[*_`]*\b(input|output|explanation)\b[*_`]*\s*:[*_`]*", re.IGNORECASE)
+_MARKDOWN_RE = re.compile(r"^[\s#>*_`]*(?:[-*\u2022]\s+)?[*_`]*|[\s*_`]+$")
+
+# JSON/JavaScript spellings models often use in examples
+_NAME_CONSTANTS = {'true': True, 'false': False, 'null': None, 'none': None, 'True': True, 'False': False, 'None': None}
+
+
+def content_hash(content):
+    """Stable identifier of a problem's text"""
+    normalized = '\n'.join(line.rstrip() for line in content.strip().splitlines())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def split_solution(content):
+    """``(statement, solution code)``; the code is ``None`` without a solution section"""
+    match = _SOLUTION_RE.search(content)
+    if match is None:
+        return content, None
+    statement, rest = content[:match.start()].rstrip(), content[match.end():]
+    block = _CODE_BLOCK_RE.search(rest)
+    code = block.group(1) if block else rest
+    return statement, code.strip('\n') or None
+
+
+def replace_example_outputs(content, outputs):
+    """Rewrite the ``Output:`` value of the examples given as ``{index: text}``.
+
+    Only the outputs ``parse_problem`` read as examples are touched, so an
+    ``Output:`` line in the description stays as it is.
+    """
+    spans = [span for _, span in _examples(_split_sections(content).get('examples', []))]
+    pieces = []
+    position = 0
+    for index, (start, end) in enumerate(spans):
+        if index in outputs:
+            # Replace the rest of the line the value sits on
+            pieces.append(content[position:start])
+            pieces.append(' ' + outputs[index])
+            position = end
+    pieces.append(content[position:])
+    return ''.join(pieces)
+
+
+def _literal(node):
+    """``ast.literal_eval`` that also accepts true/false/null"""
+    if isinstance(node, ast.Name) and node.id in _NAME_CONSTANTS:
+        return _NAME_CONSTANTS[node.id]
+    if isinstance(node, ast.List):
+        return [_literal(element) for element in node.elts]
+    if isinstance(node, ast.Tuple):
+        return tuple(_literal(element) for element in node.elts)
+    if isinstance(node, ast.Set):
+        return {_literal(element) for element in node.elts}
+    if isinstance(node, ast.Dict):
+        return {_literal(key): _literal(value) for key, value in zip(node.keys, node.values)}
+    return ast.literal_eval(node)
+
+
+def parse_value(text):
+    """``(value, typed)``: the literal value of an example output, or the text"""
+    text = _strip_markdown(text)
+    try:
+        return _literal(ast.parse(text, mode='eval').body), True
+    except (SyntaxError, ValueError, TypeError):
+        return text, False
+
+
+def parse_arguments(text):
+    """Typed arguments of an example input such as ``nums = [1, 2], k = 3``.
+
+    Returns a dict for keyword-style inputs, a list for positional ones, or
+    ``None`` when the text isn't made of literals.
+    """
+    text = _strip_markdown(text)
+    for candidate in (text, re.sub(r"\s*\n\s*", ', ', text)):
+        try:
+            call = ast.parse(f"f({candidate})", mode='eval').body
+            if call.keywords and call.args:
+                continue
+            if call.keywords:
+                return {keyword.arg: _literal(keyword.value) for keyword in call.keywords}
+            return [_literal(arg) for arg in call.args]
+        except (SyntaxError, ValueError, TypeError):
+            continue
+    return None
+
+
+def _strip_markdown(text):
+    text = text.strip()
+    if text.startswith('```'):
+        text = text.strip('`').strip()
+    return text.strip('`').strip()
+
+
+def _split_sections(content):
+    """Group lines under the section header they follow.
+
+    Lines are ``(offset, line)`` pairs, ``offset`` being where the line's
+    text starts in ``content``.
+    """
+    sections = defaultdict(list)
+    current = 'preamble'
+    offset = 0
+    for raw in content.splitlines(keepends=True):
+        line = raw.splitlines()[0]
+        start = offset
+        offset += len(raw)
+        match = _SECTION_RE.match(line)
+        if match:
+            name = match.group(1).lower()
+            if 'title' in name:
+                current = 'title'
+            elif 'description' in name or 'statement' in name:
+                current = 'description'
+            elif 'constraint' in name:
+                current = 'constraints'
+            else:
+                current = 'examples'
+            rest = match.group(2)
+            if rest.strip():
+                start += match.start(2) + len(rest) - len(rest.lstrip())
+                line = rest.strip()
+            else:
+                continue
+        sections[current].append((start, line))
+    return sections
+
+
+def _examples(lines):
+    """Examples with an output from ``(offset, line)`` pairs, as ``(example, output span)``.
+
+    The span is where the output's first line sits in the problem text.
+    """
+    text = '\n'.join(line for _, line in lines)
+    # Start of each line in ``text`` and in the problem text
+    starts = []
+    position = 0
+    for offset, line in lines:
+        starts.append((position, offset, len(line)))
+        position += len(line) + 1
+
+    def span(position):
+        joined, offset, length = next(start for start in reversed(starts) if start[0] <= position)
+        return offset + position - joined, offset + length
+
+    examples = []
+    current = None
+    for match in _EXAMPLE_FIELD_RE.finditer(text):
+        label = match.group(1).lower()
+        following = _EXAMPLE_FIELD_RE.search(text, match.end())
+        value = text[match.end():following.start() if following else len(text)].strip()
+        if label == 'input':
+            current = {'input_text': value, 'output_text': None, 'explanation': ''}
+            examples.append([current, None])
+        elif current is not None and label == 'output' and current['output_text'] is None:
+            current['output_text'] = value
+            examples[-1][1] = span(match.end())
+        elif current is not None and label == 'explanation':
+            current['explanation'] = value
+    return [(example, output_span) for example, output_span in examples if example['output_text'] is not None]
+
+
+def _parse_examples(lines):
+    parsed = []
+    for example, _ in _examples(lines):
+        # Keep only the first line of a multi-line output block unless it is a literal
+        output_text = example['output_text']
+        output, typed = parse_value(output_text)
+        if not typed and '\n' in output_text.strip():
+            output_text = output_text.strip().splitlines()[0]
+            output, typed = parse_value(output_text)
+        parsed.append({
+            'input_text': example['input_text'],
+            'input': parse_arguments(example['input_text']),
+            'output_text': _strip_markdown(output_text),
+            'output': output,
+            'output_typed': typed,
+            'explanation': example['explanation']
+        })
+    return parsed
+
+
+def parse_problem(content):
+    """Turn generated problem text into a structured record"""
+    content, solution = split_solution(content)
+    located = _split_sections(content)
+    sections = {name: [line for _, line in lines] for name, lines in located.items()}
+
+    title = ' '.join(line.strip() for line in sections.get('title', []) if line.strip())
+    if not title:
+        # Fall back to the first non-empty line
+        title = next((line for line in content.splitlines() if line.strip()), '')
+    title = _MARKDOWN_RE.sub('', title)
+
+    description = '\n'.join(sections.get('description') or sections.get('preamble', [])).strip()
+    constraints = [
+        _MARKDOWN_RE.sub('', line)
+        for line in sections.get('constraints', [])
+        if _MARKDOWN_RE.sub('', line)
+    ]
+
+    return {
+        'hash': content_hash(content),
+        'title': title,
+        'description': description,
+        'examples': _parse_examples(located.get('examples', [])),
+        'constraints': constraints,
+        'statement': content,
+        'solution': solution
+    }
+
+
+def to_test_cases(record):
+    """Executable test cases for the sandbox from a parsed problem.
+
+    Examples with literal inputs become function-call cases (arguments and
+    expected return value as Python literals); the rest fall back to
+    comparing printed output with the input text on stdin.
+    """
+    cases = []
+    for example in record['examples']:
+        if example['input'] is not None and example['output_typed']:
+            cases.append({'args': repr(example['input']), 'expected': repr(example['output'])})
+        else:
+            cases.append({'input': example['input_text'], 'expected_output': example['output_text']})
+    return cases
+
+
+class ProblemIndex:
+    """Parsed problems by content hash and by (category, concept, difficulty)"""
+
+    def __init__(self, max_entries=PROBLEM_INDEX_SIZE):
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._by_key = defaultdict(OrderedDict)
+        self._lock = threading.Lock()
+
+    def add(self, content, key=None):
+        """Parse ``content`` once and index it; returns the record"""
+        problem_hash = content_hash(split_solution(content)[0])
+        with self._lock:
+            record = self._records.get(problem_hash)
+            if record is not None:
+                self._records.move_to_end(problem_hash)
+                return record
+
+        record = parse_problem(content)
+        record['key'] = key
+        record['test_cases'] = to_test_cases(record)
+        self._store(record)
+        return record
+
+    def replace(self, record, content):
+        """Index a repaired version of ``record``'s problem in its place"""
+        with self._lock:
+            if self._records.pop(record['hash'], None) is not None:
+                keyed = self._by_key.get(record['key'])
+                if keyed is not None:
+                    keyed.pop(record['hash'], None)
+        repaired = parse_problem(content)
+        repaired['key'] = record['key']
+        repaired['solution'] = repaired['solution'] or record['solution']
+        repaired['test_cases'] = to_test_cases(repaired)
+        self._store(repaired)
+        return repaired
+
+    def _store(self, record):
+        problem_hash = record['hash']
+        key = record['key']
+        with self._lock:
+            self._records[problem_hash] = record
+            if key is not None:
+                self._by_key[key][problem_hash] = None
+            while len(self._records) > self.max_entries:
+                _, evicted = self._records.popitem(last=False)
+                keyed = self._by_key.get(evicted['key'])
+                if keyed is not None:
+                    keyed.pop(evicted['hash'], None)
+                    if not keyed:
+                        del self._by_key[evicted['key']]
+
+    def get(self, problem_hash):
+        with self._lock:
+            return self._records.get(problem_hash)
+
+    def find(self, key):
+        """Records indexed under (category, concept, difficulty)"""
+        with self._lock:
+            return [self._records[problem_hash] for problem_hash in self._by_key.get(key, ())]
+
+    def stats(self):
+        with self._lock:
+            records = list(self._records.values())
+            keys = len(self._by_key)
+        return {
+            'problems': len(records),
+            'keys': keys,
+            'with_examples': sum(1 for record in records if record['examples']),
+            'test_cases': sum(len(record['test_cases']) for record in records)
+        }
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,114 @@
+"""Verification of generated problems against their reference solution.
+
+The model is asked for a reference solution alongside every problem. Before
+a problem is served, the solution is run in the sandbox against the parsed
+examples:
+
+* every example passes: the problem is **verified**
+* the solution runs cleanly on every example and agrees with at least half
+  of them: the disagreeing ``Output:`` values are rewritten with what the
+  solution returned and the problem is **repaired**
+* anything else (no solution, no executable examples, crashes, timeouts or
+  mostly wrong examples): the problem is **rejected**
+"""
+import os
+import threading
+from collections import defaultdict
+
+from deadlines import RequestCancelled
+from problem_parser import replace_example_outputs
+from sandbox import SandboxBusy, get_sandbox_pool
+
+PROBLEM_VERIFY = os.getenv('PROBLEM_VERIFY', 'true').lower() == 'true'
+PROBLEM_VERIFY_ATTEMPTS = int(os.getenv('PROBLEM_VERIFY_ATTEMPTS', 2))
+PROBLEM_VERIFY_CASE_SECONDS = float(os.getenv('PROBLEM_VERIFY_CASE_SECONDS', 2))
+
+VERIFIED = 'verified'
+REPAIRED = 'repaired'
+REJECTED = 'rejected'
+
+# Function name the prompt asks the reference solution to use
+REFERENCE_ENTRY_POINT = 'solve'
+
+
+class ProblemVerifier:
+    """Runs reference solutions and keeps pass/fail counts per category"""
+
+    def __init__(self, index, pool=None, case_seconds=PROBLEM_VERIFY_CASE_SECONDS):
+        self.index = index
+        self.case_seconds = case_seconds
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {VERIFIED: 0, REPAIRED: 0, REJECTED: 0})
+        self._reasons = defaultdict(int)
+
+    def verify(self, record, category, deadline=None, cancelled=None):
+        """Check a parsed problem; returns ``(status, record, reason)``.
+
+        A repaired problem comes back as a new record with the fixed
+        statement, already indexed in place of the original. ``deadline``
+        and ``cancelled`` bound the solution's run as in ``run_batch``; a
+        run they cut short raises ``RequestCancelled`` and decides nothing.
+        """
+        status, reason, outputs = self._check(record, deadline, cancelled)
+        if status == REPAIRED:
+            content = replace_example_outputs(record['statement'], outputs)
+            record = self.index.replace(record, content)
+        elif status == REJECTED:
+            # Examples that can't be trusted must not fail a correct submission
+            record['test_cases'] = []
+        record['verification'] = status
+        with self._lock:
+            self._counts[category][status] += 1
+            if reason:
+                self._reasons[reason] += 1
+        return status, record, reason
+
+    def stats(self):
+        with self._lock:
+            categories = {}
+            for category, counts in self._counts.items():
+                total = sum(counts.values())
+                categories[category] = dict(counts, pass_rate=round((total - counts[REJECTED]) / total, 4))
+            totals = {status: sum(counts[status] for counts in self._counts.values())
+                      for status in (VERIFIED, REPAIRED, REJECTED)}
+            return dict(totals, categories=categories, reject_reasons=dict(self._reasons))
+
+    def _check(self, record, deadline=None, cancelled=None):
+        if not record.get('solution'):
+            return REJECTED, 'no_solution', None
+        if not record['test_cases']:
+            return REJECTED, 'no_examples', None
+
+        pool = self._pool or get_sandbox_pool()
+        try:
+            result = pool.run_batch(
+                record['solution'],
+                record['test_cases'],
+                case_seconds=self.case_seconds,
+                entry_point=REFERENCE_ENTRY_POINT,
+                deadline=deadline,
+                cancelled=cancelled
+            )
+        except SandboxBusy:
+            return REJECTED, 'sandbox_busy', None
+        if result.get('cancelled'):
+            raise RequestCancelled(result['cancelled'])
+        if not result['success']:
+            return REJECTED, 'solution_failed', None
+        if result['all_passed']:
+            return VERIFIED, None, None
+
+        cases = result['cases']
+        if any(case['verdict'] not in ('passed', 'wrong_answer') for case in cases):
+            return REJECTED, 'solution_crashed', None
+        if result['passed'] * 2 < result['total']:
+            return REJECTED, 'examples_disagree', None
+        outputs = {}
+        for case in cases:
+            if case['verdict'] == 'wrong_answer':
+                output = case['output'].strip()
+                if not output or '\n' in output:
+                    return REJECTED, 'unrepairable', None
+                outputs[case['index']] = output
+        return REPAIRED, None, outputs
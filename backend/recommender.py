@@ -0,0 +1,144 @@
+"""Adaptive difficulty: per-user concept skill and the next problem to serve.
+
+Concepts are grouped in tracks (each main-page category, plus the advanced
+Code with AI concepts). Every user has an Elo rating per concept. Each
+attempt is scored like a game against a problem rated by its difficulty,
+so solving a hard problem moves the rating more than solving an easy one,
+and failing an easy one costs more than failing a hard one.
+
+Ratings and attempt counts are kept in the user's progress as ``array``
+columns with one slot per concept, in the order the concepts are listed,
+so new concepts must be appended. The next ``(concept, difficulty)`` of a
+track is recomputed whenever one of its concepts is rated and stored
+alongside, which makes picking a question a lookup.
+"""
+import math
+import os
+import threading
+from array import array
+
+RECOMMENDER_START_RATING = int(os.getenv('RECOMMENDER_START_RATING', 900))
+RECOMMENDER_K = float(os.getenv('RECOMMENDER_K', 32))
+RECOMMENDER_TARGET_SUCCESS = float(os.getenv('RECOMMENDER_TARGET_SUCCESS', 0.7))
+RECOMMENDER_MASTERY_RATING = int(os.getenv('RECOMMENDER_MASTERY_RATING', 1250))
+# Rating points each earlier attempt adds when ranking concepts, so practice spreads out
+RECOMMENDER_ATTEMPT_WEIGHT = float(os.getenv('RECOMMENDER_ATTEMPT_WEIGHT', 25))
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+DIFFICULTY_RATINGS = (800, 1000, 1200)
+
+# Marks a track whose next problem hasn't been computed yet
+_UNSET = 255
+
+
+def expected_score(rating, difficulty_rating):
+    """Probability that a student rated ``rating`` solves a problem rated ``difficulty_rating``"""
+    return 1 / (1 + math.pow(10, (difficulty_rating - rating) / 400))
+
+
+def best_difficulty(rating):
+    """Index of the difficulty whose success chance is closest to the target"""
+    return min(range(len(DIFFICULTIES)),
+               key=lambda i: abs(expected_score(rating, DIFFICULTY_RATINGS[i]) - RECOMMENDER_TARGET_SUCCESS))
+
+
+class Recommender:
+    """Skill updates and next-problem choice for a fixed set of tracks"""
+
+    def __init__(self, tracks):
+        # track -> (first slot, concepts)
+        self._tracks = {}
+        self._slots = {}
+        # concept -> its slots in every track, for mastery
+        self._by_name = {}
+        offset = 0
+        for track, concepts in tracks.items():
+            concepts = tuple(concepts)
+            self._tracks[track] = (offset, concepts)
+            for position, concept in enumerate(concepts):
+                self._slots[(track, concept)] = offset + position
+                self._by_name.setdefault(concept, []).append(offset + position)
+            offset += len(concepts)
+        self._size = offset
+        self._track_index = {track: index for index, track in enumerate(self._tracks)}
+        self._lock = threading.Lock()
+        self._stats = {'attempts': 0, 'solved': 0, 'recommendations': 0}
+
+    def _columns(self, progress):
+        """The progress record's arrays, created or extended to the current concept list"""
+        skills = progress.get('skills')
+        if not isinstance(skills, array):
+            skills = progress['skills'] = array('h', skills or ())
+        attempts = progress.get('attempts')
+        if not isinstance(attempts, array):
+            attempts = progress['attempts'] = array('H', attempts or ())
+        upcoming = progress.get('next')
+        if not isinstance(upcoming, array):
+            upcoming = progress['next'] = array('B', upcoming or ())
+        if len(skills) < self._size:
+            skills.extend([RECOMMENDER_START_RATING] * (self._size - len(skills)))
+        if len(attempts) < self._size:
+            attempts.extend([0] * (self._size - len(attempts)))
+        if len(upcoming) < 2 * len(self._tracks):
+            upcoming.extend([_UNSET] * (2 * len(self._tracks) - len(upcoming)))
+        return skills, attempts, upcoming
+
+    def _choose(self, track, skills, attempts):
+        """(concept position, difficulty index) for ``track``: its weakest unmastered concept"""
+        offset, concepts = self._tracks[track]
+        positions = range(len(concepts))
+        learning = [p for p in positions if skills[offset + p] < RECOMMENDER_MASTERY_RATING] or positions
+        position = min(learning, key=lambda p: skills[offset + p] + RECOMMENDER_ATTEMPT_WEIGHT * attempts[offset + p])
+        return position, best_difficulty(skills[offset + position])
+
+    def has_track(self, track):
+        return track in self._tracks
+
+    def knows(self, track, concept):
+        return (track, concept) in self._slots
+
+    def record(self, progress, track, concept, difficulty, solved):
+        """Rate one attempt and refresh the track's next problem; returns the new rating"""
+        slot = self._slots.get((track, concept))
+        if slot is None or difficulty not in DIFFICULTIES:
+            return None
+        skills, attempts, upcoming = self._columns(progress)
+        rating = skills[slot]
+        expected = expected_score(rating, DIFFICULTY_RATINGS[DIFFICULTIES.index(difficulty)])
+        rating = round(rating + RECOMMENDER_K * ((1 if solved else 0) - expected))
+        skills[slot] = max(-32768, min(32767, rating))
+        attempts[slot] = min(65535, attempts[slot] + 1)
+
+        mastered = set(progress.get('concepts_mastered', ()))
+        if any(skills[s] >= RECOMMENDER_MASTERY_RATING for s in self._by_name[concept]):
+            mastered.add(concept)
+        else:
+            mastered.discard(concept)
+        progress['concepts_mastered'] = mastered
+
+        index = 2 * self._track_index[track]
+        upcoming[index], upcoming[index + 1] = self._choose(track, skills, attempts)
+        with self._lock:
+            self._stats['attempts'] += 1
+            self._stats['solved'] += int(bool(solved))
+        return skills[slot]
+
+    def next(self, progress, track):
+        """The ``(concept, difficulty)`` to serve next in ``track``"""
+        skills, attempts, upcoming = self._columns(progress)
+        index = 2 * self._track_index[track]
+        if upcoming[index] == _UNSET:
+            upcoming[index], upcoming[index + 1] = self._choose(track, skills, attempts)
+        with self._lock:
+            self._stats['recommendations'] += 1
+        _, concepts = self._tracks[track]
+        return concepts[upcoming[index]], DIFFICULTIES[upcoming[index + 1]]
+
+    def difficulty(self, progress, track, concept):
+        """The difficulty to serve for a concept the student picked"""
+        skills, _, _ = self._columns(progress)
+        return DIFFICULTIES[best_difficulty(skills[self._slots[(track, concept)]])]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, tracks=len(self._tracks), concepts=self._size)
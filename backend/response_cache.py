@@ -0,0 +1,190 @@
+"""Cache for tutor answers.
+
+Two tiers sit in front of the model:
+
+* an exact tier keyed on a hash of the normalized request (question type,
+  problem, AST-normalized code and question), with LRU and TTL eviction
+* an optional near-duplicate tier that finds a cached request with very
+  similar wording and code using MinHash signatures over word shingles
+"""
+import ast
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 5000))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_NEAR_DUPLICATES = os.getenv('RESPONSE_CACHE_NEAR_DUPLICATES', 'false').lower() == 'true'
+RESPONSE_CACHE_SIMILARITY = float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.9))
+
+# MinHash signature layout: _BANDS bands of _ROWS rows each
+_BANDS = 16
+_ROWS = 4
+_NUM_HASHES = _BANDS * _ROWS
+_MERSENNE_PRIME = (1 << 61) - 1
+_HASH_SEEDS = [
+    (int.from_bytes(hashlib.sha1(f"a{i}".encode()).digest()[:8], 'big') % _MERSENNE_PRIME or 1,
+     int.from_bytes(hashlib.sha1(f"b{i}".encode()).digest()[:8], 'big') % _MERSENNE_PRIME)
+    for i in range(_NUM_HASHES)
+]
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[^\sa-z0-9_]")
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace"""
+    return ' '.join((text or '').lower().split())
+
+
+def normalize_code(code):
+    """Canonical form of the code: the AST dump when it parses.
+
+    Comments, blank lines and formatting differences disappear in the AST;
+    code that doesn't parse falls back to whitespace-normalized text.
+    """
+    try:
+        return ast.dump(ast.parse(code or ''))
+    except (SyntaxError, ValueError):
+        return ' '.join((code or '').split())
+
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _shingles(tokens, size=3):
+    if len(tokens) < size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def minhash(text):
+    """MinHash signature of the word 3-shingles of ``text``"""
+    shingles = _shingles(_tokens(text))
+    if not shingles:
+        return None
+    values = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big') for s in shingles]
+    return tuple(
+        min((a * v + b) % _MERSENNE_PRIME for v in values)
+        for a, b in _HASH_SEEDS
+    )
+
+
+def _similarity(left, right):
+    return sum(1 for x, y in zip(left, right) if x == y) / _NUM_HASHES
+
+
+class ResponseCache:
+    """Exact + near-duplicate cache of tutor responses"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 near_duplicates=RESPONSE_CACHE_NEAR_DUPLICATES, similarity=RESPONSE_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        # LSH index: (scope, band, band hash) -> keys
+        self._bands = defaultdict(set)
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._near_hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def make_key(question_type, problem, code, question):
+        """Hash of the normalized request"""
+        parts = (question_type or '', normalize_text(problem), normalize_code(code), normalize_text(question))
+        return hashlib.sha256('\x00'.join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _scope(question_type, problem):
+        # Near-duplicates are only ever matched against the same problem and mode
+        return hashlib.sha1(f"{question_type}\x00{normalize_text(problem)}".encode('utf-8')).hexdigest()
+
+    def get(self, question_type, problem, code, question):
+        """Return a cached response or ``None``"""
+        key = self.make_key(question_type, problem, code, question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] > now:
+                self._entries.move_to_end(key)
+                self._exact_hits += 1
+                return entry['response']
+            if entry is not None:
+                self._evict(key)
+
+        if self.near_duplicates:
+            scope = self._scope(question_type, problem)
+            signature = minhash(f"{question} {code}")
+            if signature is not None:
+                with self._lock:
+                    match = self._find_similar(scope, signature, now)
+                    if match is not None:
+                        self._entries.move_to_end(match)
+                        self._near_hits += 1
+                        return self._entries[match]['response']
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def set(self, question_type, problem, code, question, response):
+        key = self.make_key(question_type, problem, code, question)
+        entry = {'response': response, 'expires': time.monotonic() + self.ttl, 'bands': ()}
+        if self.near_duplicates:
+            signature = minhash(f"{question} {code}")
+            if signature is not None:
+                scope = self._scope(question_type, problem)
+                entry['signature'] = signature
+                entry['bands'] = tuple(
+                    (scope, band, hash(signature[band * _ROWS:(band + 1) * _ROWS]))
+                    for band in range(_BANDS)
+                )
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = entry
+            for band_key in entry['bands']:
+                self._bands[band_key].add(key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            hits = self._exact_hits + self._near_hits
+            total = hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'exact_hits': self._exact_hits,
+                'near_hits': self._near_hits,
+                'misses': self._misses,
+                'hit_rate': round(hits / total, 4) if total else 0.0
+            }
+
+    def _find_similar(self, scope, signature, now):
+        candidates = set()
+        for band in range(_BANDS):
+            candidates |= self._bands.get((scope, band, hash(signature[band * _ROWS:(band + 1) * _ROWS])), set())
+        best, best_score = None, self.similarity
+        for key in candidates:
+            entry = self._entries[key]
+            if entry['expires'] <= now:
+                continue
+            score = _similarity(signature, entry['signature'])
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def _evict(self, key):
+        entry = self._entries.pop(key)
+        for band_key in entry['bands']:
+            keys = self._bands.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._bands[band_key]
@@ -0,0 +1,423 @@
+"""Model routing for tutor answers and problem generation.
+
+Models are grouped in tiers: ``fast`` (a small model for short concept and
+general questions), ``standard`` and ``deep`` (debug sessions and long
+prompts). ``ModelRouter.tier`` picks the tier of a request from its question
+type and prompt size. The tier's models are then ordered by a rolling
+estimate of their latency and error rate, and models that keep failing are
+skipped for a cooldown, so a struggling tier hands its traffic to the next.
+
+Each call goes through the LLM gateway and falls back to the next model when
+the upstream call fails. Non-streaming calls are hedged: when the first
+request is still running at its model's p95 latency, a second one goes to
+the next model and the first reply wins. Latency estimates come from
+non-streaming calls; streams fall back when they can't be started but are
+not hedged.
+
+A blocking call given a ``cancelled`` check (see ``deadlines.Deadline``)
+gives up waiting as soon as its request is abandoned, which frees the web
+thread; the upstream call runs on and its tokens are counted as waste.
+Hedged and watched calls run on a shared pool of ``ROUTER_THREADS``.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from deadlines import RequestCancelled, DEADLINE_POLL_SECONDS
+from llm import chat_completion, async_chat_completion, record_waste, LLMDeadlineExceeded, LLMOverloaded
+
+MODEL_ROUTER = os.getenv('MODEL_ROUTER', 'true').lower() == 'true'
+ROUTER_FAST_MODELS = os.getenv('ROUTER_FAST_MODELS', 'llama-3.1-8b-instant')
+ROUTER_STANDARD_MODELS = os.getenv('ROUTER_STANDARD_MODELS', 'llama3-70b-8192,llama-3.3-70b-versatile')
+ROUTER_DEEP_MODELS = os.getenv('ROUTER_DEEP_MODELS', 'llama-3.3-70b-versatile,llama3-70b-8192')
+ROUTER_FAST_MAX_PROMPT_TOKENS = int(os.getenv('ROUTER_FAST_MAX_PROMPT_TOKENS', 800))
+ROUTER_DEEP_MIN_PROMPT_TOKENS = int(os.getenv('ROUTER_DEEP_MIN_PROMPT_TOKENS', 2000))
+ROUTER_MAX_ATTEMPTS = int(os.getenv('ROUTER_MAX_ATTEMPTS', 2))
+ROUTER_HEDGE = os.getenv('ROUTER_HEDGE', 'true').lower() == 'true'
+ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv('ROUTER_HEDGE_MIN_SAMPLES', 20))
+ROUTER_WINDOW = int(os.getenv('ROUTER_WINDOW', 200))
+ROUTER_ERROR_THRESHOLD = float(os.getenv('ROUTER_ERROR_THRESHOLD', 0.5))
+ROUTER_COOLDOWN = float(os.getenv('ROUTER_COOLDOWN', 30))
+# Threads that run blocking calls which are hedged or watched for cancellation
+ROUTER_THREADS = int(os.getenv('ROUTER_THREADS', 64))
+
+FAST = 'fast'
+STANDARD = 'standard'
+DEEP = 'deep'
+
+# Tier -> tiers to fall back to, in order
+TIER_ORDER = {
+    FAST: (FAST, STANDARD, DEEP),
+    STANDARD: (STANDARD, DEEP, FAST),
+    DEEP: (DEEP, STANDARD, FAST)
+}
+
+FAST_QUESTION_TYPES = ('concept', 'general')
+DEEP_QUESTION_TYPES = ('debug',)
+
+# Weight of each outcome in the error-rate estimate
+_ERROR_DECAY = 0.2
+
+
+def _models(value):
+    return tuple(model.strip() for model in value.split(',') if model.strip())
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _spawn(call):
+    """Run ``call`` on the shared router threads; returns a Future of its result"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(ROUTER_THREADS, thread_name_prefix='router')
+    return _executor.submit(call)
+
+
+def _wait(futures, timeout=None, cancelled=None):
+    """``wait`` for the first of ``futures``, checking ``cancelled`` while blocked.
+
+    Returns the finished futures (none when ``timeout`` ran out). Raises
+    ``RequestCancelled`` once ``cancelled()`` gives a reason; the calls
+    still running then count their tokens as waste when they finish.
+    """
+    if cancelled is None:
+        return wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)[0]
+    until = None if timeout is None else time.monotonic() + timeout
+    while True:
+        step = DEADLINE_POLL_SECONDS if until is None else min(DEADLINE_POLL_SECONDS, until - time.monotonic())
+        done, _ = wait(futures, timeout=max(0.0, step), return_when=FIRST_COMPLETED)
+        if done or (until is not None and time.monotonic() >= until):
+            return done
+        reason = cancelled()
+        if reason:
+            for future in futures:
+                future.add_done_callback(lambda f: _abandoned(f, reason))
+            raise RequestCancelled(reason)
+
+
+def _abandoned(future, reason):
+    if future.exception() is None:
+        response = future.result()[0]
+        usage = getattr(response, 'usage', None)
+        record_waste(response.model, reason, (getattr(usage, 'prompt_tokens', 0) or 0)
+                     + (getattr(usage, 'completion_tokens', 0) or 0))
+
+
+def _retrieve(task):
+    # The losing call's error is expected; don't log it as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class _ModelHealth:
+    """Rolling latency samples and error rate of one model"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=ROUTER_WINDOW)
+        self.error_rate = 0.0
+        self.last_error = None
+        self.requests = 0
+        self.errors = 0
+
+
+class ModelRouter:
+    """Tier choice, per-model estimates, fallback and hedging"""
+
+    def __init__(self, tiers=None):
+        self.tiers = tiers or {
+            FAST: _models(ROUTER_FAST_MODELS),
+            STANDARD: _models(ROUTER_STANDARD_MODELS),
+            DEEP: _models(ROUTER_DEEP_MODELS)
+        }
+        for name, models in self.tiers.items():
+            if not models:
+                raise ValueError(f"Router tier '{name}' has no models; set ROUTER_{name.upper()}_MODELS")
+        self._lock = threading.Lock()
+        self._health = {}
+        self._stats = {'decisions': {}, 'fallbacks': 0, 'hedges': 0, 'hedges_won': 0, 'latency_saved_ms': 0.0}
+
+    def tier(self, question_type=None, prompt_tokens=0):
+        """Tier for a request, from its question type and prompt size"""
+        if not MODEL_ROUTER:
+            return STANDARD
+        if question_type in DEEP_QUESTION_TYPES or prompt_tokens >= ROUTER_DEEP_MIN_PROMPT_TOKENS:
+            return DEEP
+        if question_type in FAST_QUESTION_TYPES and prompt_tokens <= ROUTER_FAST_MAX_PROMPT_TOKENS:
+            return FAST
+        return STANDARD
+
+    def _healthy(self, model, now):
+        health = self._health.get(model)
+        return (health is None or health.error_rate < ROUTER_ERROR_THRESHOLD
+                or now - health.last_error >= ROUTER_COOLDOWN)
+
+    def _p50(self, model):
+        health = self._health.get(model)
+        # Models without samples go first so they get some
+        return _percentile(health.latencies, 0.5) if health and health.latencies else 0.0
+
+    def candidates(self, tier):
+        """Models to try for ``tier``: its own fastest first, then the fallback tiers, healthy ones first"""
+        if not MODEL_ROUTER:
+            return self.tiers[STANDARD][:1]
+        now = time.monotonic()
+        chain = []
+        with self._lock:
+            for index, name in enumerate(TIER_ORDER[tier]):
+                models = [model for model in self.tiers[name] if model not in chain]
+                if index == 0:
+                    models.sort(key=self._p50)
+                chain.extend(models)
+            chain.sort(key=lambda model: not self._healthy(model, now))
+        return chain
+
+    def _decided(self, route, tier, chain):
+        # The tier that actually serves the request, after skipping unhealthy models
+        tier = next((name for name in TIER_ORDER[tier] if chain[0] in self.tiers[name]), tier)
+        with self._lock:
+            decisions = self._stats['decisions']
+            decisions[tier] = decisions.get(tier, 0) + 1
+        metrics.inc('router_decisions_total', route=route, tier=tier, model=chain[0])
+
+    def observe(self, model, latency=None, error=False):
+        """Record one call's outcome; ``latency`` only for complete, non-streamed replies"""
+        with self._lock:
+            health = self._health.get(model)
+            if health is None:
+                health = self._health[model] = _ModelHealth()
+            health.requests += 1
+            health.error_rate += _ERROR_DECAY * (float(error) - health.error_rate)
+            if error:
+                health.errors += 1
+                health.last_error = time.monotonic()
+            elif latency is not None:
+                health.latencies.append(latency)
+
+    def _hedge_delay(self, model):
+        """Seconds after which a call to ``model`` is hedged, or ``None``"""
+        with self._lock:
+            health = self._health.get(model)
+            if not ROUTER_HEDGE or health is None or len(health.latencies) < ROUTER_HEDGE_MIN_SAMPLES:
+                return None
+            return _percentile(health.latencies, 0.95)
+
+    def _hedge_model(self, chain, params):
+        # A different model if there is one; the same one would join the call when deterministic
+        if len(chain) > 1:
+            return chain[1]
+        return None if params.get('temperature') == 0 else chain[0]
+
+    def _fallback(self, model, error):
+        with self._lock:
+            self._stats['fallbacks'] += 1
+        metrics.inc('router_fallbacks_total', model=model, error=type(error).__name__)
+
+    def _hedged(self, model, hedge_model):
+        with self._lock:
+            self._stats['hedges'] += 1
+        metrics.inc('router_hedges_total', model=model, hedge_model=hedge_model)
+
+    def _hedge_won(self, saved):
+        with self._lock:
+            self._stats['hedges_won'] += 1
+            self._stats['latency_saved_ms'] += saved * 1000
+        metrics.observe('router_latency_saved_seconds', saved)
+
+    def _call(self, model, messages, params):
+        started = time.monotonic()
+        try:
+            response = chat_completion(messages=messages, model=model, **params)
+        except (LLMOverloaded, LLMDeadlineExceeded):
+            raise
+        except Exception:
+            self.observe(model, error=True)
+            raise
+        finished = time.monotonic()
+        self.observe(model, finished - started)
+        return response, finished
+
+    def _call_hedged(self, chain, messages, params, cancelled=None):
+        """Call ``chain[0]``, hedging with a second model after its p95 latency"""
+        model = chain[0]
+        delay = self._hedge_delay(model)
+        hedge_model = self._hedge_model(chain, params) if delay is not None else None
+        if hedge_model is None and cancelled is None:
+            return self._call(model, messages, params)[0]
+
+        primary = _spawn(lambda: self._call(model, messages, params))
+        done = _wait([primary], delay if hedge_model is not None else None, cancelled)
+        if done:
+            return primary.result()[0]
+
+        self._hedged(model, hedge_model)
+        hedge = _spawn(lambda: self._call(hedge_model, messages, params))
+        done = _wait([primary, hedge], cancelled=cancelled)
+        winner = next((f for f in (primary, hedge) if f in done and f.exception() is None), None)
+        if winner is None:
+            # The first to finish failed; the other one may still answer
+            other = hedge if primary in done else primary
+            _wait([other], cancelled=cancelled)
+            if other.exception() is not None:
+                raise primary.exception()
+            winner = other
+        response, finished = winner.result()
+        if winner is hedge:
+            def measure(future):
+                if future.exception() is None:
+                    self._hedge_won(future.result()[1] - finished)
+            primary.add_done_callback(measure)
+        return response
+
+    def complete(self, messages, tier, route, cancelled=None, **params):
+        """A chat completion from the best model of ``tier``, with fallback and hedging.
+
+        ``cancelled`` is polled while the call blocks; the call is abandoned
+        with ``RequestCancelled`` once it returns a reason.
+        """
+        chain = self.candidates(tier)
+        self._decided(route, tier, chain)
+        error = None
+        for attempt in range(min(ROUTER_MAX_ATTEMPTS, len(chain))):
+            try:
+                return self._call_hedged(chain[attempt:], messages, params, cancelled)
+            except (LLMOverloaded, LLMDeadlineExceeded, RequestCancelled):
+                raise
+            except Exception as e:
+                error = e
+                self._fallback(chain[attempt], e)
+        raise error
+
+    def stream(self, messages, tier, route, **params):
+        """A streamed completion; falls back when the stream can't be started"""
+        chain = self.candidates(tier)
+        self._decided(route, tier, chain)
+        error = None
+        for model in chain[:ROUTER_MAX_ATTEMPTS]:
+            try:
+                return chat_completion(messages=messages, model=model, stream=True, **params)
+            except (LLMOverloaded, LLMDeadlineExceeded):
+                raise
+            except Exception as e:
+                error = e
+                self.observe(model, error=True)
+                self._fallback(model, e)
+        raise error
+
+    async def _async_call(self, model, messages, params):
+        started = time.monotonic()
+        try:
+            response = await async_chat_completion(messages=messages, model=model, **params)
+        except (LLMOverloaded, LLMDeadlineExceeded):
+            raise
+        except Exception:
+            self.observe(model, error=True)
+            raise
+        finished = time.monotonic()
+        self.observe(model, finished - started)
+        return response, finished
+
+    async def _async_call_hedged(self, chain, messages, params):
+        model = chain[0]
+        delay = self._hedge_delay(model)
+        hedge_model = self._hedge_model(chain, params) if delay is not None else None
+        if hedge_model is None:
+            return (await self._async_call(model, messages, params))[0]
+
+        primary = asyncio.ensure_future(self._async_call(model, messages, params))
+        primary.add_done_callback(_retrieve)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()[0]
+
+        self._hedged(model, hedge_model)
+        hedge = asyncio.ensure_future(self._async_call(hedge_model, messages, params))
+        hedge.add_done_callback(_retrieve)
+        try:
+            done, _ = await asyncio.wait({primary, hedge}, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((t for t in (primary, hedge) if t in done and t.exception() is None), None)
+            if winner is None:
+                other = hedge if primary in done else primary
+                await asyncio.wait({other})
+                if other.exception() is not None:
+                    raise primary.exception()
+                winner = other
+        except asyncio.CancelledError:
+            primary.cancel()
+            hedge.cancel()
+            raise
+        response, finished = winner.result()
+        if winner is hedge:
+            def measure(task):
+                if not task.cancelled() and task.exception() is None:
+                    self._hedge_won(task.result()[1] - finished)
+            primary.add_done_callback(measure)
+        return response
+
+    async def async_complete(self, messages, tier, route, **params):
+        """``complete`` for the ASGI app"""
+        chain = self.candidates(tier)
+        self._decided(route, tier, chain)
+        error = None
+        for attempt in range(min(ROUTER_MAX_ATTEMPTS, len(chain))):
+            try:
+                return await self._async_call_hedged(chain[attempt:], messages, params)
+            except (LLMOverloaded, LLMDeadlineExceeded):
+                raise
+            except Exception as e:
+                error = e
+                self._fallback(chain[attempt], e)
+        raise error
+
+    async def async_stream(self, messages, tier, route, **params):
+        """``stream`` for the ASGI app"""
+        chain = self.candidates(tier)
+        self._decided(route, tier, chain)
+        error = None
+        for model in chain[:ROUTER_MAX_ATTEMPTS]:
+            try:
+                return await async_chat_completion(messages=messages, model=model, stream=True, **params)
+            except (LLMOverloaded, LLMDeadlineExceeded):
+                raise
+            except Exception as e:
+                error = e
+                self.observe(model, error=True)
+                self._fallback(model, e)
+        raise error
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            models = {}
+            for model, health in self._health.items():
+                latencies = list(health.latencies)
+                models[model] = {
+                    'requests': health.requests,
+                    'errors': health.errors,
+                    'error_rate': round(health.error_rate, 4),
+                    'healthy': self._healthy(model, now),
+                    'p50_ms': round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+                    'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2) if latencies else None
+                }
+            stats = dict(self._stats, decisions=dict(self._stats['decisions']))
+        stats['latency_saved_ms'] = round(stats['latency_saved_ms'], 2)
+        stats['enabled'] = MODEL_ROUTER
+        stats['tiers'] = {name: list(models_) for name, models_ in self.tiers.items()}
+        stats['models'] = models
+        return stats
+
+
+# Shared by the tutor and the problem generators
+router = ModelRouter()
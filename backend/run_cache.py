@@ -0,0 +1,180 @@
+"""Cache of ``/run`` results.
+
+Students re-run unchanged code all the time, and the frontend runs the same
+code again before saving progress. A run is keyed on a fingerprint of the
+code's syntax tree (so comments, blank lines and formatting don't matter)
+plus its stdin, and answered from memory without taking a sandbox slot.
+
+Only runs that must give the same result every time are cached: code that
+imports anything outside a small set of pure standard-library modules
+(``random``, ``time``, ``os``, ...), opens files, or uses ``id``/``hash``/
+``eval`` and the like is always executed. Results that quote line numbers
+(tracebacks, stderr, analysis warnings) are only reused for the exact same
+source text. Memory is bounded by ``RUN_CACHE_SIZE`` entries and
+``RUN_CACHE_MAX_BYTES`` of results, evicting the least recently used.
+"""
+import ast
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+RUN_CACHE = os.getenv('RUN_CACHE', 'true').lower() == 'true'
+RUN_CACHE_SIZE = int(os.getenv('RUN_CACHE_SIZE', 2000))
+RUN_CACHE_MAX_BYTES = int(os.getenv('RUN_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+# Modules whose results depend only on their inputs
+DETERMINISTIC_MODULES = frozenset({
+    '__future__', 'abc', 'array', 'bisect', 'cmath', 'collections', 'copy', 'dataclasses', 'decimal',
+    'difflib', 'enum', 'fractions', 'functools', 'heapq', 'itertools', 'json', 'keyword', 'math',
+    'numbers', 'operator', 'pprint', 're', 'statistics', 'string', 'struct', 'textwrap', 'typing',
+    'unicodedata'
+})
+
+# Builtins that do I/O, depend on memory addresses or can import anything
+_NONDETERMINISTIC_BUILTINS = frozenset({
+    'open', 'id', 'hash', 'eval', 'exec', 'compile', '__import__', 'breakpoint', 'help',
+    'globals', 'locals', 'vars', '__builtins__', '__loader__', '__spec__'
+})
+_NONDETERMINISTIC_ATTRIBUTES = frozenset({
+    '__import__', '__builtins__', '__globals__', '__subclasses__', '__code__', '__loader__', '__spec__'
+})
+
+# Default object reprs include the address, which differs between runs
+_ADDRESS_MARKER = ' at 0x'
+
+# Fingerprint memo value for code that must not be cached
+_UNCACHEABLE = ''
+
+
+def nondeterminism(tree):
+    """Why running ``tree`` could give different results each time, or ``None``"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.split('.')[0] not in DETERMINISTIC_MODULES:
+                    return f"imports {alias.name}"
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or (node.module or '').split('.')[0] not in DETERMINISTIC_MODULES:
+                return f"imports {node.module or '.'}"
+        elif isinstance(node, ast.Name) and node.id in _NONDETERMINISTIC_BUILTINS:
+            return f"uses {node.id}"
+        elif isinstance(node, ast.Attribute) and node.attr in _NONDETERMINISTIC_ATTRIBUTES:
+            return f"uses {node.attr}"
+    return None
+
+
+def cacheable(result):
+    """Whether a sandbox result is what every run of the code would give.
+
+    Successful runs and runs that raised are; limits, cancellations and
+    crashes depend on the moment, and memory errors on the host.
+    """
+    if result.get('cancelled') or result.get('truncated'):
+        return False
+    if not result.get('success') and (not result.get('traceback') or 'MemoryError' in result['traceback']):
+        return False
+    return _ADDRESS_MARKER not in result.get('output', '') and _ADDRESS_MARKER not in result.get('stderr', '')
+
+
+def _quotes_lines(result):
+    """Whether the result refers to line numbers, which formatting changes"""
+    return not result.get('success') or bool(result.get('stderr')) or bool(result.get('analysis'))
+
+
+class RunCache:
+    """LRU cache of run results keyed on (AST fingerprint, stdin)"""
+
+    def __init__(self, max_entries=RUN_CACHE_SIZE, max_bytes=RUN_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # Source digest -> fingerprint, so a repeated run of the same text skips parsing
+        self._fingerprints = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._uncacheable = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _digest(code, stdin):
+        return hashlib.sha256(f"{code}\x00{stdin or ''}".encode('utf-8', errors='surrogatepass')).hexdigest()
+
+    def _fingerprint(self, code, stdin, digest):
+        """Cache key for the run, or ``_UNCACHEABLE``"""
+        with self._lock:
+            fingerprint = self._fingerprints.get(digest)
+            if fingerprint is not None:
+                self._fingerprints.move_to_end(digest)
+                return fingerprint
+
+        try:
+            tree = ast.parse(code or '')
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is None or nondeterminism(tree) is not None:
+            fingerprint = _UNCACHEABLE
+        else:
+            # The AST dump drops comments, blank lines and formatting, as response_cache.normalize_code does
+            fingerprint = hashlib.sha256(f"{ast.dump(tree)}\x00{stdin or ''}".encode('utf-8')).hexdigest()
+
+        with self._lock:
+            self._fingerprints[digest] = fingerprint
+            while len(self._fingerprints) > self.max_entries:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+
+    def get(self, code, stdin=''):
+        """Return ``(result, token)``: a cached result or ``None``, and the token ``set`` takes"""
+        digest = self._digest(code, stdin)
+        fingerprint = self._fingerprint(code, stdin, digest)
+        with self._lock:
+            if fingerprint == _UNCACHEABLE:
+                self._uncacheable += 1
+                return None, None
+            entry = self._entries.get(fingerprint)
+            if entry is not None and entry['source'] in (None, digest):
+                self._entries.move_to_end(fingerprint)
+                self._hits += 1
+                return dict(entry['result']), (fingerprint, digest)
+            self._misses += 1
+        return None, (fingerprint, digest)
+
+    def set(self, token, result):
+        """Store the result of a run ``get`` missed, if every run would give it"""
+        if token is None or not cacheable(result):
+            return
+        fingerprint, digest = token
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        entry = {'result': dict(result), 'source': digest if _quotes_lines(result) else None, 'size': size}
+        with self._lock:
+            previous = self._entries.pop(fingerprint, None)
+            if previous is not None:
+                self._bytes -= previous['size']
+            self._entries[fingerprint] = entry
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted['size']
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'enabled': RUN_CACHE,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'uncacheable': self._uncacheable,
+                'evictions': self._evictions,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0
+            }
@@ -0,0 +1,930 @@
+"""Sandboxed execution of student code.
+
+Code submitted to ``/run`` never executes inside the web worker. Instead the
+backend keeps a pool of warm Python worker processes (this file run as a
+script). For every run a worker forks a fresh child which applies CPU, memory
+and wall-clock limits, executes the code with its own stdout/stderr pipes and
+reports back. A runaway submission only ever ties up its own pool slot.
+
+Output is capped at ``SANDBOX_STDOUT_BYTES``/``SANDBOX_STDERR_BYTES``; past
+the cap it is read and dropped, so a print in a tight loop costs neither the
+worker nor the web process memory. Error messages and tracebacks are cut
+short in the child, and the result it reports is capped at
+``SANDBOX_RESULT_BYTES``. ``SandboxPool.stream`` forwards output
+while the program is still running.
+
+Runs can be given the request's ``deadline``, which bounds the wait for a
+slot and cuts the wall-clock limit, and a ``cancelled`` check. Once that
+reports the request abandoned, the pool signals the worker (``SIGUSR1``),
+which kills the program and still reports its CPU time, so the worker stays
+warm and the wasted CPU is counted.
+"""
+import ast
+import builtins
+import codecs
+import inspect
+import io
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+try:
+    import metrics
+except ImportError:  # running as the isolated worker script
+    metrics = None
+
+# Default limits, overridable through the environment
+SANDBOX_WORKERS = int(os.getenv('SANDBOX_WORKERS', os.cpu_count() or 2))
+SANDBOX_CPU_SECONDS = float(os.getenv('SANDBOX_CPU_SECONDS', 5))
+SANDBOX_WALL_SECONDS = float(os.getenv('SANDBOX_WALL_SECONDS', 10))
+SANDBOX_MEMORY_MB = int(os.getenv('SANDBOX_MEMORY_MB', 256))
+SANDBOX_QUEUE_TIMEOUT = float(os.getenv('SANDBOX_QUEUE_TIMEOUT', 15))
+SANDBOX_CASE_SECONDS = float(os.getenv('SANDBOX_CASE_SECONDS', 2))
+SANDBOX_MAX_CASES = int(os.getenv('SANDBOX_MAX_CASES', 50))
+SANDBOX_STDOUT_BYTES = int(os.getenv('SANDBOX_STDOUT_BYTES', 64 * 1024))
+SANDBOX_STDERR_BYTES = int(os.getenv('SANDBOX_STDERR_BYTES', 16 * 1024))
+SANDBOX_RESULT_BYTES = int(os.getenv('SANDBOX_RESULT_BYTES', 1024 * 1024))
+
+# Output kept per test case in batch results
+_CASE_OUTPUT_CHARS = 2000
+
+# Characters kept of an error message or traceback
+_ERROR_CHARS = 4000
+
+# Extra time the pool waits on a worker before declaring it wedged
+_WORKER_GRACE_SECONDS = 5
+
+# How often a run with a ``cancelled`` check polls it
+_CANCEL_POLL_SECONDS = 0.25
+
+
+class SandboxBusy(Exception):
+    """Raised when no sandbox slot frees up within the queue timeout"""
+
+
+# ---------------------------------------------------------------------------
+# Worker side: runs inside ``python sandbox.py``
+# ---------------------------------------------------------------------------
+
+def _apply_limits(cpu_seconds, memory_mb):
+    """Apply resource limits to the current (child) process"""
+    if resource is None:
+        return
+    cpu = max(1, int(cpu_seconds + 0.999))
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _format_exception(e):
+    """Format a traceback without the sandbox's own frame"""
+    tb = e.__traceback__.tb_next if e.__traceback__ else None
+    return _clip(''.join(traceback.format_exception(type(e), e, tb)))
+
+
+def _clip(text, limit=_ERROR_CHARS):
+    """Cut an error message the student's code controls, e.g. ``raise Exception('x' * 10**8)``"""
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"\n[... {len(text) - limit} more characters not shown]"
+
+
+def _run_child(request, out_w, err_w, res_w):
+    """Execute one submission in the forked child and never return"""
+    try:
+        signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        os.setsid()
+        _apply_limits(request['cpu_seconds'], request['memory_mb'])
+
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_w, 1)
+        os.dup2(err_w, 2)
+        os.dup2(res_w, 3)
+        # Drop every other inherited descriptor, including the worker channel
+        os.closerange(4, 65536)
+        res_w = 3
+        sys.stdin = io.StringIO(request.get('stdin', ''))
+        sys.stdout = open(1, 'w', encoding='utf-8', errors='replace', closefd=False)
+        sys.stderr = open(2, 'w', encoding='utf-8', errors='replace', closefd=False)
+
+        if request.get('cases') is not None:
+            result = _run_cases(request)
+        else:
+            result = _run_program(request['code'])
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with open(res_w, 'w', closefd=False) as res:
+            res.write(json.dumps(result))
+    finally:
+        os._exit(0)
+
+
+def _run_program(code):
+    """Execute ``code`` once as a script"""
+    try:
+        compiled = compile(code, '<string>', 'exec')
+        exec(compiled, {'__builtins__': builtins, '__name__': '__main__'})
+        return {'success': True}
+    except SystemExit as e:
+        if e.code in (None, 0):
+            return {'success': True}
+        return {'success': False, 'error': _clip(f"Exited with status {e.code}"), 'traceback': ''}
+    except BaseException as e:
+        return {
+            'success': False,
+            'error': _clip(str(e) or type(e).__name__),
+            'traceback': _format_exception(e)
+        }
+
+
+class _CaseTimeout(BaseException):
+    """Raised inside a test case that ran past its time limit"""
+
+
+def _on_case_timeout(signum, frame):
+    raise _CaseTimeout()
+
+
+def normalize_output(text):
+    """Compare outputs ignoring trailing whitespace and blank lines at the end"""
+    return '\n'.join(line.rstrip() for line in (text or '').rstrip().splitlines())
+
+
+def _entry_point(namespace, name=None):
+    """Function a call-style test case invokes.
+
+    The named function if given, else a method of a LeetCode-style
+    ``Solution`` class, else the last function the code defines.
+    """
+    if name and callable(namespace.get(name)):
+        return namespace[name]
+    solution = namespace.get('Solution')
+    if isinstance(solution, type):
+        methods = [value for key, value in vars(solution).items() if callable(value) and not key.startswith('_')]
+        if methods:
+            return getattr(solution(), methods[0].__name__)
+    functions = [
+        value for value in namespace.values()
+        if isinstance(value, types.FunctionType) and value.__code__.co_filename == '<string>'
+    ]
+    return functions[-1] if functions else None
+
+
+def _call(function, args):
+    """Call ``function`` with example arguments (keywords when the names match)"""
+    if isinstance(args, dict):
+        try:
+            parameters = inspect.signature(function).parameters
+        except (TypeError, ValueError):
+            parameters = {}
+        if all(name in parameters for name in args):
+            return function(**args)
+        return function(*args.values())
+    if isinstance(args, (list, tuple)):
+        return function(*args)
+    return function(args)
+
+
+def _literal(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError):
+        return text
+
+
+def _run_case(compiled, case, state, entry_point):
+    """Run one test case; returns the function's result for call-style cases"""
+    if 'args' not in case:
+        exec(compiled, {'__builtins__': builtins, '__name__': '__main__'})
+        return None
+
+    # Function-call case: define the functions once, then call the entry point
+    if 'namespace' not in state:
+        namespace = {'__builtins__': builtins, '__name__': '__main__'}
+        exec(compiled, namespace)
+        state['namespace'] = namespace
+    function = _entry_point(state['namespace'], entry_point)
+    if function is None:
+        raise NameError("No function found to call with the test case arguments")
+    return _call(function, _literal(case['args']))
+
+
+def _run_cases(request):
+    """Compile once, then run every test case with its own stdin and stdout.
+
+    A case is either ``{'input', 'expected_output'}`` (the code runs as a
+    script and its printed output is compared) or ``{'args', 'expected'}``
+    with Python literals (the student's function is called and its return
+    value is compared).
+    """
+    try:
+        compiled = compile(request['code'], '<string>', 'exec')
+    except (SyntaxError, ValueError) as e:
+        return {'success': False, 'error': _clip(str(e)), 'traceback': _format_exception(e)}
+
+    signal.signal(signal.SIGALRM, _on_case_timeout)
+    real_stdout = sys.stdout
+    state = {}
+    results = []
+    for index, case in enumerate(request['cases']):
+        output = io.StringIO()
+        sys.stdin = io.StringIO(case.get('input') or '')
+        sys.stdout = output
+        error = None
+        returned = None
+        started = time.perf_counter()
+        signal.setitimer(signal.ITIMER_REAL, request['case_seconds'])
+        try:
+            returned = _run_case(compiled, case, state, request.get('entry_point'))
+        except _CaseTimeout:
+            error = 'timeout'
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                error = _clip(f"Exited with status {e.code}")
+        except BaseException as e:
+            error = _format_exception(e)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            sys.stdout = real_stdout
+        elapsed = time.perf_counter() - started
+
+        actual = output.getvalue()
+        if 'args' in case:
+            expected = case.get('expected')
+            if returned is None and actual.strip():
+                # Printed instead of returned: compare the printed text
+                matched = expected is None or normalize_output(actual) in (
+                    normalize_output(str(_literal(expected))), normalize_output(expected)
+                )
+            else:
+                matched = expected is None or returned == _literal(expected)
+                actual = repr(returned)
+        else:
+            expected = case.get('expected_output')
+            matched = expected is None or normalize_output(actual) == normalize_output(expected)
+
+        if error == 'timeout':
+            verdict = 'time_limit_exceeded'
+        elif error:
+            verdict = 'runtime_error'
+        elif not matched:
+            verdict = 'wrong_answer'
+        else:
+            verdict = 'passed'
+        result = {
+            'index': index,
+            'verdict': verdict,
+            'time_ms': round(elapsed * 1000, 2),
+            'output': actual[:_CASE_OUTPUT_CHARS],
+            'expected_output': expected
+        }
+        if verdict == 'runtime_error':
+            result['error'] = error
+        results.append(result)
+        if verdict != 'passed' and request.get('stop_on_failure'):
+            break
+
+    passed = sum(1 for result in results if result['verdict'] == 'passed')
+    return {
+        'success': True,
+        'cases': results,
+        'passed': passed,
+        'total': len(request['cases']),
+        'all_passed': passed == len(request['cases'])
+    }
+
+
+def _kill(pid):
+    """Kill the child and anything it spawned"""
+    for kill in (os.killpg, os.kill):
+        try:
+            kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def _collect(pid, fds, wall_seconds, limits=None, on_output=None):
+    """Read the child's pipes until EOF or the wall-clock deadline.
+
+    ``limits`` caps the bytes kept per descriptor; the rest is still read,
+    so the child never blocks on a full pipe, and only counted. Each kept
+    chunk is also passed to ``on_output(fd, data)`` as it arrives.
+    """
+    limits = limits or {}
+    chunks = {fd: [] for fd in fds}
+    kept = dict.fromkeys(fds, 0)
+    dropped = dict.fromkeys(fds, 0)
+    open_fds = list(fds)
+    deadline = time.monotonic() + wall_seconds
+    timed_out = False
+    while open_fds:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready, _, _ = select.select(open_fds, [], [], remaining)
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if not data:
+                open_fds.remove(fd)
+                continue
+            limit = limits.get(fd)
+            if limit is not None and kept[fd] + len(data) > limit:
+                keep = max(0, limit - kept[fd])
+                dropped[fd] += len(data) - keep
+                data = data[:keep]
+            if data:
+                kept[fd] += len(data)
+                chunks[fd].append(data)
+                if on_output is not None:
+                    on_output(fd, data)
+    if timed_out:
+        _kill(pid)
+    return {fd: b''.join(parts) for fd, parts in chunks.items()}, dropped, timed_out
+
+
+def _reap(pid, deadline):
+    """Wait for the child until ``deadline``, then kill it; returns ``(status, usage, timed_out)``.
+
+    The child can close its pipes and sleep, so EOF doesn't mean it exited.
+    Anything it left running in its process group is killed as well.
+    """
+    delay = 0.001
+    timed_out = False
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.05)
+    # Not reaped yet, so the process group id can't have been reused
+    _kill(pid)
+    _, status, usage = os.wait4(pid, 0)
+    return status, usage, timed_out
+
+
+# The worker's run in progress; the pool cancels it with SIGUSR1
+_current = {'pid': None, 'cancelled': False}
+
+
+def _on_cancel(signum, frame):
+    _current['cancelled'] = True
+    if _current['pid'] is not None:
+        _kill(_current['pid'])
+
+
+def _truncation_marker(dropped):
+    return f"\n[... output truncated, {dropped} more bytes not shown]\n"
+
+
+def _execute(request, emit=None):
+    """Fork a child for one run and build the response for the pool.
+
+    With ``request['stream']`` set, output is sent through ``emit`` as it
+    arrives and left out of the result.
+    """
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    res_r, res_w = os.pipe()
+    started = time.monotonic()
+
+    _current['cancelled'] = False
+    pid = os.fork()
+    if pid == 0:
+        for fd in (out_r, err_r, res_r):
+            os.close(fd)
+        _run_child(request, out_w, err_w, res_w)
+    _current['pid'] = pid
+    if _current['cancelled']:
+        # Cancelled between the fork and here
+        _kill(pid)
+
+    for fd in (out_w, err_w, res_w):
+        os.close(fd)
+    names = {out_r: 'stdout', err_r: 'stderr'}
+    limits = {
+        out_r: request.get('stdout_bytes', SANDBOX_STDOUT_BYTES),
+        err_r: request.get('stderr_bytes', SANDBOX_STDERR_BYTES),
+        # The child writes the result itself, so a huge one must not reach memory either
+        res_r: SANDBOX_RESULT_BYTES
+    }
+    streaming = bool(request.get('stream')) and emit is not None
+    on_output = None
+    if streaming:
+        # Chunks can split a multi-byte character
+        decoders = {fd: codecs.getincrementaldecoder('utf-8')(errors='replace') for fd in names}
+
+        def on_output(fd, data):
+            if fd in names:
+                text = decoders[fd].decode(data)
+                if text:
+                    emit({'stream': names[fd], 'output': text})
+    try:
+        data, dropped, timed_out = _collect(pid, (out_r, err_r, res_r), request['wall_seconds'], limits, on_output)
+    finally:
+        for fd in (out_r, err_r, res_r):
+            os.close(fd)
+    status, usage, outlived = _reap(pid, started + request['wall_seconds'])
+    timed_out = timed_out or outlived
+    _current['pid'] = None
+    elapsed = time.monotonic() - started
+
+    stdout = data[out_r].decode('utf-8', errors='replace')
+    stderr = data[err_r].decode('utf-8', errors='replace')
+    try:
+        result = json.loads(data[res_r]) if data[res_r] and not dropped[res_r] else None
+    except ValueError:
+        result = None
+
+    if _current['cancelled']:
+        result = {'success': False, 'error': 'Run cancelled', 'cancelled': True}
+    elif timed_out:
+        result = {'success': False, 'error': f"Time limit exceeded ({request['wall_seconds']:g}s wall clock)"}
+    elif os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL):
+        result = {'success': False, 'error': f"CPU time limit exceeded ({request['cpu_seconds']:g}s)"}
+    elif os.WIFSIGNALED(status):
+        result = {'success': False, 'error': f"Process terminated by signal {os.WTERMSIG(status)}"}
+    elif dropped[res_r]:
+        result = {'success': False, 'error': f"Result too large (over {SANDBOX_RESULT_BYTES} bytes)"}
+    elif result is None:
+        result = {'success': False, 'error': 'Process exited without reporting a result'}
+
+    if not result['success']:
+        result.setdefault('traceback', '')
+    truncated = {names[fd]: count for fd, count in dropped.items() if fd in names and count}
+    if truncated:
+        result['truncated'] = truncated
+    if streaming:
+        for fd, name in names.items():
+            # A character cut in half by the cap is dropped rather than shown as garbage
+            text = _truncation_marker(dropped[fd]) if dropped[fd] else decoders[fd].decode(b'', final=True)
+            if text:
+                emit({'stream': name, 'output': text})
+    else:
+        result['output'] = stdout + (_truncation_marker(dropped[out_r]) if dropped[out_r] else '')
+        if stderr:
+            result['stderr'] = stderr + (_truncation_marker(dropped[err_r]) if dropped[err_r] else '')
+    result['wall_ms'] = round(elapsed * 1000, 2)
+    result['cpu_ms'] = round((usage.ru_utime + usage.ru_stime) * 1000, 2)
+    result['memory_kb'] = usage.ru_maxrss
+    return result
+
+
+def _serve():
+    """Worker main loop: one JSON request per line in, one JSON result out"""
+    # Keep the protocol channel private so stray writes can't corrupt it
+    channel = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    channel.write(json.dumps({'ready': True}) + '\n')
+    channel.flush()
+
+    def emit(event):
+        channel.write(json.dumps(event) + '\n')
+        channel.flush()
+
+    signal.signal(signal.SIGUSR1, _on_cancel)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = _execute(json.loads(line), emit)
+        except Exception as e:
+            result = {'success': False, 'error': f"Sandbox failure: {e}"}
+        emit(result)
+
+
+# ---------------------------------------------------------------------------
+# Pool side: used by the web workers
+# ---------------------------------------------------------------------------
+
+def _worker_env():
+    """Environment of a worker: the sandbox settings, none of the web process's secrets.
+
+    The hash seed is fixed so every worker iterates sets of strings in the
+    same order, which keeps program output reproducible (and cacheable).
+    """
+    env = {name: value for name, value in os.environ.items()
+           if name.startswith('SANDBOX_') or name in ('PATH', 'LANG', 'LC_ALL', 'TZ')}
+    # What -I did: no script directory on sys.path (``-s`` covers user site-packages)
+    env['PYTHONSAFEPATH'] = '1'
+    env['PYTHONHASHSEED'] = '0'
+    return env
+
+
+class _Worker:
+    """A warm sandbox process and its pipes"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, '-s', os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=os.path.realpath(os.getenv('SANDBOX_WORKDIR', '/tmp')),
+            env=_worker_env(),
+            text=True,
+            bufsize=1
+        )
+        # Read straight from the pipe: lines buffered by readline() would be invisible to select()
+        self._buffer = b''
+        self._read_line(_WORKER_GRACE_SECONDS + 10)
+
+    def _read_line(self, timeout):
+        deadline = time.monotonic() + timeout
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._buffer:
+            ready, _, _ = select.select([fd], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                raise TimeoutError('sandbox worker did not respond')
+            data = os.read(fd, 65536)
+            if not data:
+                raise EOFError('sandbox worker exited')
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def events(self, request, cancelled=None):
+        """Send ``request`` and yield its output events, then its result.
+
+        ``cancelled`` is polled while waiting; once it returns a reason the
+        run is cancelled and its result carries that reason.
+        """
+        self.proc.stdin.write(json.dumps(request) + '\n')
+        self.proc.stdin.flush()
+        deadline = time.monotonic() + request['wall_seconds'] + _WORKER_GRACE_SECONDS
+        reason = None
+        while True:
+            remaining = max(0.0, deadline - time.monotonic())
+            if cancelled is None or reason is not None:
+                event = self._read_line(remaining)
+            else:
+                try:
+                    event = self._read_line(min(remaining, _CANCEL_POLL_SECONDS))
+                except TimeoutError:
+                    if remaining <= _CANCEL_POLL_SECONDS:
+                        raise
+                    reason = cancelled()
+                    if reason:
+                        self.cancel()
+                    continue
+            if 'stream' not in event and event.get('cancelled'):
+                event['cancelled'] = reason or True
+            yield event
+            if 'stream' not in event:
+                return
+
+    def run(self, request, cancelled=None):
+        for event in self.events(request, cancelled):
+            pass
+        return event
+
+    def cancel(self):
+        """Stop the run in progress; the worker still reports its result"""
+        try:
+            os.kill(self.proc.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    def abandon(self, events, reason):
+        """Cancel the run ``events`` belongs to and read on to its result"""
+        self.cancel()
+        result = None
+        try:
+            for event in events:
+                if 'stream' not in event:
+                    result = event
+        except (TimeoutError, EOFError, OSError, ValueError):
+            self.kill()
+        if result is None:
+            result = {'success': False, 'error': 'Run cancelled', 'traceback': ''}
+        result['cancelled'] = reason
+        return result
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=1)
+        except Exception:
+            pass
+
+
+def _limit(request, deadline):
+    """Cut the run's wall-clock limit to what is left of ``deadline``; returns whether it was cut"""
+    if deadline is None:
+        return False
+    remaining = deadline - time.monotonic()
+    if remaining >= request['wall_seconds']:
+        return False
+    request['wall_seconds'] = max(0.001, remaining)
+    return True
+
+
+def _deadline_result(result, request, limited):
+    """A run stopped by the wall-clock limit the deadline imposed was cancelled, not too slow"""
+    if limited and not result['success'] and result.get('error', '').startswith('Time limit'):
+        result['error'] = 'Request deadline exceeded'
+        result['cancelled'] = 'deadline'
+    return result
+
+
+class SandboxPool:
+    """Fixed-size pool of sandbox workers shared by all request threads"""
+
+    def __init__(self, size=SANDBOX_WORKERS, queue_timeout=SANDBOX_QUEUE_TIMEOUT):
+        self.size = size
+        self.queue_timeout = queue_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._waiting = 0
+        self._busy = 0
+        # Workers that died and could not be replaced yet
+        self._missing = 0
+        self._runs = 0
+        self._failures = 0
+        self._timeouts = 0
+        self._cancelled = 0
+        self._wasted_cpu_ms = 0.0
+        self._latencies = deque(maxlen=1000)
+
+    def start(self):
+        """Spawn the worker processes (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(_Worker())
+
+    def run(self, code, stdin='', cpu_seconds=SANDBOX_CPU_SECONDS,
+            wall_seconds=SANDBOX_WALL_SECONDS, memory_mb=SANDBOX_MEMORY_MB, deadline=None, cancelled=None):
+        """Run ``code`` in a free sandbox slot and return its result dict.
+
+        ``deadline`` is an absolute ``time.monotonic()`` value bounding the
+        wait for a slot and the run; ``cancelled()`` returns a reason once
+        the run should stop. Either ends the run with ``cancelled`` set to
+        the reason in the result.
+        """
+        return self._submit({
+            'code': code,
+            'stdin': stdin or '',
+            'cpu_seconds': cpu_seconds,
+            'wall_seconds': wall_seconds,
+            'memory_mb': memory_mb
+        }, deadline, cancelled)
+
+    def run_batch(self, code, cases, case_seconds=SANDBOX_CASE_SECONDS,
+                  stop_on_failure=False, memory_mb=SANDBOX_MEMORY_MB, entry_point=None,
+                  deadline=None, cancelled=None):
+        """Compile ``code`` once and run it against each test case in one sandbox.
+
+        ``cases`` is a list of ``{'input': ..., 'expected_output': ...}``
+        (stdin/stdout) or ``{'args': ..., 'expected': ...}`` (function call,
+        Python literals) dicts; a missing expected output only checks the
+        code runs. ``entry_point`` names the function call cases invoke.
+        ``deadline`` and ``cancelled`` are as for ``run``.
+        """
+        if len(cases) > SANDBOX_MAX_CASES:
+            raise ValueError(f"At most {SANDBOX_MAX_CASES} test cases can be run at once")
+        budget = case_seconds * max(1, len(cases)) + 1
+        return self._submit({
+            'code': code,
+            'cases': cases,
+            'case_seconds': case_seconds,
+            'stop_on_failure': stop_on_failure,
+            'entry_point': entry_point,
+            'cpu_seconds': budget,
+            'wall_seconds': budget,
+            'memory_mb': memory_mb
+        }, deadline, cancelled)
+
+    def stream(self, code, stdin='', cpu_seconds=SANDBOX_CPU_SECONDS,
+               wall_seconds=SANDBOX_WALL_SECONDS, memory_mb=SANDBOX_MEMORY_MB, deadline=None, cancelled=None):
+        """Run ``code`` and return an iterator over its events as they happen.
+
+        Output arrives as ``{'stream': 'stdout' | 'stderr', 'output': text}``
+        and the last event is ``{'result': ...}``, the ``run`` result without
+        the output. The slot is taken before this returns (``SandboxBusy``
+        is raised here, not while iterating); closing the iterator early
+        cancels the run. ``deadline`` and ``cancelled`` are as for ``run``.
+        """
+        request = {
+            'code': code,
+            'stdin': stdin or '',
+            'cpu_seconds': cpu_seconds,
+            'wall_seconds': wall_seconds,
+            'memory_mb': memory_mb,
+            'stream': True
+        }
+        started = time.monotonic()
+        worker = self._acquire('run', deadline)
+        limited = _limit(request, deadline)
+        events = self._stream(worker, request, started, time.monotonic() - started, limited, cancelled)
+        next(events)
+        return events
+
+    def _stream(self, worker, request, started, queued, limited, cancelled):
+        events = None
+        result = None
+        try:
+            # ``stream`` runs the generator up to here, so closing it (or
+            # dropping it) before the first event still frees the slot
+            yield
+            events = worker.events(request, cancelled)
+            for event in events:
+                if 'stream' in event:
+                    yield event
+                else:
+                    result = event
+        except (TimeoutError, EOFError, OSError, ValueError) as e:
+            worker.kill()
+            result = {'success': False, 'error': f"Sandbox failure: {e}", 'traceback': ''}
+        except GeneratorExit:
+            # The client went away mid-run: stop the program but keep the worker
+            if events is not None:
+                result = worker.abandon(events, 'disconnect')
+                self._finish('run', result, started, queued)
+            raise
+        finally:
+            if result is None and events is not None:
+                worker.kill()
+            self._release(worker)
+        yield {'result': self._finish('run', _deadline_result(result, request, limited), started, queued)}
+
+    def _acquire(self, kind, deadline=None):
+        """Take an idle worker, waiting up to the queue timeout (or the deadline, if sooner)"""
+        self.start()
+        if self._missing:
+            self._respawn()
+        timeout = self.queue_timeout
+        if deadline is not None:
+            timeout = min(timeout, max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            metrics.inc('sandbox_runs_total', kind=kind, outcome='busy')
+            raise SandboxBusy('All sandboxes are busy, please try again shortly')
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._busy += 1
+        metrics.inc('sandbox_runs_in_flight')
+        return worker
+
+    def _release(self, worker):
+        try:
+            if not worker.alive():
+                worker = self._spawn()
+            if worker is not None:
+                self._idle.put(worker)
+        finally:
+            with self._lock:
+                self._busy -= 1
+            metrics.dec('sandbox_runs_in_flight')
+
+    def _spawn(self):
+        """A new worker, or ``None`` if it failed to start; ``_acquire`` tries again"""
+        try:
+            return _Worker()
+        except Exception:
+            with self._lock:
+                self._missing += 1
+            return None
+
+    def _respawn(self):
+        """Replace workers that failed to start"""
+        while True:
+            with self._lock:
+                if not self._missing:
+                    return
+                self._missing -= 1
+            worker = self._spawn()
+            if worker is None:
+                return
+            self._idle.put(worker)
+
+    def _submit(self, request, deadline=None, cancelled=None):
+        started = time.monotonic()
+        kind = 'batch' if 'cases' in request else 'run'
+        worker = self._acquire(kind, deadline)
+        queued = time.monotonic() - started
+        limited = _limit(request, deadline)
+        try:
+            result = worker.run(request, cancelled)
+        except (TimeoutError, EOFError, OSError, ValueError) as e:
+            # The worker itself is wedged or gone: replace it
+            worker.kill()
+            result = {'success': False, 'error': f"Sandbox failure: {e}", 'traceback': ''}
+        finally:
+            self._release(worker)
+        return self._finish(kind, _deadline_result(result, request, limited), started, queued)
+
+    def _finish(self, kind, result, started, queued):
+        """Add timings to ``result`` and record it in the stats and metrics"""
+        elapsed = time.monotonic() - started
+        result['queue_ms'] = round(queued * 1000, 2)
+        result['duration_ms'] = round(elapsed * 1000, 2)
+        cancelled = result.get('cancelled')
+        timed_out = not result['success'] and result.get('error', '').startswith(('Time limit', 'CPU time limit'))
+        with self._lock:
+            self._runs += 1
+            self._latencies.append(elapsed)
+            if not result['success']:
+                self._failures += 1
+                if timed_out:
+                    self._timeouts += 1
+            if cancelled:
+                self._cancelled += 1
+                self._wasted_cpu_ms += result.get('cpu_ms', 0)
+        if cancelled:
+            outcome = 'cancelled'
+            metrics.inc('sandbox_wasted_cpu_seconds_total', result.get('cpu_ms', 0) / 1000, kind=kind, reason=cancelled)
+        else:
+            outcome = 'ok' if result['success'] else 'timeout' if timed_out else 'error'
+        metrics.inc('sandbox_runs_total', kind=kind, outcome=outcome)
+        metrics.observe('sandbox_queue_seconds', queued, kind=kind)
+        metrics.observe('sandbox_run_duration_seconds', elapsed - queued, kind=kind)
+        if result.get('memory_kb'):
+            metrics.observe('sandbox_memory_kb', result['memory_kb'], kind=kind)
+        return result
+
+    def stats(self):
+        """Queue depth, utilisation and recent run latency"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'workers': self.size if self._started else 0,
+                'busy': self._busy,
+                'missing': self._missing,
+                'queue_depth': self._waiting,
+                'runs': self._runs,
+                'failures': self._failures,
+                'timeouts': self._timeouts,
+                'cancelled': self._cancelled,
+                'wasted_cpu_ms': round(self._wasted_cpu_ms, 2)
+            }
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            index = min(len(latencies) - 1, int(p / 100 * len(latencies)))
+            return round(latencies[index] * 1000, 2)
+
+        stats['latency_ms'] = {
+            'p50': percentile(50),
+            'p95': percentile(95),
+            'p99': percentile(99),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0.0
+        }
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """Return the process-wide sandbox pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool()
+    return _pool
+
+
+if __name__ == '__main__':
+    _serve()
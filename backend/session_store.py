@@ -0,0 +1,389 @@
+"""Per-user session state: tutor conversation history and solving progress.
+
+Two backends share one interface:
+
+* ``MemorySessionStore`` keeps compact records in a process-local LRU with a
+  cap on users and idle eviction (the default, fine for a single worker)
+* ``SQLiteSessionStore`` keeps records in a WAL-mode SQLite database so all
+  gunicorn workers see the same state and it survives restarts. History
+  appends are buffered and flushed in batches by a background thread;
+  progress updates are transactions.
+
+Progress is changed through ``update_progress``, which applies an update
+to the stored record atomically, so concurrent attempts are never lost.
+
+The stores also keep the graded test cases of generated problems
+(``save_problem``/``get_problem``), so a submission reaching another worker
+than the one that generated its problem is still graded on verified cases.
+"""
+import atexit
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', 100000))
+SESSION_IDLE_TTL = float(os.getenv('SESSION_IDLE_TTL', 7 * 24 * 3600))
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 0.05))
+SESSION_FLUSH_BATCH = int(os.getenv('SESSION_FLUSH_BATCH', 500))
+HISTORY_LIMIT = int(os.getenv('HISTORY_LIMIT', 10))
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+# Packed progress: (easy_solved, medium_solved, hard_solved, difficulty index, concepts,
+# skill ratings, attempt counts, next problem per track); the last three are the
+# recommender's arrays
+_EMPTY_PROGRESS = (0, 0, 0, 0, (), array('h'), array('H'), array('B'))
+_ARRAY_TYPES = ('h', 'H', 'B')
+
+
+def pack_progress(progress):
+    difficulty = progress.get('current_difficulty', 'easy')
+    return (
+        progress.get('easy_solved', 0),
+        progress.get('medium_solved', 0),
+        progress.get('hard_solved', 0),
+        DIFFICULTIES.index(difficulty) if difficulty in DIFFICULTIES else 0,
+        tuple(sorted(progress.get('concepts_mastered', ()))),
+        array('h', progress.get('skills', ())),
+        array('H', progress.get('attempts', ())),
+        array('B', progress.get('next', ()))
+    )
+
+
+def unpack_progress(packed):
+    easy, medium, hard, difficulty, concepts, skills, attempts, upcoming = packed
+    # Copies, so callers can update them without touching the stored record
+    return {
+        'easy_solved': easy,
+        'medium_solved': medium,
+        'hard_solved': hard,
+        'current_difficulty': DIFFICULTIES[difficulty],
+        'concepts_mastered': set(concepts),
+        'skills': array('h', skills),
+        'attempts': array('H', attempts),
+        'next': array('B', upcoming)
+    }
+
+
+def _load_progress(progress):
+    """Packed progress from its JSON form; rows written before the recommender have no arrays"""
+    packed = list(progress) + [[]] * (len(_EMPTY_PROGRESS) - len(progress))
+    packed[4] = tuple(packed[4])
+    for index, typecode in enumerate(_ARRAY_TYPES, start=5):
+        packed[index] = array(typecode, packed[index])
+    return tuple(packed)
+
+
+def _trim(history, entry, limit):
+    return (tuple(history) + (entry,))[-limit:]
+
+
+def _unpack_history(history):
+    return [{'question': question, 'response': response} for question, response in history]
+
+
+class _Session:
+    __slots__ = ('last_seen', 'history', 'progress')
+
+    def __init__(self, last_seen, history=(), progress=_EMPTY_PROGRESS):
+        self.last_seen = last_seen
+        self.history = history
+        self.progress = progress
+
+
+class MemorySessionStore:
+    """Process-local LRU of compact session records"""
+
+    def __init__(self, max_users=SESSION_MAX_USERS, idle_ttl=SESSION_IDLE_TTL, history_limit=HISTORY_LIMIT):
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.history_limit = history_limit
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = 0
+
+    def get_history(self, user_id):
+        with self._lock:
+            session = self._touch(user_id, create=False)
+            return _unpack_history(session.history) if session else []
+
+    def append_history(self, user_id, question, response):
+        with self._lock:
+            session = self._touch(user_id)
+            session.history = _trim(session.history, (question, response), self.history_limit)
+
+    def get_progress(self, user_id):
+        with self._lock:
+            session = self._touch(user_id, create=False)
+            return unpack_progress(session.progress if session else _EMPTY_PROGRESS)
+
+    def save_progress(self, user_id, progress):
+        with self._lock:
+            self._touch(user_id).progress = pack_progress(progress)
+
+    def update_progress(self, user_id, update):
+        """Apply ``update(progress)`` to the stored progress atomically; returns the new progress"""
+        with self._lock:
+            session = self._touch(user_id)
+            progress = unpack_progress(session.progress)
+            update(progress)
+            session.progress = pack_progress(progress)
+            return progress
+
+    def save_problem(self, problem_id, problem):
+        # Only this worker could read it back, and its problem index already has it
+        pass
+
+    def get_problem(self, problem_id):
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'users': len(self._sessions), 'evicted': self._evicted}
+
+    def _touch(self, user_id, create=True):
+        """Look up a session, refresh its recency and evict idle/excess users"""
+        now = time.monotonic()
+        self._evict_idle(now)
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.last_seen = now
+            self._sessions.move_to_end(user_id)
+        elif create:
+            session = self._sessions[user_id] = _Session(now)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+                self._evicted += 1
+        return session
+
+    def _evict_idle(self, now):
+        # Sessions are kept in recency order, so idle ones are always at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._evicted += 1
+
+
+class SQLiteSessionStore:
+    """Session records in a WAL-mode SQLite database shared by all workers.
+
+    History is an append-only table, so appends are buffered and written in
+    batches without reading anything back. Progress is read, updated and
+    written in one ``BEGIN IMMEDIATE`` transaction, so workers updating the
+    same user never overwrite each other's changes.
+    """
+
+    def __init__(self, path=SESSION_DB_PATH, idle_ttl=SESSION_IDLE_TTL, history_limit=HISTORY_LIMIT,
+                 flush_interval=SESSION_FLUSH_INTERVAL, flush_batch=SESSION_FLUSH_BATCH):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.history_limit = history_limit
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self._local = threading.local()
+        # Interactions waiting to be written and being written, in order
+        self._pending = []
+        self._inflight = []
+        self._lock = threading.Lock()
+        self._flush_now = threading.Event()
+        self._writes = 0
+        self._flushes = 0
+        self._last_expiry = 0.0
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with self._transaction(connection, immediate=True):
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                " user_id TEXT PRIMARY KEY,"
+                " progress TEXT NOT NULL,"
+                " updated REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " user_id TEXT NOT NULL,"
+                " question TEXT NOT NULL,"
+                " response TEXT NOT NULL,"
+                " created REAL NOT NULL"
+                ")"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS problems ("
+                " problem_id TEXT PRIMARY KEY,"
+                " problem TEXT NOT NULL,"
+                " created REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS progress_updated ON progress (updated)")
+            connection.execute("CREATE INDEX IF NOT EXISTS problems_created ON problems (created)")
+            connection.execute("CREATE INDEX IF NOT EXISTS history_user ON history (user_id, id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS history_created ON history (created)")
+
+        self._writer = threading.Thread(target=self._flush_loop, name='session-store-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def get_history(self, user_id):
+        rows = self._connection().execute(
+            "SELECT question, response FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, self.history_limit)
+        ).fetchall()
+        history = tuple(reversed(rows))
+        with self._lock:
+            # Buffered interactions are newer than the database
+            buffered = tuple((question, response) for uid, question, response, _ in self._inflight + self._pending
+                             if uid == user_id)
+        return _unpack_history((history + buffered)[-self.history_limit:])
+
+    def append_history(self, user_id, question, response):
+        with self._lock:
+            self._pending.append((user_id, question, response, time.time()))
+            if len(self._pending) >= self.flush_batch:
+                self._flush_now.set()
+
+    def get_progress(self, user_id):
+        return unpack_progress(self._read_progress(self._connection(), user_id))
+
+    def save_progress(self, user_id, progress):
+        self.update_progress(user_id, lambda stored: stored.update(progress))
+
+    def update_progress(self, user_id, update):
+        """Apply ``update(progress)`` to the stored progress atomically; returns the new progress"""
+        connection = self._connection()
+        with self._transaction(connection, immediate=True):
+            progress = unpack_progress(self._read_progress(connection, user_id))
+            update(progress)
+            connection.execute(
+                "INSERT INTO progress (user_id, progress, updated) VALUES (?, ?, ?)"
+                " ON CONFLICT(user_id) DO UPDATE SET progress = excluded.progress, updated = excluded.updated",
+                (user_id, json.dumps(pack_progress(progress), default=list), time.time())
+            )
+        with self._lock:
+            self._writes += 1
+        return progress
+
+    def save_problem(self, problem_id, problem):
+        """Share a generated problem's record (JSON-serializable) with the other workers"""
+        connection = self._connection()
+        with self._transaction(connection):
+            connection.execute("INSERT OR REPLACE INTO problems (problem_id, problem, created) VALUES (?, ?, ?)",
+                               (problem_id, json.dumps(problem, default=list), time.time()))
+
+    def get_problem(self, problem_id):
+        row = self._connection().execute("SELECT problem FROM problems WHERE problem_id = ?",
+                                          (problem_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def flush(self):
+        """Write all buffered interactions now"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._inflight = batch
+        if not batch:
+            return
+        connection = self._connection()
+        try:
+            self._write(connection, batch, time.time())
+        except sqlite3.Error:
+            # Put the batch back ahead of anything queued meanwhile
+            with self._lock:
+                self._pending = batch + self._pending
+                self._inflight = []
+            raise
+        with self._lock:
+            self._inflight = []
+            self._writes += len(batch)
+            self._flushes += 1
+
+    def _write(self, connection, batch, now):
+        users = {user_id for user_id, _, _, _ in batch}
+        with self._transaction(connection):
+            connection.executemany(
+                "INSERT INTO history (user_id, question, response, created) VALUES (?, ?, ?, ?)", batch
+            )
+            # Keep the newest interactions and mark the users active
+            connection.executemany(
+                "DELETE FROM history WHERE user_id = ? AND id <= ("
+                " SELECT id FROM history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                [(user_id, user_id, self.history_limit) for user_id in users]
+            )
+            connection.executemany("UPDATE progress SET updated = ? WHERE user_id = ?",
+                                   [(now, user_id) for user_id in users])
+            if self.idle_ttl and now - self._last_expiry > 60:
+                connection.execute("DELETE FROM progress WHERE updated < ?", (now - self.idle_ttl,))
+                connection.execute("DELETE FROM history WHERE created < ?", (now - self.idle_ttl,))
+                connection.execute("DELETE FROM problems WHERE created < ?", (now - self.idle_ttl,))
+                self._last_expiry = now
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            writes, flushes = self._writes, self._flushes
+        users = self._connection().execute(
+            "SELECT COUNT(*) FROM (SELECT user_id FROM progress UNION SELECT user_id FROM history)"
+        ).fetchone()[0]
+        return {
+            'backend': 'sqlite',
+            'users': users,
+            'pending_writes': pending,
+            'writes': writes,
+            'flushes': flushes
+        }
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Transactions are begun explicitly, see _transaction
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(connection, immediate=False):
+        """A transaction; ``immediate`` takes the write lock up front, before anything is read"""
+        connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _read_progress(connection, user_id):
+        row = connection.execute("SELECT progress FROM progress WHERE user_id = ?", (user_id,)).fetchone()
+        return _load_progress(json.loads(row[0])) if row is not None else _EMPTY_PROGRESS
+
+    def _flush_loop(self):
+        while True:
+            self._flush_now.wait(self.flush_interval)
+            self._flush_now.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Session store flush failed: %s", e)
+
+
+def create_session_store(backend=SESSION_STORE):
+    """Build the session store selected by ``SESSION_STORE``"""
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'memory':
+        return MemorySessionStore()
+    raise ValueError(f"Unknown session store backend: {backend}")
@@ -0,0 +1,11 @@
+import pytest
+
+import sandbox
+
+
+@pytest.fixture(scope='session', autouse=True)
+def shared_sandbox_pool():
+    """Stop the sandbox workers the app's routes started"""
+    yield
+    if sandbox._pool is not None:
+        sandbox._pool.close()
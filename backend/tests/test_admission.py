@@ -0,0 +1,57 @@
+import pytest
+
+import admission
+import app as flask_app
+from admission import AdmissionController, AdmissionRejected, caller_identity
+
+
+def test_identity_ignores_what_the_client_sent():
+    assert caller_identity('1.2.3.4, 10.0.0.7', '10.0.0.1', proxy_hops=1) == 'addr:10.0.0.7'
+    assert caller_identity('spoofed', '10.0.0.1', proxy_hops=0) == 'addr:10.0.0.1'
+    assert caller_identity(None, '10.0.0.1') == 'addr:10.0.0.1'
+
+
+def test_llm_requests_over_the_burst_are_shed():
+    controller = AdmissionController(slots=100)
+    for _ in range(int(admission.ADMISSION_USER_LLM_BURST)):
+        controller.admit('ai', 'addr:a').release()
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit('ai', 'addr:a')
+    assert rejected.value.reason == 'user_rate'
+    assert rejected.value.retry_after >= 1
+    # Another caller still has its own bucket
+    controller.admit('ai', 'addr:b').release()
+
+
+def test_full_queue_sheds_and_refunds():
+    controller = AdmissionController(slots=1, max_queue=0)
+    ticket = controller.admit('ai', 'addr:a')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit('ai', 'addr:b')
+    assert rejected.value.reason == 'queue_full'
+    ticket.release()
+    assert controller.stats()['free_slots'] == 1
+    assert controller.stats()['rejected'] == {'queue_full': 1}
+
+
+def test_overdrawn_cpu_quota_waits_for_refill():
+    controller = AdmissionController()
+    ticket = controller.admit('run', 'addr:a')
+    ticket.charge_cpu(admission.ADMISSION_USER_CPU_BURST * 1000 + 1000)
+    ticket.release()
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit('run', 'addr:a')
+    assert rejected.value.reason == 'cpu_quota'
+
+
+def test_changing_user_id_does_not_escape_the_limit(monkeypatch):
+    monkeypatch.setattr(flask_app, 'admission', AdmissionController(slots=1, max_queue=0))
+    ticket = flask_app.admission.admit('ai', 'addr:127.0.0.1')
+    try:
+        response = flask_app.app.test_client().post('/ai', json={'question': 'hi', 'user_id': 'someone-else'})
+    finally:
+        ticket.release()
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['success'] is False
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+from admission import AdmissionController
+from session_store import MemorySessionStore
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(asgi, 'session_store', MemorySessionStore())
+    return TestClient(asgi.app)
+
+
+def tutor(answer, delay=0):
+    async def async_get_tutor_response(question_type, problem, code, question, history, deadline=None):
+        await asyncio.sleep(delay)
+        return answer
+    return async_get_tutor_response
+
+
+def test_ai_keeps_the_flask_contract(client, monkeypatch):
+    monkeypatch.setattr(asgi, 'async_get_tutor_response', tutor('A stack is LIFO.'))
+    response = client.post('/ai', json={'question': 'What is a stack?', 'user_id': 'student'})
+    assert response.status_code == 200
+    assert response.json() == {'success': True, 'response': 'A stack is LIFO.'}
+    assert asgi.session_store.get_history('student') == [{'question': 'What is a stack?',
+                                                          'response': 'A stack is LIFO.'}]
+
+
+def test_request_past_its_deadline_gets_504(client, monkeypatch):
+    monkeypatch.setattr(asgi, 'async_get_tutor_response', tutor('late', delay=5))
+    response = client.post('/ai', json={'question': 'What is a stack?'}, headers={'X-Request-Timeout': '0.2'})
+    assert response.status_code == 504
+    assert response.json()['success'] is False
+
+
+def test_shed_request_gets_429(client, monkeypatch):
+    monkeypatch.setattr(asgi, 'admission', AdmissionController(slots=1, max_queue=0))
+    ticket = asgi.admission.admit('ai', 'addr:elsewhere')
+    try:
+        response = client.post('/ai', json={'question': 'What is a stack?'})
+    finally:
+        ticket.release()
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_run_is_served_by_the_flask_view(client):
+    response = client.post('/run', json={'code': "print(6 * 7)"})
+    assert response.status_code == 200
+    assert response.json()['output'] == '42\n'
+
+
+def test_unknown_category_is_a_bad_request(client):
+    response = client.get('/generate-question', params={'category': 'no-such-track'})
+    assert response.status_code == 400
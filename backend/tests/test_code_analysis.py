@@ -0,0 +1,25 @@
+import pytest
+
+from code_analysis import analyze, first_error
+
+TERMINATING = [
+    # Ends with IndexError after printing every element
+    "nums = [1, 2]\ni = 0\nwhile True:\n    print(nums[i])\n    i += 1\n",
+    "x = 0\nwhile True:\n    assert x < 3\n    x += 1\n",
+    "f = lambda: helper_never_defined()\n",
+    'globals()["x"] = 5\nprint(x)\n',
+]
+
+
+@pytest.mark.parametrize('code', TERMINATING)
+def test_code_that_can_terminate_is_not_blocked(code):
+    assert first_error(analyze(code)) is None
+
+
+@pytest.mark.parametrize('code, kind', [
+    ("while True:\n    pass\n", 'infinite_loop'),
+    ("x = 0\nwhile True:\n    x += 1\n", 'infinite_loop'),
+    ("print(y)\n", 'undefined_name'),
+])
+def test_certain_failures_are_blocked(code, kind):
+    assert first_error(analyze(code))['kind'] == kind
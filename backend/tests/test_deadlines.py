@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from deadlines import DEADLINE, DISCONNECT, Deadline, RequestCancelled, client_timeout
+from problem_parser import ProblemIndex
+from problem_verifier import VERIFIED, ProblemVerifier
+from sandbox import SandboxPool
+
+PROBLEM = """Title: Count Items
+Description: Return how many items there are.
+
+Examples:
+Example 1:
+Input: nums = [1, 2, 3]
+Output: 3
+
+Reference Solution:
+```python
+def solve(nums):
+    {body}
+```
+"""
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = SandboxPool(size=1)
+    yield pool
+    pool.close()
+
+
+def test_client_timeout_is_validated():
+    assert client_timeout('2.5') == 2.5
+    assert client_timeout('soon') is None
+    assert client_timeout('-1') is None
+
+
+def test_deadline_passes():
+    deadline = Deadline('run', timeout=0.01)
+    assert deadline.cancelled() is None
+    time.sleep(0.02)
+    assert deadline.cancelled() == DEADLINE
+    with pytest.raises(RequestCancelled):
+        deadline.check()
+
+
+def test_disconnect_is_seen_by_later_checks():
+    closed = []
+    deadline = Deadline('ai', timeout=30, closed=lambda: bool(closed))
+    assert deadline.cancelled() is None
+    closed.append(True)
+    assert deadline.cancelled() == DISCONNECT
+    # The first reason sticks
+    assert deadline.abandon(DEADLINE) == DISCONNECT
+
+
+def test_verification_run_stops_at_the_deadline(pool):
+    verifier = ProblemVerifier(ProblemIndex(), pool=pool)
+    record = verifier.index.add(PROBLEM.format(body='import time\n    time.sleep(5)\n    return len(nums)'))
+
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        verifier.verify(record, 'arrays', deadline=time.monotonic() + 0.5)
+    assert time.monotonic() - started < 3
+    # A run cut short decides nothing about the problem
+    assert verifier.stats()['rejected'] == 0
+
+
+def test_verification_run_stops_when_cancelled(pool):
+    verifier = ProblemVerifier(ProblemIndex(), pool=pool)
+    record = verifier.index.add(PROBLEM.format(body='import time\n    time.sleep(5)\n    return len(nums)'))
+    with pytest.raises(RequestCancelled):
+        verifier.verify(record, 'arrays', cancelled=lambda: DISCONNECT)
+
+
+def test_verification_within_the_deadline(pool):
+    verifier = ProblemVerifier(ProblemIndex(), pool=pool)
+    record = verifier.index.add(PROBLEM.format(body='return len(nums)'))
+    status, _, _ = verifier.verify(record, 'arrays', deadline=time.monotonic() + 30)
+    assert status == VERIFIED
@@ -0,0 +1,30 @@
+import pytest
+
+from intent import GREETING, LEARN, OTHER, THANKS, IntentClassifier
+
+
+@pytest.fixture(scope='module')
+def classifier():
+    return IntentClassifier()
+
+
+@pytest.mark.parametrize('message', [
+    'hey i am stuck', 'teach me linked lists', 'i want to learn recursion', 'ty next question',
+    'thanks but it still fails', 'hi my code gives an index error', 'teach me dynamic programming'
+])
+def test_requests_go_to_the_model(classifier, message):
+    assert classifier.classify(message) == OTHER
+    assert classifier.canned_response(message) is None
+
+
+@pytest.mark.parametrize('message, label', [
+    ('Hi!', GREETING), ('heyyy there', GREETING), ('thanks a lot!!', THANKS), ('ok ty', THANKS),
+    ('thank you so much', THANKS), ('I want to learn', LEARN), ('I have an interview tomorrow', LEARN)
+])
+def test_trivial_messages_are_answered_locally(classifier, message, label):
+    assert classifier.classify(message) == label
+
+
+def test_learn_needs_an_exact_phrase(classifier):
+    # Close to the learn phrases, but only the trie may answer with the learn reply
+    assert classifier.classify('i would like to learn coding') != LEARN
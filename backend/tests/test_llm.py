@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import groq
+import pytest
+
+import llm
+from bench.mock_groq import MockConfig, MockStats, start_mock_server
+from llm import LLMDeadlineExceeded
+
+MESSAGES = [{'role': 'user', 'content': 'What is a stack?'}]
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = start_mock_server(MockConfig())
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def upstream(server, monkeypatch):
+    """Points the gateway's clients at the mock API; returns its config and request counts"""
+    handler = server.RequestHandlerClass
+    monkeypatch.setattr(handler, 'config', MockConfig(latency_ms=0, jitter_ms=0, tokens_per_second=10 ** 6,
+                                                      completion_tokens=10))
+    monkeypatch.setattr(handler, 'stats', MockStats())
+    monkeypatch.setenv('GROQ_BASE_URL', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setenv('GROQ_API_KEY', 'test')
+    monkeypatch.setattr(llm, '_client', None)
+    monkeypatch.setattr(llm, '_async_client', None)
+    monkeypatch.setattr(llm, '_async_slots', None)
+    monkeypatch.setattr(llm, '_backoff', lambda attempt, error: 0)
+    return handler.config, handler.stats
+
+
+def together(call, count):
+    """Run ``call`` on ``count`` threads at once; returns results or raised errors"""
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = call(index)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_rate_limits_and_server_errors_are_retried(upstream):
+    config, requests = upstream
+    config.error_rate, config.error_status = 1.0, 503
+    retries = llm.stats()['retries']
+    with pytest.raises(groq.InternalServerError):
+        llm.chat_completion(MESSAGES, 'mock')
+    assert requests.requests == llm.LLM_MAX_RETRIES + 1
+    assert llm.stats()['retries'] - retries == llm.LLM_MAX_RETRIES
+
+
+def test_retry_succeeds_after_a_rate_limit(upstream, monkeypatch):
+    config, requests = upstream
+    config.error_rate = 1.0
+
+    def backoff(attempt, error):
+        config.error_rate = 0.0
+        return 0
+
+    monkeypatch.setattr(llm, '_backoff', backoff)
+    response = llm.chat_completion(MESSAGES, 'mock')
+    assert response.choices[0].message.content
+    assert requests.requests == 2 and requests.errors == 1
+
+
+def test_slow_upstream_misses_the_deadline(upstream):
+    config, _ = upstream
+    config.latency_ms = 500
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        llm.chat_completion(MESSAGES, 'mock', deadline=time.monotonic() + 0.1)
+    assert time.monotonic() - started < 0.4
+
+
+def test_identical_deterministic_calls_share_one_request(upstream):
+    config, requests = upstream
+    config.latency_ms = 300
+    coalesced = llm.stats()['coalesced']
+
+    responses = together(lambda index: llm.chat_completion(MESSAGES, 'mock', temperature=0), 5)
+    assert requests.requests == 1
+    assert len({response.id for response in responses}) == 1
+    assert llm.stats()['coalesced'] - coalesced == 4
+
+
+def test_sampled_calls_are_not_shared(upstream):
+    config, requests = upstream
+    config.latency_ms = 200
+    responses = together(lambda index: llm.chat_completion(MESSAGES, 'mock', temperature=0.7), 2)
+    assert requests.requests == 2
+    assert responses[0].id != responses[1].id
+
+
+def test_async_calls_are_coalesced(upstream):
+    config, requests = upstream
+    config.latency_ms = 200
+
+    async def ask():
+        return await asyncio.gather(*(llm.async_chat_completion(MESSAGES, 'mock', temperature=0) for _ in range(3)))
+
+    responses = asyncio.run(ask())
+    assert requests.requests == 1
+    assert len({response.id for response in responses}) == 1
+
+
+def test_follower_outlives_the_leaders_deadline(upstream):
+    config, requests = upstream
+    config.latency_ms = 300
+
+    def call(index):
+        if index:
+            # Joins the leader's flight, then needs a call of its own
+            time.sleep(0.05)
+        return llm.chat_completion(MESSAGES, 'mock', temperature=0,
+                                   deadline=time.monotonic() + (0.1 if index == 0 else 5))
+
+    leader, follower = together(call, 2)
+    assert isinstance(leader, LLMDeadlineExceeded)
+    assert follower.choices[0].message.content
+    assert requests.requests == 2
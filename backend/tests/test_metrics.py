@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+import app as flask_app
+import metrics
+from metrics import COUNTER, HISTOGRAM, Registry
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    registry = Registry()
+    monkeypatch.setattr(metrics, 'registry', registry)
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    return registry
+
+
+def test_histogram_is_rendered_cumulatively(registry):
+    registry.define('latency_seconds', HISTOGRAM, 'Latency', (0.1, 1))
+    for value in (0.05, 0.5, 0.7, 3):
+        registry.observe('latency_seconds', value, route='/ai')
+
+    text = metrics.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{route="/ai",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/ai",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/ai",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/ai"} 4' in text
+    assert 'latency_seconds_sum{route="/ai"} 4.25' in text
+
+
+def test_snapshots_of_live_workers_are_merged(registry, tmp_path):
+    registry.define('runs_total', COUNTER, 'Runs')
+    registry.inc('runs_total', 2, kind='run')
+    other = {'runs_total': {'type': COUNTER, 'help': 'Runs', 'buckets': None, 'values': [[[['kind', 'run']], 3]]}}
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(other))
+    # A worker that exited no longer counts, and its snapshot is removed
+    dead = tmp_path / '999999999.json'
+    dead.write_text(json.dumps(other))
+
+    assert 'runs_total{kind="run"} 5' in metrics.render()
+    assert not dead.exists()
+
+
+def test_label_values_are_escaped(registry):
+    registry.define('errors_total', COUNTER, 'Errors')
+    registry.inc('errors_total', error='say "hi"\n')
+    assert 'errors_total{error="say \\"hi\\"\\n"} 1' in metrics.render()
+
+
+def test_collectors_read_stats_at_scrape_time(registry):
+    stats = {'hits': 1}
+    registry.add_collector(lambda: [('cache_hits_total', COUNTER, 'Hits', {'cache': 'run'}, stats['hits'])])
+    stats['hits'] = 7
+    assert 'cache_hits_total{cache="run"} 7' in metrics.render()
+
+
+def test_metrics_endpoint_counts_requests():
+    client = flask_app.app.test_client()
+    client.get('/run/stats')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'http_requests_total{' in response.get_data(as_text=True)
+    assert 'http_request_duration_seconds_bucket{' in response.get_data(as_text=True)
@@ -0,0 +1,34 @@
+from problem_parser import parse_problem, replace_example_outputs
+
+PROBLEM = """Title: Count Items
+Description: Return how many items there are.
+Output: an integer
+
+Examples:
+Example 1:
+Input: nums = [1, 2, 3]
+Output: 4
+Explanation: There are three items.
+Example 2: Input: nums = [1]
+Output: 1
+
+Constraints:
+- 1 <= len(nums) <= 10
+"""
+
+
+def test_replace_example_outputs_leaves_description_alone():
+    record = parse_problem(PROBLEM)
+    assert [example['output'] for example in record['examples']] == [4, 1]
+
+    repaired = replace_example_outputs(record['statement'], {0: '3'})
+
+    assert 'Output: an integer' in repaired
+    assert [example['output'] for example in parse_problem(repaired)['examples']] == [3, 1]
+
+
+def test_replace_example_outputs_on_header_line():
+    record = parse_problem(PROBLEM)
+    repaired = replace_example_outputs(record['statement'], {1: '2'})
+    assert 'Example 2: Input: nums = [1]\nOutput: 2\n' in repaired
+    assert [example['output'] for example in parse_problem(repaired)['examples']] == [4, 2]
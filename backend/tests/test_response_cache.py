@@ -0,0 +1,50 @@
+import time
+
+from response_cache import ResponseCache
+
+PROBLEM = "Return the sum of a list of numbers."
+CODE = "def total(nums):\n    return sum(nums)\n"
+QUESTION = "Why is my output wrong when the list is empty and I call total on it?"
+
+
+def test_exact_hit_ignores_formatting():
+    cache = ResponseCache()
+    cache.set('debug', PROBLEM, CODE, QUESTION, 'answer')
+
+    reformatted = "def total(nums):  # sum it\n\n    return sum( nums )\n"
+    assert cache.get('debug', PROBLEM, reformatted, '  ' + QUESTION.upper()) == 'answer'
+    assert cache.get('hint', PROBLEM, CODE, QUESTION) is None
+    assert cache.get('debug', PROBLEM, "def total(nums):\n    return 0\n", QUESTION) is None
+    assert cache.stats()['exact_hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.01)
+    cache.set('debug', PROBLEM, CODE, QUESTION, 'answer')
+    time.sleep(0.02)
+    assert cache.get('debug', PROBLEM, CODE, QUESTION) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(max_entries=2)
+    for index in range(3):
+        cache.set('debug', PROBLEM, CODE, f"question {index}", f"answer {index}")
+    assert cache.get('debug', PROBLEM, CODE, 'question 0') is None
+    assert cache.get('debug', PROBLEM, CODE, 'question 2') == 'answer 2'
+
+
+def test_near_duplicates_match_within_one_problem():
+    cache = ResponseCache(near_duplicates=True, similarity=0.7)
+    cache.set('debug', PROBLEM, CODE, QUESTION, 'answer')
+
+    assert cache.get('debug', PROBLEM, CODE, QUESTION.replace('Why', 'So why')) == 'answer'
+    assert cache.get('debug', "Return the product of a list.", CODE, QUESTION.replace('Why', 'So why')) is None
+    assert cache.get('debug', PROBLEM, CODE, "How do I make this faster for a million numbers?") is None
+    assert cache.stats()['near_hits'] == 1
+
+
+def test_near_duplicates_are_off_by_default():
+    cache = ResponseCache(near_duplicates=False)
+    cache.set('debug', PROBLEM, CODE, QUESTION, 'answer')
+    assert cache.get('debug', PROBLEM, CODE, QUESTION.replace('Why', 'So why')) is None
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import router
+from deadlines import DISCONNECT, RequestCancelled
+from llm import LLMOverloaded
+from router import DEEP, FAST, STANDARD, ModelRouter
+
+TIERS = {FAST: ('small',), STANDARD: ('large', 'other'), DEEP: ('other', 'large')}
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+
+
+class Upstream:
+    """Stands in for the gateway: per-model delays and errors, and the models called"""
+
+    def __init__(self, delays=None, errors=None):
+        self.delays = delays or {}
+        self.errors = errors or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _reply(self, model):
+        with self._lock:
+            self.calls.append(model)
+        if model in self.errors:
+            raise self.errors[model]
+        return SimpleNamespace(model=model, usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1))
+
+    def __call__(self, messages, model, **params):
+        time.sleep(self.delays.get(model, 0))
+        return self._reply(model)
+
+    async def async_call(self, messages, model, **params):
+        await asyncio.sleep(self.delays.get(model, 0))
+        return self._reply(model)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(router, 'chat_completion', upstream)
+    monkeypatch.setattr(router, 'async_chat_completion', upstream.async_call)
+    return upstream
+
+
+def test_tier_from_question_type_and_prompt_size():
+    model_router = ModelRouter(TIERS)
+    assert model_router.tier('concept', 100) == FAST
+    assert model_router.tier('concept', 1000) == STANDARD
+    assert model_router.tier('debug', 100) == DEEP
+    assert model_router.tier('general', router.ROUTER_DEEP_MIN_PROMPT_TOKENS) == DEEP
+
+
+def test_empty_tier_is_rejected():
+    with pytest.raises(ValueError):
+        ModelRouter({FAST: (), STANDARD: ('large',), DEEP: ('large',)})
+
+
+def test_failed_model_falls_back(upstream):
+    upstream.errors['large'] = RuntimeError('upstream 500')
+    model_router = ModelRouter(TIERS)
+
+    assert model_router.complete(MESSAGES, STANDARD, 'ai').model == 'other'
+    assert upstream.calls == ['large', 'other']
+    assert model_router.stats()['fallbacks'] == 1
+    assert model_router.stats()['models']['large']['errors'] == 1
+
+
+def test_overload_is_not_retried_on_another_model(upstream):
+    upstream.errors['large'] = LLMOverloaded('queue full')
+    with pytest.raises(LLMOverloaded):
+        ModelRouter(TIERS).complete(MESSAGES, STANDARD, 'ai')
+    assert upstream.calls == ['large']
+
+
+def test_failing_model_is_skipped(upstream):
+    model_router = ModelRouter(TIERS)
+    for _ in range(5):
+        model_router.observe('large', error=True)
+    assert model_router.candidates(STANDARD)[0] == 'other'
+    model_router.complete(MESSAGES, STANDARD, 'ai')
+    assert upstream.calls == ['other']
+
+
+def test_slow_call_is_hedged(upstream):
+    upstream.delays['large'] = 1.0
+    model_router = ModelRouter(TIERS)
+    for _ in range(router.ROUTER_HEDGE_MIN_SAMPLES):
+        model_router.observe('large', 0.05)
+        model_router.observe('other', 0.1)
+
+    started = time.monotonic()
+    assert model_router.complete(MESSAGES, STANDARD, 'ai').model == 'other'
+    assert time.monotonic() - started < 0.5
+    assert model_router.stats()['hedges'] == 1
+
+
+def test_async_call_is_hedged(upstream):
+    upstream.delays['large'] = 1.0
+    model_router = ModelRouter(TIERS)
+    for _ in range(router.ROUTER_HEDGE_MIN_SAMPLES):
+        model_router.observe('large', 0.05)
+        model_router.observe('other', 0.1)
+
+    response = asyncio.run(model_router.async_complete(MESSAGES, STANDARD, 'ai'))
+    assert response.model == 'other'
+    assert model_router.stats()['hedges'] == 1
+
+
+def test_async_failed_model_falls_back(upstream):
+    upstream.errors['large'] = RuntimeError('upstream 500')
+    response = asyncio.run(ModelRouter(TIERS).async_complete(MESSAGES, STANDARD, 'ai'))
+    assert response.model == 'other'
+
+
+def test_abandoned_call_stops_waiting(upstream):
+    upstream.delays['large'] = 2.0
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        ModelRouter(TIERS).complete(MESSAGES, STANDARD, 'ai', cancelled=lambda: DISCONNECT)
+    assert time.monotonic() - started < 1.0
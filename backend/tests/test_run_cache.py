@@ -0,0 +1,83 @@
+import pytest
+
+import app as flask_app
+from run_cache import RunCache, cacheable
+
+OK = {'success': True, 'output': '3\n', 'wall_ms': 12.0}
+
+
+def test_formatting_and_comments_share_an_entry():
+    cache = RunCache()
+    result, token = cache.get("print(1 + 2)")
+    assert result is None
+    cache.set(token, OK)
+
+    result, _ = cache.get("# sum\nprint( 1+2 )\n\n")
+    assert result == OK
+    assert cache.get("print(1 + 2)", stdin='5')[0] is None
+    assert cache.stats()['hits'] == 1
+
+
+@pytest.mark.parametrize('code', [
+    "import random\nprint(random.random())",
+    "import time\nprint(time.time())",
+    "from os import getpid\nprint(getpid())",
+    "print(open('/etc/hostname').read())",
+    "print(id(object()))",
+    "print(eval('1'))",
+    "print(().__class__.__subclasses__())",
+    "print(1 +",
+])
+def test_nondeterministic_code_is_never_cached(code):
+    cache = RunCache()
+    result, token = cache.get(code)
+    assert result is None and token is None
+    cache.set(token, OK)
+    assert cache.get(code)[0] is None
+    assert cache.stats()['uncacheable'] == 2
+
+
+def test_limits_and_crashes_are_not_cached():
+    assert cacheable(OK)
+    assert cacheable({'success': False, 'error': 'boom', 'traceback': 'ValueError: boom'})
+    assert not cacheable({'success': False, 'error': 'Time limit exceeded (10s wall clock)', 'traceback': ''})
+    assert not cacheable({'success': False, 'error': 'x', 'traceback': 'MemoryError'})
+    assert not cacheable({'success': False, 'error': 'Run cancelled', 'cancelled': 'deadline'})
+    assert not cacheable(dict(OK, truncated={'stdout': 10}))
+    assert not cacheable(dict(OK, output='<object object at 0x7f00>'))
+
+
+def test_results_quoting_lines_need_the_same_source():
+    cache = RunCache()
+    failed = {'success': False, 'error': 'boom', 'traceback': 'line 2'}
+    _, token = cache.get("x = 1\nraise ValueError('boom')")
+    cache.set(token, failed)
+
+    assert cache.get("x = 1\nraise ValueError('boom')")[0] == failed
+    assert cache.get("x = 1\n\nraise ValueError('boom')")[0] is None
+
+
+def test_memory_is_bounded():
+    cache = RunCache(max_entries=2)
+    for value in range(3):
+        _, token = cache.get(f"print({value})")
+        cache.set(token, OK)
+    assert cache.get("print(0)")[0] is None
+    assert cache.get("print(2)")[0] == OK
+    assert cache.stats()['evictions'] == 1
+
+    cache = RunCache(max_bytes=100)
+    _, token = cache.get("print('big')")
+    cache.set(token, dict(OK, output='x' * 200))
+    assert cache.stats()['entries'] == 0
+
+
+def test_repeated_run_is_answered_from_the_cache(monkeypatch):
+    monkeypatch.setattr(flask_app, 'run_cache', RunCache())
+    client = flask_app.app.test_client()
+    first = client.post('/run', json={'code': "print(sum(range(10)))"}).get_json()
+    second = client.post('/run', json={'code': "print(sum(range(10)))  # again"}).get_json()
+
+    assert first['output'] == second['output'] == '45\n'
+    assert 'cached' not in first and second['cached']
+    assert flask_app.run_cache.stats()['hits'] == 1
@@ -0,0 +1,55 @@
+import pytest
+
+import sandbox
+from sandbox import SandboxPool
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = SandboxPool(size=1)
+    yield pool
+    pool.close()
+
+
+def test_output_past_the_cap_is_dropped(pool):
+    result = pool.run("for i in range(100000):\n    print('x' * 100)\n")
+    assert result['success']
+    assert len(result['output']) < sandbox.SANDBOX_STDOUT_BYTES + 100
+    assert result['truncated']['stdout'] > 0
+    assert 'output truncated' in result['output']
+
+
+def test_huge_exception_message_is_cut_in_the_child(pool):
+    result = pool.run("raise Exception('x' * 10 ** 7)")
+    assert not result['success']
+    assert len(result['error']) < 2 * sandbox._ERROR_CHARS
+    assert len(result['traceback']) < 2 * sandbox._ERROR_CHARS
+    assert 'more characters not shown' in result['error']
+
+
+def test_huge_case_error_is_cut(pool):
+    result = pool.run_batch("def solve(n):\n    raise ValueError('y' * 10 ** 7)\n", [{'args': '1', 'expected': '1'}])
+    case = result['cases'][0]
+    assert case['verdict'] == 'runtime_error'
+    assert len(case['error']) < 2 * sandbox._ERROR_CHARS
+
+
+def test_result_past_the_cap_fails_the_run(pool):
+    cases = [{'input': '', 'expected_output': 'z' * sandbox.SANDBOX_RESULT_BYTES}]
+    result = pool.run_batch("print('z')", cases)
+    assert not result['success']
+    assert 'Result too large' in result['error']
+
+
+def test_cpu_limit(pool):
+    result = pool.run("import itertools\nfor i in itertools.count():\n    pass\n", cpu_seconds=1)
+    assert not result['success']
+    assert 'CPU time limit' in result['error']
+
+
+def test_child_that_closes_its_pipes_is_killed_at_the_wall_limit(pool):
+    code = "import os, time\nfor fd in (1, 2, 3):\n    os.close(fd)\ntime.sleep(60)\n"
+    result = pool.run(code, wall_seconds=1)
+    assert not result['success']
+    assert 'Time limit exceeded' in result['error']
+    assert result['wall_ms'] < 5000
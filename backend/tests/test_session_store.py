@@ -0,0 +1,42 @@
+import multiprocessing
+
+from session_store import SQLiteSessionStore
+
+ATTEMPTS = 50
+
+
+def _solve_and_ask(path, worker):
+    store = SQLiteSessionStore(path, history_limit=1000)
+
+    def solve(progress):
+        progress['easy_solved'] += 1
+
+    for attempt in range(ATTEMPTS):
+        store.update_progress('student', solve)
+        store.append_history('student', f"question {worker}-{attempt}", 'answer')
+    store.flush()
+
+
+def test_two_processes_updating_one_user_lose_nothing(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    SQLiteSessionStore(path)
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_solve_and_ask, args=(path, worker)) for worker in range(2)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+        assert process.exitcode == 0
+
+    store = SQLiteSessionStore(path, history_limit=1000)
+    assert store.get_progress('student')['easy_solved'] == 2 * ATTEMPTS
+    assert len(store.get_history('student')) == 2 * ATTEMPTS
+
+
+def test_history_keeps_the_newest_interactions(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), history_limit=3)
+    for index in range(5):
+        store.append_history('student', f"question {index}", 'answer')
+    assert [entry['question'] for entry in store.get_history('student')] == ['question 2', 'question 3', 'question 4']
+    store.flush()
+    assert [entry['question'] for entry in store.get_history('student')] == ['question 2', 'question 3', 'question 4']
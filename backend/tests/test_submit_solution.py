@@ -0,0 +1,102 @@
+import pytest
+
+import app as flask_app
+from problem_parser import ProblemIndex
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+PROBLEM = """Title: Count Items
+Description: Return how many items there are.
+
+Examples:
+Example 1:
+Input: nums = [1, 2, 3]
+Output: 3
+Example 2:
+Input: nums = [1]
+Output: 1
+"""
+
+SOLUTION = "def count_items(nums):\n    return len(nums)\n"
+WRONG = "def count_items(nums):\n    return 0\n"
+# Cases a client could send to pass anything
+PASS_ANYTHING = [{'input': '', 'expected_output': None}]
+
+
+@pytest.fixture
+def attempts(monkeypatch):
+    """Progress updates made by the requests, instead of touching the session store"""
+    recorded = []
+
+    def update_user_progress(user_id, difficulty, category=None, concept=None, solved=True):
+        recorded.append(solved)
+        return {'current_difficulty': difficulty}
+
+    monkeypatch.setattr(flask_app, 'update_user_progress', update_user_progress)
+    monkeypatch.setattr(flask_app, 'progress_payload', lambda progress: progress)
+    monkeypatch.setattr(flask_app, 'problem_index', ProblemIndex())
+    monkeypatch.setattr(flask_app, 'session_store', MemorySessionStore())
+    return recorded
+
+
+def submit(**data):
+    response = flask_app.app.test_client().post('/submit-solution', json={'user_id': 'student', **data})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_stored_problem_is_graded_on_its_own_cases(attempts):
+    problem_id = flask_app.problem_index.add(PROBLEM)['hash']
+
+    result = submit(code=SOLUTION, problem_id=problem_id)
+    assert result['correct'] and result['graded']
+    assert result['total'] == 2
+
+    result = submit(code=WRONG, problem_id=problem_id, cases=PASS_ANYTHING)
+    assert not result['correct']
+    assert result['total'] == 2
+    assert attempts == [True, False]
+
+
+def test_no_test_cases_is_ungraded(attempts):
+    result = submit(code="print('hello')")
+    assert result['success']
+    assert not result['correct'] and not result['graded']
+    assert 'progress' not in result
+    assert attempts == []
+
+
+def test_rejected_problem_is_ungraded(attempts):
+    record = flask_app.problem_index.add(PROBLEM)
+    record['test_cases'] = []
+
+    result = submit(code=WRONG, problem_id=record['hash'], cases=PASS_ANYTHING)
+    assert not result['correct'] and not result['graded']
+    assert attempts == []
+
+
+def test_unknown_problem_is_not_parsed_from_the_request(attempts):
+    problem_id = ProblemIndex().add(PROBLEM)['hash']
+
+    result = submit(code=SOLUTION, problem_id=problem_id, problem=PROBLEM)
+    assert not result['graded']
+    assert attempts == []
+
+
+def test_problem_checked_by_another_worker_is_graded(attempts, monkeypatch, tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'))
+    monkeypatch.setattr(flask_app, 'session_store', store)
+    monkeypatch.setattr(flask_app, 'PROBLEM_VERIFY', False)
+    problem_id = flask_app.check_problem(PROBLEM, ('arrays', 'counting', 'easy'))[1]['hash']
+    # This worker never saw it
+    monkeypatch.setattr(flask_app, 'problem_index', ProblemIndex())
+
+    result = submit(code=WRONG, problem_id=problem_id, cases=PASS_ANYTHING)
+    assert result['graded'] and not result['correct']
+    assert result['total'] == 2
+    assert attempts == [False]
+
+
+def test_invalid_timeout_is_rejected(attempts):
+    response = flask_app.app.test_client().post('/submit-solution', json={'code': SOLUTION, 'timeout': 'soon'})
+    assert response.status_code == 400
+    assert attempts == []
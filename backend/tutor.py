@@ -1,26 +1,48 @@
 import os
-from dotenv import load_dotenv
-import groq
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Get environment variables
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-
-# Debug print
-print(f"Loaded GROQ_API_KEY: {GROQ_API_KEY}")
-
-# Initialize Groq client
-client = groq.Client(api_key=GROQ_API_KEY)
-
-# Define specialized prompt templates
-DEBUG_TEMPLATE = """You are a helpful coding tutor. A student is having trouble with this code:
-
-Problem: {problem}
-Code: {code}
-Error/Issue: {question}
+import re
+import threading
+from router import router
+from deadlines import RequestCancelled
+from llm import LLMDeadlineExceeded
+from response_cache import ResponseCache
+from intent import IntentClassifier
+from code_analysis import analyze, format_hints, STATIC_ANALYSIS
+
+# Cache of tutor answers shared by all requests in this process
+response_cache = ResponseCache()
+
+# Answers greetings, thanks and generic learning requests without the model;
+# trained on first use (or by the worker warmup) rather than at import
+_intent_classifier = None
+_intent_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier():
+    """Return the shared intent classifier, training it on first use"""
+    global _intent_classifier
+    if _intent_classifier is None:
+        with _intent_classifier_lock:
+            if _intent_classifier is None:
+                _intent_classifier = IntentClassifier()
+    return _intent_classifier
+
+
+# Token budget for the assembled tutor messages (the model's window is 8192,
+# leaving room for the 1024-token completion)
+TUTOR_PROMPT_TOKEN_BUDGET = int(os.getenv('TUTOR_PROMPT_TOKEN_BUDGET', 3000))
+# Largest share of the budget the student's code or the problem may take
+CODE_TOKEN_SHARE = 0.4
+PROBLEM_TOKEN_SHARE = 0.25
+# Words kept from each older question when history is summarized
+SUMMARY_WORDS = 12
+
+# Prefix of the message get_groq_response returns when the call fails
+GROQ_ERROR_PREFIX = "Error getting Groq response"
+
+# Fixed system prompt per question type. Nothing request-specific goes in
+# here, so every request of a type shares the same prefix and can hit the
+# upstream prompt cache.
+DEBUG_SYSTEM_PROMPT = """You are a helpful coding tutor. A student is having trouble with their code for a problem. You will be given the problem, then the conversation so far, then the student's current code and the error or issue they are seeing. Problems found by static analysis of the code, if any, are listed after it; they are reliable, so start from them.
 
 IMPORTANT: For acknowledgments like "thanks", "thank you", "ok thanks", etc., respond with ONLY "You're welcome!" and nothing else.
 
@@ -57,11 +79,7 @@ print(example_function(test_input))  # Actual output: [actual output]
 
 Be direct and answer only what's asked. If more information is needed, ask for it. Remember previous interactions to maintain context."""
 
-EXPLAIN_TEMPLATE = """You are a helpful coding tutor. A student needs help understanding this problem:
-
-Problem: {problem}
-Code: {code}
-Question: {question}
+EXPLAIN_SYSTEM_PROMPT = """You are a helpful coding tutor. A student needs help understanding a problem. You will be given the problem, then the conversation so far, then the student's current code and their question.
 
 IMPORTANT: For acknowledgments like "thanks", "thank you", "ok thanks", etc., respond with ONLY "You're welcome!" and nothing else.
 
@@ -98,11 +116,7 @@ print(example_function(test_input))  # Actual output: [actual output]
 
 Be direct and answer only what's asked. If more information is needed, ask for it. Remember previous interactions to maintain context."""
 
-CONCEPT_TEMPLATE = """You are a helpful coding tutor. A student is working on this problem:
-
-Problem: {problem}
-Code: {code}
-Question: {question}
+CONCEPT_SYSTEM_PROMPT = """You are a helpful coding tutor. A student is working on a problem. You will be given the problem, then the conversation so far, then the student's current code and their question.
 
 IMPORTANT: For acknowledgments like "thanks", "thank you", "ok thanks", etc., respond with ONLY "You're welcome!" and nothing else.
 
@@ -139,15 +153,7 @@ print(example_function(test_input))  # Actual output: [actual output]
 
 Be direct and answer only what's asked. If more information is needed, ask for it. Remember previous interactions to maintain context."""
 
-GENERAL_TEMPLATE = """You are a helpful coding tutor. A student asked:
-
-{question}
-
-About this problem:
-{problem}
-
-Their code:
-{code}
+GENERAL_SYSTEM_PROMPT = """You are a helpful coding tutor. A student has a question about a problem. You will be given the problem, then the conversation so far, then the student's current code and their question.
 
 IMPORTANT: For acknowledgments like "thanks", "thank you", "ok thanks", etc., respond with ONLY "You're welcome!" and nothing else.
 
@@ -184,71 +190,342 @@ print(example_function(test_input))  # Actual output: [actual output]
 
 Be direct and answer only what's asked. If more information is needed, ask for it. Remember previous interactions to maintain context."""
 
-def format_history(history):
-    """Format conversation history for the prompt"""
-    if not history:
-        return "No previous conversation."
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Running totals of what build_tutor_messages produced and what the API reported
+_prompt_stats_lock = threading.Lock()
+_prompt_stats = {
+    'prompts': 0,
+    'prompt_tokens': 0,
+    'max_prompt_tokens': 0,
+    'history_turns': 0,
+    'summarized_turns': 0,
+    'dropped_turns': 0,
+    'truncated_code': 0,
+    'truncated_problems': 0,
+    'static_analysis_hints': 0,
+    'upstream_prompt_tokens': 0,
+    'cached_prompt_tokens': 0,
+    'completion_tokens': 0
+}
+
+def count_tokens(text):
+    """Estimate the number of model tokens in ``text`` without a tokenizer.
+
+    Words and punctuation marks count as one token each, and long words
+    count one token per four characters, which tracks the Llama 3 BPE
+    closely for English and Python source.
+    """
+    return sum(max(1, len(token) // 4) for token in _TOKEN_RE.findall(text or ''))
+
+def truncate_middle(text, max_tokens, label='lines'):
+    """Cut the middle out of ``text`` so that it fits ``max_tokens``"""
+    if count_tokens(text) <= max_tokens:
+        return text, False
     
-    formatted = []
-    for i, interaction in enumerate(history, 1):
-        formatted.append(f"Q{i}: {interaction['question']}")
-        formatted.append(f"A{i}: {interaction['response']}")
-    return "\n".join(formatted)
-
-def get_groq_response(prompt):
+    lines = text.splitlines()
+    if len(lines) < 3:
+        # One huge line: fall back to characters (about four per token)
+        keep = max_tokens * 4 // 2
+        return f"{text[:keep]}\n... [truncated] ...\n{text[-keep:]}", True
+    
+    # Keep the start (definitions) and the end (where the call/error usually is)
+    head, tail = [], []
+    head_budget, tail_budget = max_tokens * 0.6, max_tokens * 0.4
+    for line in lines:
+        head_budget -= count_tokens(line) + 1
+        if head_budget < 0:
+            break
+        head.append(line)
+    for line in reversed(lines[len(head):]):
+        tail_budget -= count_tokens(line) + 1
+        if tail_budget < 0:
+            break
+        tail.append(line)
+    tail.reverse()
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"... [{omitted} {label} omitted] ..."] + tail), True
+
+def summarize_turn(interaction):
+    """One-line reminder of an older question (its answer is dropped)"""
+    words = interaction['question'].split()
+    summary = ' '.join(words[:SUMMARY_WORDS])
+    return summary + ('...' if len(words) > SUMMARY_WORDS else '')
+
+def fit_history(history, budget):
+    """Pick as much recent history as fits ``budget`` tokens.
+
+    The newest turns are kept verbatim; older turns that don't fit are
+    reduced to a one-line summary of the question, and dropped entirely
+    once even the summaries run out of room. Returns the kept turns, the
+    summaries and the number of dropped turns.
+    """
+    kept = []
+    remaining = budget
+    index = len(history)
+    while index > 0:
+        interaction = history[index - 1]
+        # A few tokens per message go to the chat format itself
+        cost = count_tokens(interaction['question']) + count_tokens(interaction['response']) + 8
+        if cost > remaining:
+            break
+        kept.append(interaction)
+        remaining -= cost
+        index -= 1
+    kept.reverse()
+    
+    summaries = []
+    while index > 0:
+        summary = summarize_turn(history[index - 1])
+        cost = count_tokens(summary) + 2
+        if cost > remaining:
+            break
+        summaries.append(summary)
+        remaining -= cost
+        index -= 1
+    summaries.reverse()
+    
+    return kept, summaries, index
+
+def _usage_value(obj, *path):
+    """Read a nested usage field that may be an attribute or a dict key"""
+    for name in path:
+        if obj is None:
+            return None
+        obj = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+    return obj
+
+def record_usage(usage):
+    """Add the token usage reported by the API to the running totals"""
+    if usage is None:
+        return
+    cached = _usage_value(usage, 'prompt_tokens_details', 'cached_tokens') or 0
+    with _prompt_stats_lock:
+        _prompt_stats['upstream_prompt_tokens'] += _usage_value(usage, 'prompt_tokens') or 0
+        _prompt_stats['cached_prompt_tokens'] += cached
+        _prompt_stats['completion_tokens'] += _usage_value(usage, 'completion_tokens') or 0
+
+def prompt_stats():
+    """Running totals of prompt sizes, compaction and upstream prompt caching"""
+    with _prompt_stats_lock:
+        stats = dict(_prompt_stats)
+    stats['avg_prompt_tokens'] = round(stats['prompt_tokens'] / stats['prompts'], 1) if stats['prompts'] else 0.0
+    upstream = stats['upstream_prompt_tokens']
+    stats['cached_prompt_ratio'] = round(stats['cached_prompt_tokens'] / upstream, 4) if upstream else 0.0
+    return stats
+
+# Sampling settings shared by the sync and async tutor paths; the model is
+# picked per request by the router
+GROQ_PARAMS = {
+    'temperature': 0.7,
+    'max_tokens': 1024
+}
+
+def get_groq_response(messages, question_type='general', prompt_tokens=0, deadline=None):
     """Get response directly from Groq API"""
     try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1024
-        )
+        tier = router.tier(question_type, prompt_tokens)
+        params = deadline.llm_params() if deadline is not None else {}
+        response = router.complete(messages, tier, 'tutor', **GROQ_PARAMS, **params)
+        record_usage(response.usage)
         return response.choices[0].message.content
+    except (LLMDeadlineExceeded, RequestCancelled):
+        # Nobody would read an error reply; the route answers these itself
+        raise
     except Exception as e:
-        return f"Error getting Groq response: {str(e)}"
+        return f"{GROQ_ERROR_PREFIX}: {str(e)}"
 
-def get_tutor_response(question_type, problem, code, question, history=None):
-    """Get response from the appropriate tutor chain"""
+async def async_get_groq_response(messages, question_type='general', prompt_tokens=0, deadline=None):
+    """``get_groq_response`` through the async gateway"""
     try:
-        # Format history for the prompt
-        formatted_history = format_history(history or [])
-        
-        # Check if it's a greeting
-        if question.lower().strip() in ['hi', 'hello', 'hey']:
-            return "Hi!"
+        tier = router.tier(question_type, prompt_tokens)
+        params = deadline.llm_params(watch=False) if deadline is not None else {}
+        response = await router.async_complete(messages, tier, 'tutor', **GROQ_PARAMS, **params)
+        record_usage(response.usage)
+        return response.choices[0].message.content
+    except LLMDeadlineExceeded:
+        raise
+    except Exception as e:
+        return f"{GROQ_ERROR_PREFIX}: {str(e)}"
+
+def stream_groq_response(messages, question_type='general', prompt_tokens=0, deadline=None):
+    """Yield response tokens from the Groq API as they arrive"""
+    # A disconnect shows up as the stream being closed, so only the deadline is passed on
+    params = deadline.llm_params(watch=False) if deadline is not None else {}
+    stream = router.stream(messages, router.tier(question_type, prompt_tokens), 'tutor', **GROQ_PARAMS, **params)
+    try:
+        for chunk in stream:
+            # Groq reports usage on the final chunk
+            record_usage(_usage_value(chunk, 'x_groq', 'usage'))
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+    finally:
+        # Release the upstream slot if the client went away mid-stream
+        stream.close()
+
+async def async_stream_groq_response(messages, question_type='general', prompt_tokens=0, deadline=None):
+    """``stream_groq_response`` through the async gateway"""
+    params = deadline.llm_params(watch=False) if deadline is not None else {}
+    stream = await router.async_stream(messages, router.tier(question_type, prompt_tokens), 'tutor',
+                                       **GROQ_PARAMS, **params)
+    try:
+        async for chunk in stream:
+            record_usage(_usage_value(chunk, 'x_groq', 'usage'))
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+    finally:
+        await stream.aclose()
+
+def get_system_prompt(question_type):
+    """Fixed system prompt for the question type"""
+    if question_type == 'debug':
+        return DEBUG_SYSTEM_PROMPT
+    elif question_type == 'explain':
+        return EXPLAIN_SYSTEM_PROMPT
+    elif question_type == 'concept':
+        return CONCEPT_SYSTEM_PROMPT
+    return GENERAL_SYSTEM_PROMPT
+
+def build_tutor_messages(question_type, problem, code, question, history=None, budget=TUTOR_PROMPT_TOKEN_BUDGET):
+    """Build the chat messages for a tutor request within ``budget`` tokens.
+
+    Messages go from most to least shared so upstream prompt caching can
+    reuse the longest possible prefix: the fixed system prompt for the
+    question type, then the problem, then the conversation so far, and
+    finally this turn's code and question.
+
+    Returns the messages and a dict of the token counts they were built from.
+    """
+    system_prompt = get_system_prompt(question_type)
+    
+    # Syntax errors, unbound names and the like are found locally, so the model needn't hunt for them
+    findings = analyze(code) if question_type == 'debug' and code and STATIC_ANALYSIS else []
+    
+    # Oversized code or problem text gets its middle cut out
+    code, code_truncated = truncate_middle(code, int(budget * CODE_TOKEN_SHARE))
+    problem, problem_truncated = truncate_middle(problem, int(budget * PROBLEM_TOKEN_SHARE))
+    
+    issue_label = 'Error/Issue' if question_type == 'debug' else 'Question'
+    context = f"Problem: {problem}"
+    turn = f"Code: {code}\n{issue_label}: {question}"
+    if findings:
+        turn = f"Code: {code}\nStatic analysis:\n{format_hints(findings)}\n{issue_label}: {question}"
+    
+    # Whatever is left goes to the conversation history
+    base_tokens = count_tokens(system_prompt) + count_tokens(context) + count_tokens(turn)
+    kept, summaries, dropped_turns = fit_history(history or [], max(0, budget - base_tokens))
+    
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": context}
+    ]
+    if summaries:
+        messages.append({"role": "user", "content": "Earlier questions: " + "; ".join(summaries)})
+    for interaction in kept:
+        messages.append({"role": "user", "content": interaction['question']})
+        messages.append({"role": "assistant", "content": interaction['response']})
+    messages.append({"role": "user", "content": turn})
+    
+    prompt_tokens = sum(count_tokens(message['content']) for message in messages)
+    usage = {
+        'prompt_tokens': prompt_tokens,
+        'budget': budget,
+        'history_tokens': prompt_tokens - base_tokens,
+        'history_turns': len(kept),
+        'summarized_turns': len(summaries),
+        'dropped_turns': dropped_turns,
+        'code_truncated': code_truncated,
+        'problem_truncated': problem_truncated,
+        'static_analysis_hints': len(findings)
+    }
+    with _prompt_stats_lock:
+        _prompt_stats['prompts'] += 1
+        _prompt_stats['prompt_tokens'] += prompt_tokens
+        _prompt_stats['max_prompt_tokens'] = max(_prompt_stats['max_prompt_tokens'], prompt_tokens)
+        _prompt_stats['history_turns'] += len(kept)
+        _prompt_stats['summarized_turns'] += len(summaries)
+        _prompt_stats['dropped_turns'] += dropped_turns
+        _prompt_stats['truncated_code'] += int(code_truncated)
+        _prompt_stats['truncated_problems'] += int(problem_truncated)
+        _prompt_stats['static_analysis_hints'] += len(findings)
+    return messages, usage
+
+def ready_response(question_type, problem, code, question):
+    """A reply that needs no model call (canned or cached), or ``None``"""
+    # Greetings, thanks and the like get a fixed reply
+    canned = get_intent_classifier().canned_response(question)
+    if canned is not None:
+        return canned
+    return response_cache.get(question_type, problem, code, question)
+
+def get_tutor_response(question_type, problem, code, question, history=None, deadline=None):
+    """Get response from the appropriate tutor chain; ``deadline`` is the request's ``Deadline``"""
+    try:
+        ready = ready_response(question_type, problem, code, question)
+        if ready is not None:
+            return ready
         
-        # Select the appropriate template based on question type
-        if question_type == 'debug':
-            prompt = DEBUG_TEMPLATE.format(
-                history=formatted_history,
-                problem=problem,
-                code=code,
-                question=question
-            )
-        elif question_type == 'explain':
-            prompt = EXPLAIN_TEMPLATE.format(
-                history=formatted_history,
-                problem=problem,
-                code=code,
-                question=question
-            )
-        elif question_type == 'concept':
-            prompt = CONCEPT_TEMPLATE.format(
-                history=formatted_history,
-                problem=problem,
-                code=code,
-                question=question
-            )
-        else:
-            prompt = GENERAL_TEMPLATE.format(
-                history=formatted_history,
-                problem=problem,
-                code=code,
-                question=question
-            )
+        messages, usage = build_tutor_messages(question_type, problem, code, question, history)
+        response = get_groq_response(messages, question_type, usage['prompt_tokens'], deadline).strip()
+        if not response.startswith(GROQ_ERROR_PREFIX):
+            response_cache.set(question_type, problem, code, question, response)
+        return response
+    except (LLMDeadlineExceeded, RequestCancelled):
+        raise
+    except Exception as e:
+        return f"Error getting tutor response: {str(e)}"
+
+async def async_get_tutor_response(question_type, problem, code, question, history=None, deadline=None):
+    """``get_tutor_response`` for the ASGI app"""
+    try:
+        ready = ready_response(question_type, problem, code, question)
+        if ready is not None:
+            return ready
         
-        response = get_groq_response(prompt)
-        return response.strip()
+        messages, usage = build_tutor_messages(question_type, problem, code, question, history)
+        response = (await async_get_groq_response(messages, question_type, usage['prompt_tokens'], deadline)).strip()
+        if not response.startswith(GROQ_ERROR_PREFIX):
+            response_cache.set(question_type, problem, code, question, response)
+        return response
+    except LLMDeadlineExceeded:
+        raise
     except Exception as e:
-        return f"Error getting tutor response: {str(e)}" 
\ No newline at end of file
+        return f"Error getting tutor response: {str(e)}"
+
+def stream_tutor_response(question_type, problem, code, question, history=None, deadline=None):
+    """Stream the tutor response token by token"""
+    ready = ready_response(question_type, problem, code, question)
+    if ready is not None:
+        yield ready
+        return
+    
+    messages, usage = build_tutor_messages(question_type, problem, code, question, history)
+    tokens = []
+    for token in stream_groq_response(messages, question_type, usage['prompt_tokens'], deadline):
+        tokens.append(token)
+        yield token
+    response = ''.join(tokens).strip()
+    if response:
+        response_cache.set(question_type, problem, code, question, response)
+
+async def async_stream_tutor_response(question_type, problem, code, question, history=None, deadline=None):
+    """``stream_tutor_response`` for the ASGI app"""
+    ready = ready_response(question_type, problem, code, question)
+    if ready is not None:
+        yield ready
+        return
+    
+    messages, usage = build_tutor_messages(question_type, problem, code, question, history)
+    tokens = []
+    async for token in async_stream_groq_response(messages, question_type, usage['prompt_tokens'], deadline):
+        tokens.append(token)
+        yield token
+    response = ''.join(tokens).strip()
+    if response:
+        response_cache.set(question_type, problem, code, question, response)
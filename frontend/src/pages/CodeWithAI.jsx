@@ -10,6 +10,7 @@ const CodeWithAI = () => {
   const [code, setCode] = useState('');
   const [output, setOutput] = useState('');
   const [currentProblem, setCurrentProblem] = useState(null);
+  const [problemId, setProblemId] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [chatHistory, setChatHistory] = useState([]);
@@ -44,6 +45,7 @@ const CodeWithAI = () => {
       
       if (data.success) {
         setCurrentProblem(data.question);
+        setProblemId(data.problem_id);
         setCurrentDifficulty(data.difficulty);
         setCode('');
         setOutput('');
@@ -94,37 +96,34 @@ const CodeWithAI = () => {
         return;
       }
 
-      // First run the code to check if it works
-      const runResponse = await fetch(`${API_URL}/run`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ code }),
-      });
-      
-      const runData = await runResponse.json();
-      if (!runData.success) {
-        setOutput(`Error: ${runData.error}\n${runData.traceback || ''}`);
-        return;
-      }
-
-      // If code runs successfully, update progress
-      const progressResponse = await fetch(`${API_URL}/update-progress`, {
+      // Run the code and record progress in a single request
+      const submitResponse = await fetch(`${API_URL}/submit-solution`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({ 
+          code,
           user_id: 'user_123',
-          difficulty: currentDifficulty
+          difficulty: currentDifficulty,
+          problem_id: problemId,
+          problem: currentProblem
         }),
       });
       
-      const progressData = await progressResponse.json();
-      if (progressData.success) {
-        setProgress(progressData.progress);
-        setCurrentDifficulty(progressData.current_difficulty);
+      const submitData = await submitResponse.json();
+      if (!submitData.success) {
+        setOutput(`Error: ${submitData.error}\n${submitData.traceback || ''}`);
+        return;
+      }
+      if (!submitData.correct) {
+        setOutput(submitData.message);
+        return;
+      }
+
+      if (submitData.progress) {
+        setProgress(submitData.progress);
+        setCurrentDifficulty(submitData.current_difficulty);
         setSolvedProblems(prev => prev + 1);
         
         // Add success message to chat